@@ -21,7 +21,8 @@ from app.ui_markets_streamlit import (
     delete_market_page,
     add_review_page,
     delete_review_page,
-    render_markets_by_category
+    render_markets_by_category,
+    nearest_markets_page
 )
 
 st.set_page_config(page_title="Farmer Markets — Streamlit", layout="wide")
@@ -61,6 +62,7 @@ MENU = [
     (7, "Поиск по радиусу (30 миль)"),
     (8, "Удалить рынок"),
     (9, "Показать рынки по категории"),
+    (10, "Ближайшие рынки (K штук)"),
     (0, "Выход"),
 ]
 
@@ -96,6 +98,9 @@ def page_delete_market():
 def page_by_category():
     render_markets_by_category()
 
+def page_nearest():
+    nearest_markets_page()
+
 def page_exit():
     st.header("0. Выход")
     st.warning("В веб-версии Streamlit пункт «Выход» ничего не делает. Можно просто закрыть вкладку браузера.")
@@ -111,6 +116,7 @@ PAGE_ROUTER = {
     7: page_radius,
     8: page_delete_market,
     9: page_by_category,
+    10: page_nearest,
     0: page_exit,
 }
 
@@ -1,5 +1,6 @@
 from .db import execute_query  # импортируем функцию для выполнения SQL-запросов
 from .utils import paginate    # импортируем функцию пагинации (переход между страницами)
+from .totals import count_total  # число рынков категории (запоминается, не пересчитывается на каждой странице)
 
 
 def show_markets_by_category():
@@ -57,7 +58,7 @@ def show_markets_by_category():
             JOIN market_categories mc ON mc.market_id = m.id
             WHERE mc.category_id = %s
         """
-        total = execute_query(count_query, (category_id,), fetch=True)[0]['count']
+        total = count_total(count_query, (category_id,))
 
         # Вложенный цикл — постраничный просмотр результатов
         while True:
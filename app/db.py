@@ -15,25 +15,184 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'setup'))
 
 # Импортируем словарь DB_CONFIG из файла config.py
 # В нем хранятся настройки подключения к базе данных (хост, порт, имя базы и т.д.)
-from setup.config import DB_CONFIG
+# DB_POOL_CONFIG — настройки пула соединений (размер, время жизни и т.д.)
+from setup.config import DB_CONFIG, DB_POOL_CONFIG
+
+import atexit
+import itertools
+import threading
+import time
+from contextlib import contextmanager
 
 # Импортируем библиотеку для работы с PostgreSQL
 import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 # RealDictCursor нужен для того, чтобы результаты запроса возвращались в виде словаря
 # (ключи — это названия колонок, значения — данные)
 from psycopg2.extras import RealDictCursor
 
 
+class ConnectionPool:
+    """
+    Пул соединений с PostgreSQL, общий для всего процесса.
+
+    Раньше каждый execute_query открывал новое соединение (TCP + авторизация +
+    запуск backend-процесса на сервере), а на одну страницу Streamlit/CLI
+    приходится несколько запросов. Пул держит соединения открытыми и выдаёт их повторно.
+
+    Поверх ThreadedConnectionPool из psycopg2 добавлено:
+    - ожидание свободного соединения (вместо ошибки, когда все заняты);
+    - проверка SELECT 1 при выдаче, если соединение долго простаивало;
+    - пересоздание соединения после max_uses выдач или max_lifetime секунд;
+    - откат незавершённой/упавшей транзакции при возврате в пул.
+    """
+
+    def __init__(self, min_size, max_size, max_uses, max_lifetime, check_idle, timeout, **connect_kwargs):
+        self.max_uses = max_uses
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self.timeout = timeout
+        self._pool = ThreadedConnectionPool(min_size, max_size, **connect_kwargs)
+        # Семафор ограничивает число выданных соединений: лишние потоки ждут, а не падают
+        self._slots = threading.BoundedSemaphore(max_size)
+        # Служебные данные по соединениям: id(conn) -> {"created", "uses", "last_used"}
+        self._info = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, conn):
+        with self._lock:
+            return self._info.setdefault(id(conn), {"created": time.monotonic(), "uses": 0, "last_used": time.monotonic()})
+
+    def _discard(self, conn):
+        with self._lock:
+            self._info.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _is_healthy(self, conn, stats):
+        """
+        Соединение живо и не пора ли его пересоздать.
+        """
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if stats["uses"] >= self.max_uses or now - stats["created"] >= self.max_lifetime:
+            return False
+        if now - stats["last_used"] >= self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def getconn(self):
+        """
+        Выдаёт проверенное соединение. Если все заняты — ждёт до timeout секунд.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"нет свободного соединения за {self.timeout} с")
+        try:
+            # Несколько попыток: пул может отдавать «протухшие» соединения одно за другим
+            for _ in range(self._pool.maxconn + 1):
+                conn = self._pool.getconn()
+                stats = self._stats(conn)
+                if self._is_healthy(conn, stats):
+                    stats["uses"] += 1
+                    return conn
+                self._discard(conn)
+            raise PoolError("не удалось получить рабочее соединение")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """
+        Возвращает соединение в пул. Незавершённую транзакцию откатываем,
+        чтобы следующий пользователь получил «чистое» соединение.
+        """
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._discard(conn)
+                    return
+            self._stats(conn)["last_used"] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+# Пул создаётся при первом обращении. Запоминаем pid: после fork (например,
+# multiprocessing) дочерний процесс не должен пользоваться соединениями родителя.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Возвращает пул соединений текущего процесса (создаёт при первом вызове).
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(**DB_POOL_CONFIG, **DB_CONFIG)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    """
+    Закрывает все соединения пула (вызывается автоматически при выходе).
+    """
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.closeall()
+    _pool = None
+
+
+atexit.register(close_pool)
+
+
+@contextmanager
 def get_connection():
     """
-    Функция создает подключение к базе данных PostgreSQL.
-    Возвращает объект соединения conn.
+    Выдаёт соединение из пула на время блока with и возвращает его обратно.
+
+        with get_connection() as conn:
+            ...
+
+    Как и раньше с psycopg2, при успешном выходе из блока транзакция фиксируется,
+    при исключении — откатывается.
 
     Почему отдельная функция?
     - Чтобы в любом месте кода можно было просто вызвать get_connection()
       и получить готовое подключение.
     """
-    return psycopg2.connect(**DB_CONFIG)  # **DB_CONFIG разворачивает словарь в аргументы
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass  # сломанное соединение пул сам выбросит в putconn
+        raise
+    finally:
+        pool.putconn(conn)
 
 
 def execute_query(query, params=None, fetch=False):
@@ -46,7 +205,7 @@ def execute_query(query, params=None, fetch=False):
     :return: список словарей с результатами (если fetch=True) или None
     """
 
-    # 1. Создаем подключение к базе данных
+    # 1. Берем подключение из пула (новое соединение открывается только при необходимости)
     with get_connection() as conn:
 
         # 2. Создаем курсор для выполнения запросов
@@ -68,3 +227,37 @@ def execute_query(query, params=None, fetch=False):
 
     # 6. Возвращаем результат (или None)
     return result
+
+
+# Размер порции по умолчанию для iter_query (строк за один запрос к серверу)
+DEFAULT_ITERSIZE = 2000
+
+# Счётчик для уникальных имён серверных курсоров
+_cursor_names = itertools.count(1)
+
+
+def iter_query(query, params=None, itersize=DEFAULT_ITERSIZE):
+    """
+    Выполняет SELECT и отдаёт строки по одной (словарями), не загружая весь результат в память.
+
+    В отличие от execute_query(fetch=True), который делает fetchall(), здесь используется
+    именованный (серверный) курсор: PostgreSQL держит результат у себя, а клиент забирает
+    его порциями по itersize строк. Поэтому обход таблицы на миллионы строк идёт в постоянной памяти.
+
+        for row in iter_query("SELECT id, rating FROM reviews"):
+            ...
+
+    Важно: пока обход не закончен, генератор держит соединение из пула и открытую транзакцию.
+    Если прервать цикл (break), соединение вернётся в пул при закрытии генератора.
+
+    :param query: SQL-строка (SELECT ...)
+    :param params: параметры запроса
+    :param itersize: сколько строк забирать с сервера за раз
+    """
+    with get_connection() as conn:
+        # Имя курсора делает его серверным (DECLARE ... CURSOR); работает только внутри транзакции
+        with conn.cursor(name=f"iter_query_{next(_cursor_names)}", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = itersize
+            cur.execute(query, params or ())
+            for row in cur:
+                yield row
@@ -0,0 +1,227 @@
+# distance_engine.py
+# =======================================================
+# Сортировка рынков по расстоянию силами NumPy.
+#
+# Раньше «Сортировка по расстоянию» просила PostgreSQL посчитать acos(...)
+# для КАЖДОГО рынка и отсортировать все строки — и так заново на каждой
+# странице. Здесь:
+# - координаты всех рынков лежат в памяти в непрерывных массивах float64
+#   (уже в радианах, вместе с cos(широты) — он нужен в формуле);
+# - расстояние до всех рынков считается одним векторным проходом (гаверсинус);
+# - для первой страницы от новой точки берём np.argpartition: он отбирает
+#   offset + limit ближайших за O(n), без полной сортировки;
+# - для следующих страниц той же точки один раз строится полный порядок
+#   (np.lexsort) и кешируется, дальше страница — просто срез, O(размер страницы).
+#
+# Порядок — как в SQL «ORDER BY distance, id»: при равном расстоянии — по id.
+# DESC — от дальних к ближним (при равном расстоянии тоже по id).
+#
+# get_distance_engine() — общий движок процесса: строится при первом вызове
+# и раз в DISTANCE_ENGINE_REFRESH секунд сверяется с базой (число рынков,
+# max(id), max(coords_change_no) — номер последнего изменения координат,
+# его ставит триггер при любом INSERT/UPDATE); если что-то изменилось — строится заново.
+# DISTANCE_ENGINE=0 — выключить (тогда работает прежний SQL).
+# =======================================================
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .db import execute_query
+from .geo_index import load_hit_rows
+
+EARTH_RADIUS_MILES = 3959
+
+DISTANCE_ENGINE_ENABLED = os.getenv("DISTANCE_ENGINE", "1") not in ("0", "false", "False")
+DISTANCE_ENGINE_REFRESH = float(os.getenv("DISTANCE_ENGINE_REFRESH", 60))
+# Для скольких точек хранить готовый порядок (4 байта на рынок на каждую точку)
+DISTANCE_CACHE_SIZE = int(os.getenv("DISTANCE_CACHE_SIZE", 16))
+
+
+class DistanceEngine:
+    """
+    Координаты рынков в памяти + постраничная выдача по расстоянию от точки.
+    """
+
+    def __init__(self, ids, lats, lons, cache_size=DISTANCE_CACHE_SIZE):
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        self.lat = np.ascontiguousarray(np.radians(np.asarray(lats, dtype=np.float64)))
+        self.lon = np.ascontiguousarray(np.radians(np.asarray(lons, dtype=np.float64)))
+        self.cos_lat = np.cos(self.lat)
+        self.cache_size = cache_size
+        # (lat, lon, descending) -> полный порядок индексов (int32)
+        self._orders = OrderedDict()
+        # Точка, для которой уже отдавали страницу через argpartition:
+        # на втором запросе с ней строим полный порядок
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, lat, lon, idx=None):
+        """
+        Расстояния (мили) от точки до всех рынков (или только до рынков idx) — формула гаверсинуса.
+        """
+        lat_r, lon_r = np.radians(lat), np.radians(lon)
+        mlat = self.lat if idx is None else self.lat[idx]
+        mlon = self.lon if idx is None else self.lon[idx]
+        mcos = self.cos_lat if idx is None else self.cos_lat[idx]
+
+        # Считаем «на месте» (out=), чтобы не плодить временные массивы на миллион элементов
+        a = np.subtract(mlat, lat_r)
+        np.multiply(a, 0.5, out=a)
+        np.sin(a, out=a)
+        np.square(a, out=a)
+        b = np.subtract(mlon, lon_r)
+        np.multiply(b, 0.5, out=b)
+        np.sin(b, out=b)
+        np.square(b, out=b)
+        np.multiply(b, mcos, out=b)
+        np.multiply(b, np.cos(lat_r), out=b)
+        np.add(a, b, out=a)
+        np.minimum(a, 1.0, out=a)  # защита от 1.0000000002 из-за округления
+        np.sqrt(a, out=a)
+        np.arcsin(a, out=a)
+        np.multiply(a, 2 * EARTH_RADIUS_MILES, out=a)
+        return a
+
+    def _full_order(self, dist, descending):
+        # lexsort сортирует по последнему ключу, при равенстве — по предыдущему (id)
+        key = -dist if descending else dist
+        return np.lexsort((self.ids, key)).astype(np.int32)
+
+    def _top(self, dist, k, descending):
+        """
+        k первых индексов в порядке (расстояние, id) без полной сортировки:
+        argpartition находит k-е значение, затем сортируем только кандидатов.
+        """
+        key = -dist if descending else dist
+        if k >= len(key):
+            return np.lexsort((self.ids, key))
+        kth = key[np.argpartition(key, k - 1)[k - 1]]
+        # Все, кто не дальше k-го (с равными ему — чтобы выбор по id был честным)
+        candidates = np.flatnonzero(key <= kth)
+        order = np.lexsort((self.ids[candidates], key[candidates]))[:k]
+        return candidates[order]
+
+    def page(self, lat, lon, offset, limit, descending=False):
+        """
+        [(id, мили), ...] для строк offset .. offset + limit сортировки по расстоянию от точки.
+        """
+        n = len(self.ids)
+        if limit <= 0 or offset >= n:
+            return []
+        end = min(offset + limit, n)
+        key = (round(lat, 6), round(lon, 6), descending)
+
+        order = self._orders.get(key)
+        if order is not None:
+            self._orders.move_to_end(key)
+            idx = order[offset:end]
+            dist = self.distances(lat, lon, idx)
+        else:
+            all_dist = self.distances(lat, lon)
+            if key in self._seen:
+                # Второй запрос от той же точки — пользователь листает: строим порядок один раз
+                del self._seen[key]
+                order = self._full_order(all_dist, descending)
+                self._remember_order(key, order)
+                idx = order[offset:end]
+            else:
+                self._seen[key] = True
+                while len(self._seen) > self.cache_size:
+                    self._seen.popitem(last=False)
+                idx = self._top(all_dist, end, descending)[offset:end]
+            dist = all_dist[idx]
+
+        return [(int(market_id), float(miles)) for market_id, miles in zip(self.ids[idx], dist)]
+
+    def _remember_order(self, key, order):
+        self._orders[key] = order
+        while len(self._orders) > self.cache_size:
+            self._orders.popitem(last=False)
+
+
+# ===========================================================
+# Общий движок процесса
+# ===========================================================
+
+_POINTS_SQL = """
+    SELECT id, latitude, longitude
+    FROM markets
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+# Признаки «данные изменились»: число рынков, последний id и последнее обновление из CSV
+_SIGNATURE_SQL = """
+    SELECT COUNT(*) FILTER (WHERE latitude IS NOT NULL AND longitude IS NOT NULL) AS n,
+           MAX(id) AS max_id,
+           MAX(coords_change_no) AS max_change
+    FROM markets
+"""
+
+_engine = None
+_engine_state = {"checked_at": 0.0, "signature": None}
+_engine_lock = threading.Lock()
+
+
+def _signature():
+    row = execute_query(_SIGNATURE_SQL, fetch=True)[0]
+    return row["n"], row["max_id"], row["max_change"]
+
+
+def _build():
+    rows = execute_query(_POINTS_SQL, fetch=True)
+    n = len(rows)
+    ids = np.fromiter((r["id"] for r in rows), dtype=np.int64, count=n)
+    lats = np.fromiter((r["latitude"] for r in rows), dtype=np.float64, count=n)
+    lons = np.fromiter((r["longitude"] for r in rows), dtype=np.float64, count=n)
+    return DistanceEngine(ids, lats, lons)
+
+
+def get_distance_engine():
+    """
+    Общий движок процесса (или None, если выключен через DISTANCE_ENGINE=0).
+    """
+    global _engine
+    if not DISTANCE_ENGINE_ENABLED:
+        return None
+    with _engine_lock:
+        now = time.monotonic()
+        if _engine is None or now - _engine_state["checked_at"] >= DISTANCE_ENGINE_REFRESH:
+            signature = _signature()
+            if _engine is None or signature != _engine_state["signature"]:
+                _engine = _build()
+                _engine_state["signature"] = signature
+            _engine_state["checked_at"] = now
+        return _engine
+
+
+def reset_distance_engine():
+    """
+    Забыть движок (например, после удаления рынка) — следующий вызов перечитает координаты.
+    """
+    global _engine
+    with _engine_lock:
+        _engine = None
+
+
+def distance_page(lat, lon, limit, offset=0, descending=False):
+    """
+    Страница рынков, отсортированных по расстоянию от точки: строки как в
+    geo_index.load_hit_rows (id, name, city, state, zip, latitude, longitude, distance).
+    Возвращает None, если движок выключен или не смог ответить — тогда нужен обычный SQL.
+    """
+    try:
+        engine = get_distance_engine()
+        if engine is None:
+            return None
+        with _engine_lock:
+            hits = engine.page(lat, lon, offset, limit, descending)
+        return load_hit_rows(hits)
+    except Exception as e:
+        print(f"Движок расстояний недоступен ({e}), сортируем в базе.")
+        return None
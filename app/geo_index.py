@@ -0,0 +1,463 @@
+# geo_index.py
+# =======================================================
+# Пространственный индекс рынков в памяти процесса (KD-дерево).
+#
+# Вместо того чтобы просить PostgreSQL посчитать расстояние до КАЖДОГО рынка
+# и отсортировать их, держим координаты всех рынков в памяти и отвечаем на
+#   - knn(lat, lon, k)                — k ближайших рынков;
+#   - within_radius(lat, lon, miles)  — все рынки в радиусе, по возрастанию расстояния
+# за микросекунды-миллисекунды.
+#
+# Как устроено:
+# - (lat, lon) переводим в точку на единичной сфере (x, y, z). Прямое расстояние
+#   между такими точками (хорда) растёт вместе с расстоянием по поверхности,
+#   поэтому обычное евклидово KD-дерево даёт правильный порядок без особых
+#   случаев у полюсов и 180-го меридиана. Мили: 2 * R * asin(хорда / 2).
+# - Дерево «неявное»: точки лежат в плоских массивах array('d') / array('q')
+#   в таком порядке, что середина любого диапазона — узел, левая половина —
+#   левое поддерево, правая — правое. Никаких объектов-узлов: 32 байта на рынок.
+# - Изменения без полной перестройки: новые/переместившиеся рынки попадают в небольшой
+#   «хвост» (просматривается перебором), а их старые точки в дереве и удалённые
+#   рынки — в множество «мёртвых» id. Когда хвост или множество разрастаются,
+#   дерево перестраивается целиком.
+#
+# get_geo_index() — общий индекс процесса: строится из таблицы markets при первом
+# вызове и раз в GEO_INDEX_REFRESH секунд подтягивает изменения из базы.
+# Если индекс выключен (GEO_INDEX=0) или упал, вызывающий код
+# возвращается к обычному SQL-запросу.
+#
+# nearest_markets(lat, lon, k) — k ближайших рынков без подбора радиуса: через индекс,
+# а без него — SQL-поиском расширяющимися кругами (nearest_markets_sql).
+# =======================================================
+
+import heapq
+import math
+import os
+import threading
+import time
+from array import array
+
+from .db import execute_query
+from .utils import bbox_condition, geohash_condition
+
+EARTH_RADIUS_MILES = 3959
+
+# Включение индекса и период подтягивания изменений из базы (секунды)
+GEO_INDEX_ENABLED = os.getenv("GEO_INDEX", "1") not in ("0", "false", "False")
+GEO_INDEX_REFRESH = float(os.getenv("GEO_INDEX_REFRESH", 60))
+
+
+def to_xyz(lat, lon):
+    """
+    Широта/долгота (градусы) -> точка на единичной сфере.
+    """
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+    cos_phi = math.cos(phi)
+    return cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi)
+
+
+def chord_to_miles(chord):
+    """
+    Длина хорды единичной сферы -> расстояние по поверхности Земли в милях.
+    """
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, chord / 2))
+
+
+def miles_to_chord(miles):
+    """
+    Расстояние в милях -> длина хорды (обратное к chord_to_miles).
+    """
+    angle = min(math.pi, miles / EARTH_RADIUS_MILES)  # дальше половины окружности не бывает
+    return 2 * math.sin(angle / 2)
+
+
+class GeoIndex:
+    """
+    KD-дерево по точкам (id, lat, lon) на плоских массивах.
+    Само по себе не потокобезопасно: общий индекс процесса защищён блокировкой (см. get_geo_index).
+    """
+
+    def __init__(self, points=()):
+        self.build(points)
+
+    # ---------- построение ----------
+
+    def build(self, points):
+        """
+        Строит дерево заново из (id, lat, lon). Точки без координат пропускаются.
+        """
+        items = []
+        for market_id, lat, lon in points:
+            if lat is None or lon is None:
+                continue
+            items.append((int(market_id),) + to_xyz(float(lat), float(lon)))
+
+        n = len(items)
+        ids = array("q", bytes(8 * n))
+        xyz = array("d", bytes(24 * n))
+
+        # Медиана диапазона по оси (x, y, z по кругу) — в середину, меньшие — влево, большие — вправо
+        stack = [(items, 0, 0)]
+        while stack:
+            part, lo, depth = stack.pop()
+            if not part:
+                continue
+            axis = depth % 3 + 1
+            part.sort(key=lambda item: item[axis])
+            mid = len(part) // 2
+            pos = lo + mid
+            market_id, x, y, z = part[mid]
+            ids[pos] = market_id
+            xyz[3 * pos], xyz[3 * pos + 1], xyz[3 * pos + 2] = x, y, z
+            stack.append((part[:mid], lo, depth + 1))
+            stack.append((part[mid + 1:], pos + 1, depth + 1))
+
+        self._ids = ids
+        self._xyz = xyz
+        self._tail = {}     # id -> (x, y, z): добавленные/перемещённые после построения
+        self._dead = set()  # id, чьи точки в дереве больше не действительны
+
+    def _live_points(self):
+        """
+        Все действующие точки (id, x, y, z): дерево без «мёртвых» + хвост.
+        """
+        xyz = self._xyz
+        for i, market_id in enumerate(self._ids):
+            if market_id not in self._dead:
+                yield market_id, xyz[3 * i], xyz[3 * i + 1], xyz[3 * i + 2]
+        for market_id, (x, y, z) in self._tail.items():
+            yield market_id, x, y, z
+
+    def rebuild(self):
+        """
+        Полная перестройка с учётом хвоста и удалений.
+        """
+        points = []
+        for market_id, x, y, z in self._live_points():
+            lat = math.degrees(math.asin(max(-1.0, min(1.0, z))))
+            lon = math.degrees(math.atan2(y, x))
+            points.append((market_id, lat, lon))
+        self.build(points)
+
+    # ---------- изменения ----------
+
+    def add(self, market_id, lat, lon):
+        """
+        Добавить рынок или обновить его координаты.
+        """
+        market_id = int(market_id)
+        self._dead.add(market_id)  # старая точка в дереве (если была) больше не действует
+        if lat is None or lon is None:
+            self._tail.pop(market_id, None)
+        else:
+            self._tail[market_id] = to_xyz(float(lat), float(lon))
+        self._maybe_rebuild()
+
+    def remove(self, market_id):
+        market_id = int(market_id)
+        self._dead.add(market_id)
+        self._tail.pop(market_id, None)
+        self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        n = len(self._ids)
+        if len(self._tail) > max(64, 4 * int(math.sqrt(n))) or len(self._dead) > max(64, n // 4):
+            self.rebuild()
+
+    def __len__(self):
+        return sum(1 for _ in self._live_points())
+
+    # ---------- поиск ----------
+
+    def _visit(self, q, limit2, accept):
+        """
+        Обход дерева с отсечением. accept(d2, id) вызывается для каждой точки ближе,
+        чем limit2() (квадрат хорды), и может уменьшать limit2 (для k ближайших).
+        """
+        ids, xyz, dead = self._ids, self._xyz, self._dead
+        qx, qy, qz = q
+        stack = [(0, len(ids), 0, 0.0)]  # (начало, конец, глубина, квадрат расстояния до плоскости разреза)
+        while stack:
+            lo, hi, depth, bound2 = stack.pop()
+            # Граница могла сузиться, пока диапазон лежал в стеке
+            if lo >= hi or bound2 > limit2():
+                continue
+            mid = (lo + hi) // 2
+            px, py, pz = xyz[3 * mid], xyz[3 * mid + 1], xyz[3 * mid + 2]
+            d2 = (qx - px) ** 2 + (qy - py) ** 2 + (qz - pz) ** 2
+            if d2 <= limit2() and ids[mid] not in dead:
+                accept(d2, ids[mid])
+            diff = q[depth % 3] - (px, py, pz)[depth % 3]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # Дальнюю половину смотрим, только если плоскость разреза ближе текущей границы.
+            # В стек кладём её первой — тогда ближняя обойдётся раньше и сузит границу.
+            if diff * diff <= limit2():
+                stack.append((far[0], far[1], depth + 1, diff * diff))
+            stack.append((near[0], near[1], depth + 1, bound2))
+        for market_id, (px, py, pz) in self._tail.items():
+            d2 = (qx - px) ** 2 + (qy - py) ** 2 + (qz - pz) ** 2
+            if d2 <= limit2():
+                accept(d2, market_id)
+
+    def knn(self, lat, lon, k):
+        """
+        k ближайших рынков: [(id, мили), ...] по возрастанию расстояния (при равенстве — по id).
+        """
+        if k <= 0:
+            return []
+        heap = []  # (-d2, -id): на вершине — самый дальний из найденных
+
+        def limit2():
+            return -heap[0][0] if len(heap) >= k else math.inf
+
+        def accept(d2, market_id):
+            item = (-d2, -market_id)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+        self._visit(to_xyz(lat, lon), limit2, accept)
+        found = sorted((-neg_d2, -neg_id) for neg_d2, neg_id in heap)
+        return [(market_id, chord_to_miles(math.sqrt(d2))) for d2, market_id in found]
+
+    def within_radius(self, lat, lon, miles):
+        """
+        Все рынки не дальше miles: [(id, мили), ...] по возрастанию расстояния (при равенстве — по id).
+        """
+        chord = miles_to_chord(miles)
+        radius2 = chord * chord
+        found = []
+        self._visit(to_xyz(lat, lon), lambda: radius2, lambda d2, market_id: found.append((d2, market_id)))
+        found.sort()
+        return [(market_id, chord_to_miles(math.sqrt(d2))) for d2, market_id in found]
+
+
+# ===========================================================
+# Общий индекс процесса
+# ===========================================================
+
+# Что читаем из базы: координаты и метки для поиска изменений
+_POINTS_SQL = """
+    SELECT id, latitude, longitude, coords_change_no
+    FROM markets
+    {where}
+"""
+
+_geo_index = None
+_geo_state = {"built_at": 0.0, "max_id": 0, "max_change": 0, "count": 0}
+_geo_lock = threading.Lock()
+
+
+def _remember(rows):
+    # Запоминаем, докуда дочитали: новые рынки — id больше max_id,
+    # новые и сдвинутые (загрузчиком, в админке, любым UPDATE координат) —
+    # coords_change_no больше max_change (номер ставит триггер, setup/init.sql)
+    for r in rows:
+        _geo_state["max_id"] = max(_geo_state["max_id"], r["id"])
+        _geo_state["max_change"] = max(_geo_state["max_change"], r["coords_change_no"] or 0)
+
+
+def _refresh(index):
+    """
+    Подтягивает изменения из базы без полной перестройки:
+    новые и обновлённые рынки — add(), пропавшие (если число рынков не сходится) — remove().
+    """
+    rows = execute_query(
+        _POINTS_SQL.format(where="WHERE coords_change_no > %s"),
+        (_geo_state["max_change"],),
+        fetch=True,
+    )
+    added = sum(1 for r in rows if r["id"] > _geo_state["max_id"])
+    for r in rows:
+        index.add(r["id"], r["latitude"], r["longitude"])
+    _remember(rows)
+
+    count = execute_query("SELECT COUNT(*) FROM markets", fetch=True)[0]["count"]
+    if count != _geo_state["count"] + added:
+        # Что-то удалили в другом процессе — сверяем список id
+        present = {r["id"] for r in execute_query("SELECT id FROM markets", fetch=True)}
+        for market_id, *_ in list(index._live_points()):
+            if market_id not in present:
+                index.remove(market_id)
+    _geo_state["count"] = count
+
+
+def get_geo_index():
+    """
+    Общий индекс процесса (или None, если он выключен через GEO_INDEX=0).
+    При первом вызове строится по всей таблице markets, дальше раз в
+    GEO_INDEX_REFRESH секунд подтягивает изменения.
+    """
+    global _geo_index
+    if not GEO_INDEX_ENABLED:
+        return None
+    with _geo_lock:
+        now = time.monotonic()
+        if _geo_index is None:
+            rows = execute_query(_POINTS_SQL.format(where=""), fetch=True)
+            _geo_index = GeoIndex((r["id"], r["latitude"], r["longitude"]) for r in rows)
+            _remember(rows)
+            _geo_state["count"] = len(rows)
+            _geo_state["built_at"] = now
+        elif now - _geo_state["built_at"] >= GEO_INDEX_REFRESH:
+            _refresh(_geo_index)
+            _geo_state["built_at"] = now
+        return _geo_index
+
+
+def market_deleted(market_id):
+    """
+    Сообщить индексу, что рынок удалён в этом процессе (чтобы не ждать обновления).
+    """
+    with _geo_lock:
+        if _geo_index is not None:
+            _geo_index.remove(market_id)
+            _geo_state["count"] -= 1
+
+
+def load_hit_rows(hits):
+    """
+    [(id, мили), ...] из индекса -> строки рынков (id, name, city, state, zip,
+    latitude, longitude, distance) в том же порядке. Рынки, удалённые после
+    последнего обновления индекса, пропускаются.
+    """
+    if not hits:
+        return []
+    rows = execute_query(
+        """
+        SELECT m.id, m.name, l.city, l.state, l.zip, m.latitude, m.longitude
+        FROM markets m
+        JOIN locations l ON l.id = m.location_id
+        WHERE m.id = ANY(%s)
+        """,
+        ([market_id for market_id, _ in hits],),
+        fetch=True,
+    )
+    by_id = {r["id"]: r for r in rows}
+    result = []
+    for market_id, miles in hits:
+        row = by_id.get(market_id)
+        if row is not None:
+            row = dict(row)
+            row["distance"] = miles
+            result.append(row)
+    return result
+
+
+def radius_hits(lat, lon, miles):
+    """
+    [(id, мили), ...] всех рынков в радиусе — по возрастанию расстояния.
+    Возвращает None, если индекс выключен или не смог ответить — тогда нужен обычный SQL.
+    """
+    try:
+        index = get_geo_index()
+        if index is None:
+            return None
+        with _geo_lock:
+            return index.within_radius(lat, lon, miles)
+    except Exception as e:
+        print(f"Гео-индекс недоступен ({e}), считаем расстояния в базе.")
+        return None
+
+
+def search_radius(lat, lon, miles, limit=None, offset=0):
+    """
+    Рынки в радиусе через индекс: (всего, строки текущей страницы) — строки как в load_hit_rows.
+    Возвращает None, если индекс недоступен (см. radius_hits).
+    """
+    hits = radius_hits(lat, lon, miles)
+    if hits is None:
+        return None
+    end = None if limit is None else offset + limit
+    return len(hits), load_hit_rows(hits[offset:end])
+
+
+def search_nearest(lat, lon, limit, offset=0):
+    """
+    Ближайшие рынки через индекс: строки с offset по offset + limit (по возрастанию расстояния).
+    Возвращает None, если индекс выключен или не смог ответить — тогда нужен обычный SQL.
+    """
+    try:
+        index = get_geo_index()
+        if index is None:
+            return None
+        with _geo_lock:
+            hits = index.knn(lat, lon, offset + limit)
+        return load_hit_rows(hits[offset:])
+    except Exception as e:
+        print(f"Гео-индекс недоступен ({e}), считаем расстояния в базе.")
+        return None
+
+
+# ===========================================================
+# k ближайших рынков (k-NN) без подбора радиуса
+# ===========================================================
+
+# Первое «кольцо» SQL-поиска (мили) и во сколько раз оно растёт на каждом шаге
+KNN_START_MILES = 10
+KNN_GROWTH = 4
+# Половина окружности Земли: дальше этого расстояния точек не бывает
+KNN_MAX_MILES = math.pi * EARTH_RADIUS_MILES
+
+# Расстояние в милях по формуле гаверсинуса (устойчива и на малых расстояниях)
+_DISTANCE_SQL = """
+    2 * 3959 * ASIN(LEAST(1, SQRT(
+        POWER(SIN(RADIANS(m.latitude - %s) / 2), 2) +
+        COS(RADIANS(%s)) * COS(RADIANS(m.latitude)) *
+        POWER(SIN(RADIANS(m.longitude - %s) / 2), 2)
+    )))
+"""
+
+_KNN_SQL = """
+    SELECT m.id, m.name, l.city, l.state, l.zip, m.latitude, m.longitude,
+           {distance} AS distance
+    FROM markets m
+    JOIN locations l ON l.id = m.location_id
+    WHERE m.latitude IS NOT NULL AND m.longitude IS NOT NULL
+      AND {cells}
+      AND {bbox}
+      AND {distance} <= %s
+    ORDER BY distance ASC, m.id ASC
+    LIMIT %s
+"""
+
+
+def nearest_markets_sql(lat, lon, k):
+    """
+    k ближайших рынков силами базы — «расширяющимися кольцами».
+    Берём круг KNN_START_MILES миль: кандидатов дают ячейки geohash вокруг него
+    (диапазоны по индексу idx_markets_geohash) и прямоугольник, расстояние
+    считается только для них.
+    Если в круге нашлось k рынков — это и есть k ближайших (все, кто ближе, тоже в круге).
+    Иначе увеличиваем радиус в KNN_GROWTH раз, пока не дойдём до всей Земли.
+    Строки — как в load_hit_rows (с ключом distance).
+    """
+    if k <= 0:
+        return []
+    distance_params = (lat, lat, lon)
+    radius = KNN_START_MILES
+    while True:
+        geo_sql, geo_params = geohash_condition(lat, lon, radius)
+        bbox_sql, bbox_params = bbox_condition(lat, lon, radius)
+        query = _KNN_SQL.format(distance=_DISTANCE_SQL, cells=geo_sql, bbox=bbox_sql)
+        params = distance_params + geo_params + bbox_params + distance_params + (radius, k)
+        rows = execute_query(query, params, fetch=True)
+        if len(rows) >= k or radius >= KNN_MAX_MILES:
+            for r in rows:
+                r["distance"] = float(r["distance"])
+            return rows
+        radius = min(radius * KNN_GROWTH, KNN_MAX_MILES)
+
+
+def nearest_markets(lat, lon, k):
+    """
+    k ближайших к точке рынков по возрастанию расстояния — без подбора радиуса.
+    Сначала гео-индекс в памяти (search_nearest), если он недоступен — nearest_markets_sql.
+    Строки: id, name, city, state, zip, latitude, longitude, distance (мили).
+    """
+    rows = search_nearest(lat, lon, k)
+    if rows is not None:
+        return rows
+    return nearest_markets_sql(lat, lon, k)
@@ -0,0 +1,205 @@
+# keyset.py
+# =======================================================
+# Keyset-пагинация («по ключу», seek) вместо LIMIT/OFFSET.
+#
+# LIMIT 20 OFFSET 100000 заставляет PostgreSQL построить и выбросить
+# 100 000 строк — чем дальше страница, тем медленнее. При keyset-пагинации
+# запоминаем ключ сортировки последней показанной строки, например
+# (avg_rating, review_count, id) или (city, id), и просим следующую страницу
+# условием «строки ПОСЛЕ этого ключа»:
+#     WHERE (city, id) > ('Boston', 812) ORDER BY city, id LIMIT 20
+# Такая страница стоит столько же, сколько первая.
+#
+# Как выбирается способ для страницы (plan_page):
+#   - первая страница         — просто LIMIT;
+#   - следующая/предыдущая    — по ключу крайней строки текущей страницы;
+#   - последняя               — обратный порядок + LIMIT (тоже без OFFSET);
+#   - прыжок на номер N       — OFFSET, но от ближнего конца списка
+#                               (страница 900 из 1000 — OFFSET от конца).
+#
+# Ключ сортировки описывается списком [(колонка, "ASC"|"DESC"), ...].
+# Колонки — имена из SELECT запроса-источника: запрос страницы оборачивает его
+#     SELECT * FROM (<источник>) AS page_src WHERE <ключ> ORDER BY <ключ> LIMIT .. OFFSET ..
+# Последняя колонка ключа должна быть уникальной (обычно id), а значения
+# в колонках ключа — не NULL (как l.city и l.state: NOT NULL в схеме).
+# Колонку ключа лучше брать как есть, без выражений вокруг: тогда ORDER BY
+# идёт по её индексу (idx_city, idx_state).
+# =======================================================
+
+import math
+
+# Запрос страницы поверх запроса-источника
+PAGE_SQL = """
+    SELECT * FROM ({source}) AS page_src
+    {where}
+    ORDER BY {order}
+    LIMIT %s OFFSET %s
+"""
+
+
+def _flip(direction):
+    return "DESC" if direction == "ASC" else "ASC"
+
+
+def order_sql(keys, reverse=False):
+    """
+    [("city", "ASC"), ("id", "ASC")] -> "city ASC, id ASC" (reverse=True — наоборот).
+    """
+    return ", ".join(f"{col} {_flip(d) if reverse else d}" for col, d in keys)
+
+
+def seek_condition(keys, values, forward=True):
+    """
+    Условие «строка идёт после (forward=True) или до (forward=False) строки с ключом values».
+    Возвращает (sql, params).
+    - Все направления одинаковые — сравнение кортежей: (city, id) > (%s, %s).
+      Его PostgreSQL умеет вести по индексу.
+    - Направления разные (avg_rating DESC, id ASC) — развёрнутая форма:
+      a <= x AND (a < x OR (a = x AND b > y) ...)
+    """
+    directions = {d for _, d in keys}
+    if len(directions) == 1:
+        ascending = directions.pop() == "ASC"
+        op = ">" if ascending == forward else "<"
+        cols = ", ".join(col for col, _ in keys)
+        marks = ", ".join(["%s"] * len(keys))
+        return f"({cols}) {op} ({marks})", tuple(values)
+
+    parts, params = [], []
+    for i, (col, direction) in enumerate(keys):
+        op = ">" if (direction == "ASC") == forward else "<"
+        equal = [f"{c} = %s" for c, _ in keys[:i]]
+        parts.append("(" + " AND ".join(equal + [f"{col} {op} %s"]) + ")")
+        params.extend(list(values[:i]) + [values[i]])
+    # Лишнее, но полезное условие на первую колонку (a <= x): по нему индекс
+    # начинает чтение сразу с ключа, а не с начала списка
+    first_col, first_dir = keys[0]
+    first_op = ">=" if (first_dir == "ASC") == forward else "<="
+    return f"({first_col} {first_op} %s AND (" + " OR ".join(parts) + "))", (values[0],) + tuple(params)
+
+
+def row_key(row, keys):
+    """
+    Значения ключа сортировки из строки результата (словаря).
+    """
+    return tuple(row[col] for col, _ in keys)
+
+
+def plan_page(keys, total, per_page, page, anchor=None, exact=True, fresh=True):
+    """
+    Как получить страницу page. anchor — что известно о соседней странице:
+        {"page": номер, "after": ключ последней строки} или {"page": номер, "before": ключ первой строки}
+    (ключ «after» используется для страницы anchor["page"], то есть он уже
+    указывает на страницу, которую хотим показать).
+    exact=False — total лишь оценка (totals.count_total): тогда нельзя считать
+    от конца списка, все прыжки — OFFSET от начала.
+    fresh=False — total точный, но взят из кеша (totals: total.cached) и мог
+    устареть: номер страницы зажимаем по нему, но от конца тоже не считаем —
+    лишняя или пропавшая строка сдвинула бы последнюю страницу и OFFSET от конца.
+
+    Возвращает словарь:
+        page, pages         — номер страницы (зажатый в 1..pages) и число страниц;
+        offset              — номер первой строки страницы (для «с N по M»);
+        kind                — "first" / "after" / "before" / "last" / "offset" / "offset_rev";
+        where, params       — условие по ключу (или "") и его параметры;
+        order               — ORDER BY;
+        limit, skip         — LIMIT и OFFSET запроса;
+        reverse             — строки пришли в обратном порядке, их надо развернуть.
+    """
+    pages = max(1, math.ceil(max(0, total) / max(1, per_page)))
+    if exact:
+        page = max(1, min(page, pages))
+    else:
+        # total — оценка: настоящих страниц может быть больше, номер не обрезаем
+        page = max(1, page)
+        pages = max(pages, page)
+    plan = {
+        "page": page, "pages": pages, "offset": (page - 1) * per_page,
+        "where": "", "params": (), "order": order_sql(keys),
+        "limit": per_page, "skip": 0, "reverse": False, "exact": exact,
+    }
+
+    if anchor and anchor.get("page") == page and ("after" in anchor or "before" in anchor):
+        forward = "after" in anchor
+        where, params = seek_condition(keys, anchor["after" if forward else "before"], forward)
+        plan.update(kind="after" if forward else "before", where="WHERE " + where, params=params)
+        if not forward:
+            plan.update(order=order_sql(keys, reverse=True), reverse=True)
+    elif page == 1:
+        plan["kind"] = "first"
+    elif exact and fresh and page == pages:
+        # Последняя страница — первые строки обратного порядка (её размер может быть неполным)
+        plan.update(kind="last", order=order_sql(keys, reverse=True), reverse=True,
+                    limit=total - (pages - 1) * per_page)
+    elif exact and fresh and page > pages / 2:
+        # Прыжок ближе к концу — OFFSET от конца списка короче
+        plan.update(kind="offset_rev", order=order_sql(keys, reverse=True), reverse=True,
+                    skip=total - page * per_page)
+    else:
+        plan.update(kind="offset", skip=plan["offset"])
+    return plan
+
+
+def page_query(source, plan, extra_params=()):
+    """
+    SQL и параметры страницы поверх запроса-источника (его параметры — extra_params).
+    """
+    sql = PAGE_SQL.format(source=source, where=plan["where"], order=plan["order"])
+    return sql, tuple(extra_params) + plan["params"] + (plan["limit"], plan["skip"])
+
+
+def finish_page(plan, rows, keys):
+    """
+    Разворачивает строки, если они пришли в обратном порядке, и возвращает
+    (rows, anchors), где anchors — ключи для соседних страниц:
+        {"next": {"page": p + 1, "after": ...} | None, "prev": {"page": p - 1, "before": ...} | None}
+    """
+    rows = list(rows)
+    if plan["reverse"]:
+        rows.reverse()
+    anchors = {"next": None, "prev": None}
+    # При оценке total конец списка узнаём по неполной странице
+    more = plan["page"] < plan["pages"] if plan["exact"] else len(rows) == plan["limit"]
+    if rows and more:
+        anchors["next"] = {"page": plan["page"] + 1, "after": row_key(rows[-1], keys)}
+    if rows and plan["page"] > 1:
+        anchors["prev"] = {"page": plan["page"] - 1, "before": row_key(rows[0], keys)}
+    return rows, anchors
+
+
+class KeysetPager:
+    """
+    Keyset-пагинация для консоли и Streamlit, где страница задаётся номером
+    (paginate() / st_paginate() возвращают offset). Пейджер помнит ключи
+    крайних строк последней показанной страницы: если следующий запрос — соседняя
+    страница, она берётся по ключу, иначе — по plan_page (первая/последняя/OFFSET).
+
+        pager = KeysetPager([("city", "ASC"), ("id", "ASC")])
+        rows = pager.fetch(execute_query, source_sql, params, total, per_page, offset)
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.anchors = {"next": None, "prev": None}
+        self.signature = None
+
+    def fetch(self, run_query, source, params, total, per_page, offset, signature=None):
+        """
+        Строки страницы с номером offset // per_page + 1.
+        run_query(sql, params, fetch=True) — функция выполнения запроса (execute_query).
+        signature — что угодно, описывающее запрос (например, фильтры): если оно
+        или размер страницы поменялись, запомненные ключи не используются.
+        """
+        if (signature, per_page) != self.signature:
+            self.anchors = {"next": None, "prev": None}
+            self.signature = (signature, per_page)
+        exact = not getattr(total, "approximate", False)
+        if exact and offset >= total:
+            return []  # за последней страницей — пусто, как у LIMIT/OFFSET
+        page = offset // max(1, per_page) + 1
+        anchor = next((a for a in self.anchors.values() if a and a["page"] == page), None)
+        plan = plan_page(self.keys, total, per_page, page, anchor, exact,
+                         fresh=not getattr(total, "cached", False))
+        sql, sql_params = page_query(source, plan, params)
+        rows, self.anchors = finish_page(plan, run_query(sql, sql_params, fetch=True), self.keys)
+        return rows
@@ -7,6 +7,16 @@
 # 1. Подключение к базе данных.
 # 2. Добавление категорий в таблицу categories.
 # 3. Добавление локаций, рынков и связей с категориями.
+# 4. Расписание рынков (market_hours) из колонок Season1..4 Date/Time.
+#
+# Два режима:
+# - load_data()      — построчная загрузка (по умолчанию);
+# - load_data_bulk() — пакетная загрузка: CSV потоком уходит во
+#   временную таблицу через COPY FROM STDIN, а локации, рынки и
+#   связи с категориями разрешаются несколькими INSERT ... SELECT.
+#   Запуск: python app/load_data.py --bulk
+#   С --workers N файл делится на N кусков по байтам (по границам записей),
+#   каждый кусок разбирают отдельные процессы, а слияние в таблицы делается один раз.
 # =======================================================
 
 import sys
@@ -14,14 +24,33 @@ import os
 # Добавляем путь к корню проекта, чтобы корректно работал импорт setup.config при ручном запуске
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import argparse
 import csv
+import io
+import multiprocessing
+import time
+from datetime import datetime
 import psycopg2  # библиотека для подключения к PostgreSQL
+from psycopg2.extras import execute_values  # вставка многих строк одним INSERT
 # === Импортируем настройки подключения к базе данных ===
 from setup.config import DB_CONFIG 
+# === Разбор расписания (Season1..4 Date/Time) ===
+from app.schedule import parse_schedule
 
 # === Путь к CSV-файлу с исходными данными ===
 CSV_FILE = os.path.join(os.path.dirname(__file__), '..', 'setup', 'Export.csv')
 
+# Сколько строк CSV отправляем в одном COPY (bulk-режим).
+# Ограничивает расход памяти: в буфере держим только одну пачку.
+BULK_BATCH_ROWS = 50000
+
+# Сколько строк коммитим одной транзакцией в построчном режиме.
+# После каждой пачки сохраняется чекпоинт (см. load_checkpoints).
+SERIAL_BATCH_ROWS = 1000
+
+# Формат колонки updateTime в Export.csv, например "8/3/2020 3:23:12 PM"
+UPDATE_TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
 def normalize(value):
     if value is None:
         return None
@@ -33,164 +62,531 @@ def normalize(value):
     return value if value else None
 
 
-def load_data():
+def parse_fmid(value):
+    """
+    FMID из CSV -> int (или None, если колонка пустая/битая).
+    """
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_update_time(value):
+    """
+    updateTime из CSV -> datetime (или None, если колонка пустая/битая).
+    """
+    try:
+        return datetime.strptime(str(value).strip(), UPDATE_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_categories(csv_file=CSV_FILE):
+    """
+    Читает заголовок CSV и возвращает список колонок-категорий.
+    """
+    # Читаем байты: текстовый режим декодирует сразу целый блок файла, и
+    # битая строка данных рядом с заголовком сломала бы чтение заголовка
+    with open(csv_file, 'rb') as file:
+        header_line = file.readline().decode('utf-8').strip()
+        columns = header_line.split(",")
+
+    # Категории начинаются с 29-й колонки (индекс 28) и идут до предпоследней
+    # Последние две колонки — "y" и "x" (координаты), их исключаем
+    categories_list = columns[28:-2]
+
+    # Убираем пробелы и лишние символы (на всякий случай)
+    return [c.strip() for c in categories_list]
+
+
+def ensure_categories(cur, conn, categories_list):
+    """
+    Заполняет таблицу categories, если она пустая.
+    """
+    cur.execute("SELECT COUNT(*) FROM categories")
+    count = cur.fetchone()[0] 
+    """Выполняется SQL-запрос, который подсчитывает количество записей в таблице categories
+    fetchone() это метод курсора, получает первую строку результата (в виде кортежа)
+    [0] извлекает первый (и единственный) элемент из этого кортежа - собственно число записей
+    Это число сохраняется в переменную count
+    По сути, этот код отвечает на вопрос: "Сколько всего категорий существует в таблице?"
+    Эквивалент на человеческом языке: "Посчитай все записи в таблице categories и скажи мне их количество"."""
+
+    # Если таблица пустая — добавляем все категории
+    if count == 0:
+        print("Добавляем категории в таблицу categories...")
+        for cat in categories_list:
+            # Вставляем каждую категорию (например, "Meat") далее по коду будет %s - placeholder (метка-заполнитель), означает, что на это место будет подставлено значение переменной cat. Вроде как защита от SQL-инъекций
+            cur.execute("INSERT INTO categories (name) VALUES (%s)", (cat,))
+        conn.commit()
+        print("Категории добавлены.")
+    else:
+        print("Категории уже существуют в базе.")
+
+
+def load_location_cache(cur):
+    """
+    Загружает все локации в словарь (city, state, zip) -> id.
+    Если в таблице есть дубликаты ключа — берём меньший id.
+    """
+    cur.execute("SELECT city, state, zip, MIN(id) FROM locations GROUP BY city, state, zip")
+    return {(city, state, zip_code): loc_id for city, state, zip_code, loc_id in cur.fetchall()}
+
+
+def load_payment_bits(cur):
+    """
+    Загружает биты способов оплаты: имя колонки CSV (Credit, WIC, ...) -> bit_no.
+    """
+    cur.execute("SELECT name, bit_no FROM payment_types")
+    return dict(cur.fetchall())
+
+
+def payment_mask(row, payment_bits):
+    """
+    Биты способов оплаты, отмеченных "Y" в строке CSV (часть markets.flags_mask).
+    Биты категорий в маску ставят триггеры на market_categories.
+    """
+    mask = 0
+    for name, bit_no in payment_bits.items():
+        if (row.get(name) or "").strip() == "Y":
+            mask |= 1 << bit_no
+    return mask
+
+
+def load_category_cache(cur):
+    """
+    Загружает все категории в словарь name -> id.
+    """
+    cur.execute("SELECT name, id FROM categories")
+    return dict(cur.fetchall())
+
+
+# Поиск рынка по тем же девяти полям, из которых считается markets.identity_hash
+MARKET_BY_HASH_SQL = """
+    SELECT id FROM markets
+    WHERE identity_hash = market_identity_hash(%s, %s, %s, %s, %s, %s, %s,
+                                               %s::numeric(10, 6), %s::numeric(10, 6))
+"""
+
+
+def load_known_markets(cur):
+    """
+    Загружает уже известные рынки из выгрузки: fmid -> (id, source_updated_at).
+    """
+    cur.execute("SELECT fmid, id, source_updated_at FROM markets WHERE fmid IS NOT NULL")
+    return {fmid: (market_id, updated) for fmid, market_id, updated in cur.fetchall()}
+
+
+def delete_missing_markets(cur, seen_fmids):
+    """
+    Удаляет рынки из выгрузки (fmid задан), которых больше нет в CSV.
+    Возвращает число удалённых рынков.
+    """
+    if not seen_fmids:
+        # Пустой/битый файл не должен стирать всю базу
+        print("Предупреждение: в CSV нет ни одного FMID — удаление пропущено.")
+        return 0
+    cur.execute(
+        "DELETE FROM markets WHERE fmid IS NOT NULL AND NOT (fmid = ANY(%s))",
+        (sorted(seen_fmids),)
+    )
+    return cur.rowcount
+
+
+def load_checkpoint(cur, csv_file):
+    """
+    Читает сохранённую позицию загрузки файла: (byte_offset, row_number) или None.
+    """
+    cur.execute(
+        "SELECT byte_offset, row_number FROM load_checkpoints WHERE file_path = %s",
+        (os.path.abspath(csv_file),)
+    )
+    return cur.fetchone()
+
+
+def save_checkpoint(cur, csv_file, byte_offset, row_number):
+    """
+    Запоминает позицию первой ещё не загруженной строки.
+    Выполняется в той же транзакции, что и сама пачка строк.
+    """
+    cur.execute("""
+        INSERT INTO load_checkpoints (file_path, byte_offset, row_number, updated_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (file_path) DO UPDATE
+        SET byte_offset = EXCLUDED.byte_offset,
+            row_number = EXCLUDED.row_number,
+            updated_at = EXCLUDED.updated_at
+    """, (os.path.abspath(csv_file), byte_offset, row_number))
+
+
+def default_quarantine_file(csv_file):
+    """
+    Файл для отклонённых строк по умолчанию: рядом с CSV, например Export.quarantine.csv
+    """
+    base, _ = os.path.splitext(os.path.normpath(csv_file))
+    return base + ".quarantine.csv"
+
+
+def write_quarantine(quarantine_file, rejected):
+    """
+    Дописывает отклонённые строки в CSV-карантин: номер строки, причина,
+    все исходные колонки и лишние поля записи (extra_fields, через " | "),
+    если их было больше, чем в заголовке. Заголовок пишется, только если файл новый.
+    """
+    if not rejected:
+        return
+    columns = [key for key in rejected[0][2].keys() if key is not None]
+    fieldnames = ["row_number", "reason"] + columns + ["extra_fields"]
+    is_new = not os.path.exists(quarantine_file) or os.path.getsize(quarantine_file) == 0
+    with open(quarantine_file, "a", newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        if is_new:
+            writer.writeheader()
+        for row_number, reason, row in rejected:
+            record = {key: value for key, value in row.items() if key is not None}
+            writer.writerow({"row_number": row_number, "reason": reason, **record,
+                             "extra_fields": " | ".join(row.get(None) or [])})
+
+
+def load_caches(cur):
+    """
+    Кэши id в памяти: вместо SELECT на каждую строку/категорию один раз читаем таблицы.
+    Новые id попадают в кэш сразу после вставки. После отката транзакции кэши
+    перечитываются — в них могли остаться id откатанных строк.
+    """
+    return {
+        "location_ids": load_location_cache(cur),
+        "category_ids": load_category_cache(cur),
+        "known_markets": load_known_markets(cur),
+        "payment_bits": load_payment_bits(cur),
+    }
+
+
+def bad_encoding(row):
+    """
+    True, если в строке были байты не в UTF-8 (iter_csv_records заменил их на U+FFFD).
+    """
+    return any(isinstance(v, str) and "\ufffd" in v for v in row.values())
+
+
+def wrong_field_count(row):
+    """
+    Причина отказа, если в записи CSV не столько полей, сколько в заголовке, иначе None.
+    Запись разобрана как у DictReader: лишние поля — списком под ключом None,
+    недостающие — None (пустое поле в файле — это "", а не None).
+    Такую строку нельзя ни дополнить, ни обрезать: колонки в ней съехали.
+    """
+    expected = len(row) - (None in row)
+    if None in row:
+        return f"неверное число полей: {expected + len(row[None])} вместо {expected}"
+    missing = sum(1 for value in row.values() if value is None)
+    if missing:
+        return f"неверное число полей: {expected - missing} вместо {expected}"
+    return None
+
+
+def load_row(cur, row, categories_list, caches, missing_categories, seen_fmids):
+    """
+    Загружает одну строку CSV (локация, рынок, связи с категориями).
+    Возвращает пару (результат, причина):
+    - ("inserted" | "updated" | "unchanged", None);
+    - ("rejected", причина) — строку нужно отправить в карантин.
+    Ошибки базы данных не перехватывает — ими занимается load_data().
+    """
+    location_ids = caches["location_ids"]
+    category_ids = caches["category_ids"]
+    known_markets = caches["known_markets"]
+
+    reason = wrong_field_count(row)
+    if reason:
+        return "rejected", reason
+    if bad_encoding(row):
+        return "rejected", "неверная кодировка (не UTF-8)"
+
+    # Достаём основные поля
+    city = row["city"].strip() if row["city"] else None
+    state = row["State"].strip() if row["State"] else None
+    street = row["street"].strip() if row["street"] else None
+    county = row["County"].strip() if row["County"] else None
+    zip_code = row["zip"].strip() if row["zip"] else None
+
+    # Если нет города или штата — строка невалидна
+    if not city or not state:
+        return "rejected", "нет города или штата"
+    if not normalize(row["MarketName"]):
+        return "rejected", "нет названия рынка"
+
+    # === Рынок уже загружен и не менялся в выгрузке — пропускаем ===
+    fmid = parse_fmid(row.get("FMID"))
+    source_updated_at = parse_update_time(row.get("updateTime"))
+    known = known_markets.get(fmid) if fmid is not None else None
+    if fmid is not None:
+        seen_fmids.add(fmid)
+    if known is not None and known[1] == source_updated_at and not caches["refresh_hours"]:
+        return "unchanged", None
+
+    # Координаты проверяем до любых вставок
+    try:
+        latitude = float(row["y"]) if row["y"] else None
+        longitude = float(row["x"]) if row["x"] else None
+    except ValueError:
+        return "rejected", f"неверные координаты: x={row['x']!r}, y={row['y']!r}"
+
+    # === Проверяем, есть ли локация (город + штат + индекс) ===
+    location_key = (city, state, zip_code)
+    location_id = location_ids.get(location_key)
+
+    if location_id is None:
+        # Если локации нет — добавляем новую и запоминаем её id
+        cur.execute("""
+            INSERT INTO locations (street, city, county, state, zip)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+        """, (street, city, county, state, zip_code))
+        location_id = cur.fetchone()[0]
+        location_ids[location_key] = location_id
+
+    # Приводим значения к нормализованному виду (убираем пробелы, '' → None)
+    market_fields = (
+        normalize(row["MarketName"]),
+        location_id,
+        normalize(row["Website"]),
+        normalize(row["Facebook"]),
+        normalize(row["Twitter"]),
+        normalize(row["Youtube"]),
+        normalize(row["OtherMedia"]),
+        latitude,
+        longitude
+    )
+
+    flags_mask = payment_mask(row, caches["payment_bits"])
+
+    if known is not None:
+        # Рынок изменился в выгрузке — обновляем его на месте.
+        # flags_mask = только биты оплаты: биты категорий вернут триггеры
+        # при повторной вставке связей ниже.
+        market_id = known[0]
+        cur.execute("""
+            UPDATE markets
+            SET name = %s, location_id = %s, website = %s, facebook = %s, twitter = %s,
+                youtube = %s, other_media = %s, latitude = %s, longitude = %s,
+                source_updated_at = %s, flags_mask = %s
+            WHERE id = %s
+        """, market_fields + (source_updated_at, flags_mask, market_id))
+        # Набор категорий тоже мог поменяться — пересоздаём связи
+        cur.execute("DELETE FROM market_categories WHERE market_id = %s", (market_id,))
+        result = "updated"
+    else:
+        # Пытаемся вставить рынок
+        cur.execute("""
+            INSERT INTO markets (name, location_id, website, facebook, twitter, youtube, other_media, latitude, longitude,
+                                 fmid, source_updated_at, flags_mask)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (identity_hash) DO NOTHING
+            RETURNING id
+        """, market_fields + (fmid, source_updated_at, flags_mask))
+
+        inserted = cur.fetchone()
+
+        if inserted:
+            market_id = inserted[0]
+            result = "inserted"
+        else:
+            # Если рынок уже есть, находим его ID по хэшу идентичности (одна проверка по индексу).
+            # Координаты приводим к NUMERIC(10, 6) — как в колонках markets.
+            cur.execute(MARKET_BY_HASH_SQL, market_fields)
+
+            market_result = cur.fetchone()
+            if not market_result:
+                return "rejected", "рынок не найден, хотя должен быть уникальным"
+            market_id = market_result[0]
+            result = "unchanged"
+
+            # Рынок загружен раньше, чем появились колонки fmid/updateTime — привязываем его к FMID
+            if fmid is not None:
+                cur.execute("""
+                    UPDATE markets SET fmid = %s, source_updated_at = %s
+                    WHERE id = %s AND fmid IS NULL
+                """, (fmid, source_updated_at, market_id))
+
+    if fmid is not None:
+        known_markets[fmid] = (market_id, source_updated_at)
+
+    # === Добавляем связи рынок -> категория (одним запросом на рынок) ===
+    market_category_ids = []
+    for cat in categories_list:
+        if row.get(cat) == "Y":
+            category_id = category_ids.get(cat)
+            if category_id is not None:
+                market_category_ids.append(category_id)
+            elif cat not in missing_categories:
+                print(f"Предупреждение: категория '{cat}' не найдена в таблице.")
+                missing_categories.add(cat)
+
+    if market_category_ids:
+        cur.execute("""
+            INSERT INTO market_categories (market_id, category_id)
+            SELECT %s, unnest(%s::int[])
+            ON CONFLICT DO NOTHING
+        """, (market_id, market_category_ids))
+
+    # === Расписание: строки market_hours пересоздаются целиком ===
+    if result != "inserted":
+        cur.execute("DELETE FROM market_hours WHERE market_id = %s", (market_id,))
+    hours = parse_schedule(row)
+    if hours:
+        execute_values(cur, """
+            INSERT INTO market_hours (market_id, season_no, weekday, open_minute, close_minute,
+                                      season_start, season_end)
+            VALUES %s
+        """, [(market_id,) + h for h in hours])
+
+    return result, None
+
+
+# Ошибки разбора одной строки CSV (нет колонки, не число, битая кодировка):
+# строка уходит в карантин, а не останавливает загрузку
+ROW_ERRORS = (KeyError, ValueError, UnicodeDecodeError)
+
+
+def load_batch(conn, cur, batch, categories_list, caches, missing_categories, seen_fmids):
+    """
+    Загружает пачку строк [(row_number, row), ...] в текущей транзакции.
+    Если пачка падает с ошибкой базы (или строка — с ошибкой разбора:
+    ROW_ERRORS) — откатываем её и повторяем построчно, каждую строку в своей
+    точке сохранения (SAVEPOINT): упавшие строки уходят в карантин,
+    остальные загружаются, и чекпоинт идёт дальше.
+    Возвращает (счётчики, отклонённые строки [(row_number, причина, row)]).
+    Коммит делает вызывающий код (вместе с чекпоинтом).
+    """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    rejected = []
+    try:
+        for row_number, row in batch:
+            result, reason = load_row(cur, row, categories_list, caches, missing_categories, seen_fmids)
+            if result == "rejected":
+                rejected.append((row_number, reason, row))
+            else:
+                counts[result] += 1
+        return counts, rejected
+    except (psycopg2.Error,) + ROW_ERRORS as e:
+        print(f"Ошибка в пачке строк {batch[0][0]}–{batch[-1][0]}: {str(e).strip()}. Повторяем построчно.")
+        conn.rollback()
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    rejected = []
+    caches.update(load_caches(cur))
+    for row_number, row in batch:
+        cur.execute("SAVEPOINT load_row")
+        try:
+            result, reason = load_row(cur, row, categories_list, caches, missing_categories, seen_fmids)
+            cur.execute("RELEASE SAVEPOINT load_row")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT load_row")
+            caches.update(load_caches(cur))
+            result, reason = "rejected", f"ошибка базы данных: {str(e).strip()}"
+        except ROW_ERRORS as e:
+            # Строку не удалось разобрать — всё, что она успела записать, откатываем
+            cur.execute("ROLLBACK TO SAVEPOINT load_row")
+            caches.update(load_caches(cur))
+            result, reason = "rejected", f"ошибка разбора строки: {type(e).__name__}: {e}"
+        if result == "rejected":
+            rejected.append((row_number, reason, row))
+        else:
+            counts[result] += 1
+    return counts, rejected
+
+
+def load_data(csv_file=CSV_FILE, delete_missing=False, batch_size=SERIAL_BATCH_ROWS,
+              resume=False, quarantine_file=None):
     """
     Загружает данные из Export.csv в PostgreSQL:
     - Создаёт категории (если не созданы)
     - Добавляет рынки, локации
     - Создаёт связи рынок -> категория
+
+    Повторная загрузка идёт по FMID и updateTime:
+    - рынок с тем же FMID и тем же updateTime пропускается;
+    - рынок с тем же FMID, но новым updateTime обновляется на месте;
+    - delete_missing=True удаляет рынки, которых больше нет в CSV.
+
+    Строки коммитятся пачками по batch_size, вместе с пачкой в load_checkpoints
+    сохраняется позиция в файле. resume=True продолжает с последней
+    сохранённой пачки. Отклонённые строки с причиной пишутся в quarantine_file
+    (по умолчанию <имя CSV>.quarantine.csv), загрузка при этом не останавливается.
     """
+    quarantine_file = quarantine_file or default_quarantine_file(csv_file)
     try:
         # 1. Подключаемся к базе данных
         conn = psycopg2.connect(**DB_CONFIG)
         cur = conn.cursor() # создает курсор: Курсор позволяет выполнять SQL-запросы и получать результаты
 
         # === Шаг 2. Получаем список категорий из заголовка CSV ===
-        with open(CSV_FILE, 'r', encoding='utf-8') as file:
-            header_line = file.readline().strip()
-            columns = header_line.split(",")
+        categories_list = read_categories(csv_file)
+        print("Категории из CSV:", categories_list)  # можно временно оставить
 
-            # Категории начинаются с 29-й колонки (индекс 28) и идут до предпоследней
-            # Последние две колонки — "y" и "x" (координаты), их исключаем
-            categories_list = columns[28:-2]
+        # === Шаг 3. Проверяем, есть ли категории в таблице categories ===
+        ensure_categories(cur, conn, categories_list)
 
-            # Убираем пробелы и лишние символы (на всякий случай)
-            categories_list = [c.strip() for c in categories_list]
+        # === Шаг 4. Кэши id в памяти ===
+        caches = load_caches(cur)
+        # market_hours пуста (таблицу только что добавили) — один раз перечитываем
+        # расписание и у неизменившихся рынков
+        cur.execute("SELECT NOT EXISTS (SELECT 1 FROM market_hours)")
+        caches["refresh_hours"] = cur.fetchone()[0]
 
-            print("Категории из CSV:", categories_list)  # можно временно оставить
+        # === Шаг 5. Откуда начинаем: с начала файла или с чекпоинта ===
+        byte_offset, file_size = csv_data_range(csv_file)
+        row_number = 0
+        if resume:
+            checkpoint = load_checkpoint(cur, csv_file)
+            if checkpoint:
+                byte_offset, row_number = checkpoint
+                print(f"Продолжаем загрузку со строки {row_number + 1} (байт {byte_offset}).")
+            if delete_missing:
+                # Строки до чекпоинта в этом запуске не читаются — по ним нельзя решить, кто пропал
+                print("Предупреждение: --delete-missing не работает вместе с --resume — удаление пропущено.")
+                delete_missing = False
+        elif os.path.exists(quarantine_file):
+            # Новая загрузка с начала — старый карантин больше не актуален
+            os.remove(quarantine_file)
 
+        seen_fmids = set()
+        missing_categories = set()  # сюда запишем категории, которых нет в таблице
+        totals = {"inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0}
 
-        # === Шаг 3. Проверяем, есть ли категории в таблице categories ===
-        cur.execute("SELECT COUNT(*) FROM categories")
-        count = cur.fetchone()[0] 
-        """Выполняется SQL-запрос, который подсчитывает количество записей в таблице categories
-        fetchone() это метод курсора, получает первую строку результата (в виде кортежа)
-        [0] извлекает первый (и единственный) элемент из этого кортежа - собственно число записей
-        Это число сохраняется в переменную count
-        По сути, этот код отвечает на вопрос: "Сколько всего категорий существует в таблице?"
-        Эквивалент на человеческом языке: "Посчитай все записи в таблице categories и скажи мне их количество"."""
-
-        # Если таблица пустая — добавляем все категории
-        if count == 0:
-            print("Добавляем категории в таблицу categories...")
-            for cat in categories_list:
-                # Вставляем каждую категорию (например, "Meat") далее по коду будет %s - placeholder (метка-заполнитель), означает, что на это место будет подставлено значение переменной cat. Вроде как защита от SQL-инъекций
-                cur.execute("INSERT INTO categories (name) VALUES (%s)", (cat,))
+        def flush(batch, next_offset):
+            # Пачка + чекпоинт коммитятся одной транзакцией
+            counts, rejected = load_batch(conn, cur, batch, categories_list, caches,
+                                          missing_categories, seen_fmids)
+            save_checkpoint(cur, csv_file, next_offset, batch[-1][0])
             conn.commit()
-            print("Категории добавлены.")
-        else:
-            print("Категории уже существуют в базе.")
-
-        # === Шаг 4. Открываем CSV-файл для чтения ===
-        with open(CSV_FILE, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)  # Читаем строки как словарь
-            missing_categories = set()  # сюда запишем категории, которых нет в таблице
-            # === Обрабатываем каждую строку (один рынок) ===
-            for row in reader:
-                # Достаём основные поля
-                city = row["city"].strip() if row["city"] else None
-                state = row["State"].strip() if row["State"] else None
-                street = row["street"].strip() if row["street"] else None
-                county = row["County"].strip() if row["County"] else None
-                zip_code = row["zip"].strip() if row["zip"] else None
-
-                # Если нет города или штата — пропускаем (невалидная запись)
-                if not city or not state:
-                    continue
-
-                # === Проверяем, есть ли локация (город + штат + индекс) ===
-                cur.execute("""
-                    SELECT id FROM locations WHERE city=%s AND state=%s AND zip=%s
-                """, (city, state, zip_code))
-                loc = cur.fetchone()
-
-                if loc:
-                    location_id = loc[0]
-                else:
-                    # Если локации нет — добавляем новую
-                    cur.execute("""
-                        INSERT INTO locations (street, city, county, state, zip)
-                        VALUES (%s, %s, %s, %s, %s) RETURNING id
-                    """, (street, city, county, state, zip_code))
-                    location_id = cur.fetchone()[0]
-
-                # Приводим значения к нормализованному виду (убираем пробелы, '' → None)
-                market_fields = (
-                    normalize(row["MarketName"]),
-                    location_id,
-                    normalize(row["Website"]),
-                    normalize(row["Facebook"]),
-                    normalize(row["Twitter"]),
-                    normalize(row["Youtube"]),
-                    normalize(row["OtherMedia"]),
-                    float(row["y"]) if row["y"] else None,
-                    float(row["x"]) if row["x"] else None
-                )
-
-                # Пытаемся вставить рынок
-                cur.execute("""
-                    INSERT INTO markets (name, location_id, website, facebook, twitter, youtube, other_media, latitude, longitude)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (name, location_id, website, facebook, twitter, youtube, other_media, latitude, longitude)
-                    DO NOTHING
-                    RETURNING id
-                """, market_fields)
-
-                result = cur.fetchone()
-
-                if result:
-                    market_id = result[0]
-                else:
-                    # Если рынок уже есть, ищем его ID вручную (учитывая NULL и пробелы)
-                    cur.execute("""
-                        SELECT id FROM markets
-                        WHERE name IS NOT DISTINCT FROM %s
-                        AND location_id IS NOT DISTINCT FROM %s
-                        AND website IS NOT DISTINCT FROM %s
-                        AND facebook IS NOT DISTINCT FROM %s
-                        AND twitter IS NOT DISTINCT FROM %s
-                        AND youtube IS NOT DISTINCT FROM %s
-                        AND other_media IS NOT DISTINCT FROM %s
-                        AND latitude IS NOT DISTINCT FROM %s
-                        AND longitude IS NOT DISTINCT FROM %s
-                    """, market_fields)
-
-                    market_result = cur.fetchone()
-                    if market_result:
-                        market_id = market_result[0]
-                    else:
-                        print("Ошибка: рынок не найден, хотя должен быть уникальным. Пропускаем.")
-                        print("Данные для поиска:", market_fields)
-
-                        continue
-
-
-
-                
-
-                # === Добавляем связи рынок -> категория ===
-                for cat in categories_list:
-                    if row.get(cat) == "Y":
-                        cur.execute("SELECT id FROM categories WHERE name=%s", (cat,))
-                        result = cur.fetchone()
-
-                        if result:
-                            category_id = result[0]
-                            cur.execute("""
-                                INSERT INTO market_categories (market_id, category_id)
-                                VALUES (%s, %s)
-                                ON CONFLICT DO NOTHING
-                            """, (market_id, category_id))
-
-                        else:
-                            if cat not in missing_categories:
-                                print(f"Предупреждение: категория '{cat}' не найдена в таблице.")
-                                missing_categories.add(cat)
-
-
-            # Сохраняем все изменения
+            write_quarantine(quarantine_file, rejected)
+            for key, value in counts.items():
+                totals[key] += value
+            totals["rejected"] += len(rejected)
+
+        # === Шаг 6. Читаем CSV и загружаем пачками ===
+        batch = []
+        for offset, row in iter_csv_records(csv_file, byte_offset, file_size):
+            if len(batch) >= batch_size:
+                flush(batch, offset)
+                batch = []
+            row_number += 1
+            batch.append((row_number, row))
+        if batch:
+            flush(batch, file_size)
+
+        deleted = 0
+        if delete_missing:
+            deleted = delete_missing_markets(cur, seen_fmids)
             conn.commit()
-            print("Данные рынков и категорий загружены в базу.")
+
+        print("Данные рынков и категорий загружены в базу.")
+        print(f"Новых рынков: {totals['inserted']}, обновлено: {totals['updated']}, "
+              f"без изменений: {totals['unchanged']}, удалено: {deleted}.")
+        if totals["rejected"]:
+            print(f"Отклонено строк: {totals['rejected']} (см. {quarantine_file}).")
 
         # ОБЯЗАТЕЛЬНО Закрываем соединение
         cur.close()
@@ -198,8 +594,614 @@ def load_data():
 
     except Exception as e:
         print(f"Ошибка при загрузке данных: {e}")
+        print("Загруженные пачки сохранены — продолжить можно с флагом --resume.")
+
+
+# =======================================================
+# === Bulk-режим: COPY во временную таблицу + set-based SQL ===
+# =======================================================
+
+# Временная таблица, в которую потоком копируется CSV.
+# Значения уже нормализованы в Python (те же правила, что и в normalize()),
+# поэтому дальше SQL сравнивает их «как есть».
+# Колонки, которые заполняет разбор CSV (общие для stage_markets и
+# таблиц процессов-воркеров в параллельном режиме)
+STAGE_DATA_COLUMNS_SQL = """
+        row_no      BIGINT,           -- позиция строки в CSV (байтовое смещение — сохраняет порядок файла)
+        name        TEXT,
+        street      TEXT,
+        city        TEXT,
+        county      TEXT,
+        state       TEXT,
+        zip         TEXT,
+        website     TEXT,
+        facebook    TEXT,
+        twitter     TEXT,
+        youtube     TEXT,
+        other_media TEXT,
+        latitude    NUMERIC(10, 6),   -- тот же тип, что и в markets: сравнение идёт после округления
+        longitude   NUMERIC(10, 6),
+        categories  TEXT[],           -- категории, отмеченные "Y"
+        fmid        BIGINT,           -- FMID из выгрузки
+        hours       TEXT[],           -- расписание: "сезон|день|открытие|закрытие|начало|конец"
+        payment_mask BIGINT,          -- биты способов оплаты (часть markets.flags_mask)
+        -- updateTime из выгрузки (последняя колонка — без комментария в строке,
+        -- чтобы после неё можно было дописать запятую)
+        source_updated_at TIMESTAMP
+"""
+
+STAGE_TABLE_SQL = f"""
+    CREATE TEMP TABLE stage_markets (
+        {STAGE_DATA_COLUMNS_SQL.strip()},
+        action      TEXT DEFAULT 'new', -- new / changed / unchanged (по FMID и updateTime), conflict
+        location_id INT,              -- заполняется на этапе разрешения локаций
+        market_id   INT,              -- заполняется на этапе разрешения рынков
+        -- тот же хэш, что и markets.identity_hash (пересчитывается при заполнении location_id)
+        identity_hash BYTEA GENERATED ALWAYS AS (
+            market_identity_hash(name, location_id, website, facebook, twitter,
+                                 youtube, other_media, latitude, longitude)) STORED
+    ) ON COMMIT DROP
+"""
+
+# Таблица одного воркера (параллельный режим). UNLOGGED — без записи в WAL:
+# это черновик, который после слияния удаляется.
+WORKER_STAGE_TABLE_SQL = """
+    CREATE UNLOGGED TABLE {table} (
+        """ + STAGE_DATA_COLUMNS_SQL.strip() + """
+    )
+"""
+
+STAGE_COLUMNS = (
+    "row_no", "name", "street", "city", "county", "state", "zip",
+    "website", "facebook", "twitter", "youtube", "other_media",
+    "latitude", "longitude", "categories", "fmid", "hours", "payment_mask", "source_updated_at",
+)
+
+# Сверяем строки с уже загруженными рынками по FMID:
+# тот же updateTime -> unchanged (строку дальше не трогаем), другой -> changed.
+# Пока market_hours пуста (таблицу только что добавили), все рынки считаются
+# changed — так расписание один раз заполняется и у старых рынков.
+CLASSIFY_STAGE_SQL = """
+    UPDATE stage_markets s
+    SET market_id = m.id,
+        action = CASE WHEN m.source_updated_at IS NOT DISTINCT FROM s.source_updated_at
+                           AND EXISTS (SELECT 1 FROM market_hours)
+                      THEN 'unchanged' ELSE 'changed' END
+    FROM markets m
+    WHERE m.fmid = s.fmid
+"""
+
+# Новые локации: по одной на (city, state, zip), первая по порядку строка CSV
+# задаёт street/county — как при построчной загрузке.
+# Внешний ORDER BY row_no выдаёт id в порядке файла.
+INSERT_LOCATIONS_SQL = """
+    INSERT INTO locations (street, city, county, state, zip)
+    SELECT street, city, county, state, zip
+    FROM (
+        SELECT DISTINCT ON (s.city, s.state, s.zip)
+               s.row_no, s.street, s.city, s.county, s.state, s.zip
+        FROM stage_markets s
+        WHERE s.action <> 'unchanged'
+          AND NOT EXISTS (
+            SELECT 1 FROM locations l
+            WHERE l.city = s.city AND l.state = s.state
+              AND l.zip IS NOT DISTINCT FROM s.zip
+        )
+        ORDER BY s.city, s.state, s.zip, s.row_no
+    ) first_rows
+    ORDER BY row_no
+"""
+
+RESOLVE_LOCATIONS_SQL = """
+    UPDATE stage_markets s
+    SET location_id = l.id
+    FROM (
+        SELECT city, state, zip, MIN(id) AS id
+        FROM locations
+        GROUP BY city, state, zip
+    ) l
+    WHERE s.action <> 'unchanged'
+      AND l.city = s.city AND l.state = s.state
+      AND l.zip IS NOT DISTINCT FROM s.zip
+"""
+
+# Изменившийся рынок, чьи новые девять полей совпали с другим рынком (уже
+# загруженным или изменённым раньше по файлу), нарушил бы уникальный
+# idx_markets_identity_hash и откатил бы всю загрузку. Такие строки
+# помечаются conflict и дальше не участвуют — как построчная загрузка,
+# которая отклоняет их по ошибке базы.
+MARK_CONFLICTING_CHANGES_SQL = """
+    UPDATE stage_markets s
+    SET action = 'conflict'
+    WHERE s.action = 'changed'
+      AND (
+        EXISTS (SELECT 1 FROM markets m
+                WHERE m.identity_hash = s.identity_hash AND m.id <> s.market_id)
+        OR EXISTS (SELECT 1 FROM stage_markets o
+                   WHERE o.action = 'changed' AND o.identity_hash = s.identity_hash
+                     AND o.market_id <> s.market_id AND o.row_no < s.row_no)
+      )
+"""
+
+CONFLICTING_CHANGES_SQL = """
+    SELECT fmid, name
+    FROM stage_markets
+    WHERE action = 'conflict'
+    ORDER BY row_no
+"""
+
+# Изменившиеся в выгрузке рынки обновляются на месте (id и отзывы сохраняются)
+UPDATE_CHANGED_MARKETS_SQL = """
+    UPDATE markets m
+    SET name = s.name, location_id = s.location_id, website = s.website,
+        facebook = s.facebook, twitter = s.twitter, youtube = s.youtube,
+        other_media = s.other_media, latitude = s.latitude, longitude = s.longitude,
+        source_updated_at = s.source_updated_at, flags_mask = s.payment_mask
+    FROM stage_markets s
+    WHERE s.action = 'changed' AND m.id = s.market_id
+"""
+
+# Набор категорий у изменившегося рынка тоже мог поменяться — связи пересоздаются
+DELETE_CHANGED_LINKS_SQL = """
+    DELETE FROM market_categories mc
+    USING stage_markets s
+    WHERE s.action = 'changed' AND mc.market_id = s.market_id
+"""
+
+# Ключ дедупликации — хэш девяти колонок (markets.identity_hash).
+# В отличие от старого девятиколоночного UNIQUE хэш не считает NULL-ы разными,
+# поэтому ON CONFLICT сам отсекает уже загруженные рынки.
+# DISTINCT ON + ORDER BY row_no: из дубликатов внутри файла побеждает первая строка.
+INSERT_MARKETS_SQL = """
+    INSERT INTO markets (name, location_id, website, facebook, twitter, youtube, other_media, latitude, longitude,
+                         fmid, source_updated_at, flags_mask)
+    SELECT name, location_id, website, facebook, twitter, youtube, other_media, latitude, longitude,
+           fmid, source_updated_at, payment_mask
+    FROM (
+        SELECT DISTINCT ON (s.identity_hash) s.*
+        FROM stage_markets s
+        WHERE s.action = 'new'
+        ORDER BY s.identity_hash, s.row_no
+    ) first_rows
+    ORDER BY row_no
+    ON CONFLICT (identity_hash) DO NOTHING
+"""
+
+RESOLVE_MARKETS_SQL = """
+    UPDATE stage_markets s
+    SET market_id = m.id
+    FROM markets m
+    WHERE s.action = 'new'
+      AND m.identity_hash = s.identity_hash
+"""
+
+# Рынки, загруженные до появления колонки fmid, привязываются к FMID
+# первой (по порядку файла) строки, которая на них указывает.
+ADOPT_LEGACY_MARKETS_SQL = """
+    UPDATE markets m
+    SET fmid = s.fmid, source_updated_at = s.source_updated_at
+    FROM (
+        SELECT DISTINCT ON (market_id) market_id, fmid, source_updated_at
+        FROM stage_markets
+        WHERE action = 'new' AND market_id IS NOT NULL AND fmid IS NOT NULL
+        ORDER BY market_id, row_no
+    ) s
+    WHERE m.id = s.market_id AND m.fmid IS NULL
+      AND NOT EXISTS (SELECT 1 FROM markets other WHERE other.fmid = s.fmid)
+"""
+
+INSERT_MARKET_CATEGORIES_SQL = """
+    INSERT INTO market_categories (market_id, category_id)
+    SELECT DISTINCT s.market_id, c.id
+    FROM stage_markets s
+    CROSS JOIN LATERAL unnest(s.categories) AS flag(name)
+    JOIN categories c ON c.name = flag.name
+    WHERE s.market_id IS NOT NULL AND s.action IN ('new', 'changed')
+    ON CONFLICT DO NOTHING
+"""
+
+# Расписание затронутых рынков пересоздаётся целиком
+DELETE_STAGE_HOURS_SQL = """
+    DELETE FROM market_hours h
+    USING stage_markets s
+    WHERE s.action IN ('new', 'changed') AND h.market_id = s.market_id
+"""
+
+# Если на один рынок указывают несколько строк CSV, берём последнюю —
+# как построчная загрузка, где каждая строка перезаписывает расписание.
+INSERT_MARKET_HOURS_SQL = """
+    INSERT INTO market_hours (market_id, season_no, weekday, open_minute, close_minute,
+                              season_start, season_end)
+    SELECT s.market_id,
+           split_part(item, '|', 1)::smallint,
+           split_part(item, '|', 2)::smallint,
+           split_part(item, '|', 3)::smallint,
+           split_part(item, '|', 4)::smallint,
+           NULLIF(split_part(item, '|', 5), '')::date,
+           NULLIF(split_part(item, '|', 6), '')::date
+    FROM (
+        SELECT DISTINCT ON (market_id) market_id, hours
+        FROM stage_markets
+        WHERE market_id IS NOT NULL AND action IN ('new', 'changed')
+        ORDER BY market_id, row_no DESC
+    ) s
+    CROSS JOIN LATERAL unnest(s.hours) AS item
+"""
+
+# Рынки из выгрузки, которых больше нет в CSV
+DELETE_MISSING_MARKETS_SQL = """
+    DELETE FROM markets m
+    WHERE m.fmid IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM stage_markets s WHERE s.fmid = m.fmid)
+"""
+
+
+def _array_literal(values):
+    """
+    Список строк -> литерал массива PostgreSQL для COPY: {Meat,Cheese}.
+    Элементы — имена категорий (заголовки CSV) или строки расписания
+    (цифры, даты и "|"), экранирование не нужно.
+    """
+    return "{" + ",".join(values) + "}"
+
+
+def stage_row(row_no, row, categories_list, payment_bits):
+    """
+    Превращает строку CSV (словарь из DictReader) в кортеж для stage_markets.
+    Возвращает None, если строка невалидна (нет города, штата или названия,
+    неверные координаты, битая кодировка, неверное число полей) — те же строки,
+    что отклоняет load_row().
+    """
+    if wrong_field_count(row) or bad_encoding(row):
+        return None
+    city = row["city"].strip() if row["city"] else None
+    state = row["State"].strip() if row["State"] else None
+    name = normalize(row["MarketName"])
+    if not city or not state or not name:
+        return None
+    # Одна строка с "abc" вместо координаты не должна ронять весь COPY (и процесс-воркер)
+    try:
+        latitude = float(row["y"]) if row["y"] else None
+        longitude = float(row["x"]) if row["x"] else None
+    except ValueError:
+        return None
+
+    return (
+        row_no,
+        name,
+        row["street"].strip() if row["street"] else None,
+        city,
+        row["County"].strip() if row["County"] else None,
+        state,
+        row["zip"].strip() if row["zip"] else None,
+        normalize(row["Website"]),
+        normalize(row["Facebook"]),
+        normalize(row["Twitter"]),
+        normalize(row["Youtube"]),
+        normalize(row["OtherMedia"]),
+        latitude,
+        longitude,
+        _array_literal([cat for cat in categories_list if row.get(cat) == "Y"]),
+        parse_fmid(row.get("FMID")),
+        _array_literal(["|".join("" if v is None else str(v) for v in h) for h in parse_schedule(row)]),
+        payment_mask(row, payment_bits),
+        parse_update_time(row.get("updateTime")),
+    )
+
+
+def csv_data_range(csv_file):
+    """
+    Возвращает (начало данных, размер файла) в байтах: данные начинаются
+    сразу после строки заголовка.
+    """
+    with open(csv_file, 'rb') as f:
+        f.readline()
+        return f.tell(), os.path.getsize(csv_file)
+
+
+def split_csv_chunks(csv_file, parts):
+    """
+    Делит данные CSV на parts диапазонов байт [start, end).
+    Граница куска ставится только на начало записи: идём по строкам файла
+    и считаем кавычки — конец строки завершает запись, только если кавычек
+    до него чётное число (поле в кавычках с переносом строки закрыто).
+    Так каждая запись достаётся ровно одному куску и не разрезается.
+    """
+    data_start, size = csv_data_range(csv_file)
+    step = max(1, (size - data_start) // parts)
+    targets = [data_start + i * step for i in range(1, parts)]
+    bounds = [data_start]
+    with open(csv_file, 'rb') as f:
+        f.seek(data_start)
+        quotes = 0
+        for line in iter(f.readline, b''):
+            if not targets:
+                break
+            quotes += line.count(b'"')
+            if quotes % 2 == 0 and f.tell() >= targets[0]:
+                bounds.append(f.tell())
+                while targets and targets[0] <= f.tell():
+                    targets.pop(0)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def iter_csv_dicts(csv_file):
+    """
+    Читает весь CSV через csv.DictReader (однопроцессный bulk-режим).
+    Возвращает пары (номер последней строки файла у записи, словарь).
+    Номер растёт по файлу, как и смещение у iter_csv_records(), поэтому
+    порядок строк в stage_markets тот же, что и в параллельном режиме.
+    """
+    # Не UTF-8 — битые байты становятся U+FFFD, строку отклонит bad_encoding()
+    with open(csv_file, newline='', encoding='utf-8', errors='replace') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def iter_csv_records(csv_file, start, end):
+    """
+    Читает записи CSV, которые НАЧИНАЮТСЯ в диапазоне байт [start, end).
+    start должен быть началом записи: началом данных, чекпоинтом или
+    границей из split_csv_chunks().
+    Возвращает пары (смещение записи в файле, словарь как у DictReader).
+    Смещение уникально и растёт по файлу — им и нумеруем строки (row_no),
+    поэтому порядок одинаков при любом числе кусков.
+    Разбирает настоящий csv.reader: поле в кавычках с переносом строки
+    остаётся одной записью. Смещение берём через f.tell() перед каждой
+    записью — reader читает файл лениво, по строкам, поэтому tell()
+    указывает ровно на начало следующей записи.
+    Лишние поля, как у DictReader, лежат списком под ключом None, недостающие
+    равны None — такую запись отклоняет wrong_field_count().
+    """
+    with open(csv_file, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8')]))
+        f.seek(max(start, f.tell()))
+        # Не UTF-8 — не падаем: битые байты становятся U+FFFD, и строку
+        # отклоняет bad_encoding() (а чекпоинт идёт дальше)
+        lines = (line.decode('utf-8', errors='replace') for line in iter(f.readline, b''))
+        reader = csv.reader(lines)
+        while True:
+            offset = f.tell()
+            if offset >= end:
+                break
+            values = next(reader, None)
+            if values is None:
+                break
+            if not values:
+                # Пустая строка
+                continue
+            row = dict(zip(header, values))
+            if len(values) > len(header):
+                row[None] = values[len(header):]
+            else:
+                for column in header[len(values):]:
+                    row[column] = None
+            yield offset, row
+
+
+def copy_rows(cur, table, columns, rows):
+    """
+    Отправляет пачку кортежей в таблицу одной командой COPY FROM STDIN.
+    None превращается в пустое поле без кавычек — для COPY (FORMAT csv) это NULL.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def stage_chunk(cur, table, records, categories_list, batch_rows=BULK_BATCH_ROWS):
+    """
+    Разбирает записи CSV [(row_no, словарь), ...] и пачками копирует их в таблицу table.
+    Возвращает (строк в куске, принято строк).
+    """
+    payment_bits = load_payment_bits(cur)
+    total_rows = 0
+    staged_rows = 0
+    batch = []
+    for row_no, row in records:
+        total_rows += 1
+        staged = stage_row(row_no, row, categories_list, payment_bits)
+        if staged is None:
+            continue
+        batch.append(staged)
+        if len(batch) >= batch_rows:
+            copy_rows(cur, table, STAGE_COLUMNS, batch)
+            staged_rows += len(batch)
+            batch = []
+    if batch:
+        copy_rows(cur, table, STAGE_COLUMNS, batch)
+        staged_rows += len(batch)
+    return total_rows, staged_rows
+
+
+def _stage_chunk_worker(task):
+    """
+    Процесс-воркер параллельного режима: своё подключение, своя UNLOGGED-таблица.
+    """
+    table, csv_file, start, end, categories_list, batch_rows = task
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(WORKER_STAGE_TABLE_SQL.format(table=table))
+            counts = stage_chunk(cur, table, iter_csv_records(csv_file, start, end),
+                                 categories_list, batch_rows)
+        conn.commit()
+        return counts
+    finally:
+        conn.close()
+
+
+def stage_parallel(cur, csv_file, categories_list, worker_tables, batch_rows=BULK_BATCH_ROWS):
+    """
+    Параллельный разбор: куски CSV обрабатывают процессы (по одному на таблицу
+    из worker_tables), затем их таблицы сливаются в stage_markets одним INSERT ... SELECT.
+    Удаляет таблицы воркеров вызывающий код — drop_worker_tables().
+    Возвращает (строк в CSV, принято строк).
+    """
+    chunks = split_csv_chunks(csv_file, len(worker_tables))
+    tasks = [(table, csv_file, start, end, categories_list, batch_rows)
+             for table, (start, end) in zip(worker_tables, chunks)]
+    with multiprocessing.Pool(processes=len(tasks)) as pool:
+        counts = pool.map(_stage_chunk_worker, tasks)
+
+    columns = ", ".join(STAGE_COLUMNS)
+    union = " UNION ALL ".join(f"SELECT {columns} FROM {task[0]}" for task in tasks)
+    cur.execute(f"INSERT INTO stage_markets ({columns}) {union}")
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+def drop_worker_tables(worker_tables):
+    """
+    Удаляет таблицы воркеров. Вызывается после того, как основное подключение
+    закрыто: иначе DROP ждал бы блокировок его незавершённой транзакции.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    with conn, conn.cursor() as cur:
+        for table in worker_tables:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.close()
+
+
+def merge_stage(cur, delete_missing=False):
+    """
+    Разрешает staging-таблицу в locations, markets и market_categories.
+    Строки с известным FMID и тем же updateTime пропускаются, с новым
+    updateTime — обновляются на месте. delete_missing=True удаляет рынки,
+    которых нет в staging.
+    Возвращает словарь со счётчиками.
+    """
+    stats = {}
+    cur.execute("ANALYZE stage_markets")
+
+    cur.execute(CLASSIFY_STAGE_SQL)
+    cur.execute("SELECT COUNT(*) FILTER (WHERE action = 'unchanged'), COUNT(*) FROM stage_markets")
+    stats["unchanged"], staged = cur.fetchone()
+
+    cur.execute(INSERT_LOCATIONS_SQL)
+    stats["locations"] = cur.rowcount
+    cur.execute(RESOLVE_LOCATIONS_SQL)
+
+    cur.execute(MARK_CONFLICTING_CHANGES_SQL)
+    stats["conflicts"] = cur.rowcount
+    if stats["conflicts"]:
+        cur.execute(CONFLICTING_CHANGES_SQL + " LIMIT 10")
+        print(f"Предупреждение: {stats['conflicts']} изменённых рынков совпали с другим рынком "
+              f"по девяти полям и пропущены (первые по файлу):")
+        for fmid, name in cur.fetchall():
+            print(f"  FMID {fmid}: {name}")
+
+    cur.execute(UPDATE_CHANGED_MARKETS_SQL)
+    stats["updated"] = cur.rowcount
+    cur.execute(DELETE_CHANGED_LINKS_SQL)
+
+    cur.execute(INSERT_MARKETS_SQL)
+    stats["markets"] = cur.rowcount
+    cur.execute(RESOLVE_MARKETS_SQL)
+    cur.execute(ADOPT_LEGACY_MARKETS_SQL)
+
+    cur.execute(INSERT_MARKET_CATEGORIES_SQL)
+    stats["market_categories"] = cur.rowcount
+
+    cur.execute(DELETE_STAGE_HOURS_SQL)
+    cur.execute(INSERT_MARKET_HOURS_SQL)
+    stats["market_hours"] = cur.rowcount
+
+    stats["deleted"] = 0
+    if delete_missing:
+        if staged:
+            cur.execute(DELETE_MISSING_MARKETS_SQL)
+            stats["deleted"] = cur.rowcount
+        else:
+            # Пустой/битый файл не должен стирать всю базу
+            print("Предупреждение: в CSV нет ни одной валидной строки — удаление пропущено.")
+    return stats
+
+
+def load_data_bulk(csv_file=CSV_FILE, batch_rows=BULK_BATCH_ROWS, delete_missing=False, workers=1):
+    """
+    Пакетная загрузка Export.csv:
+    1) строки CSV нормализуются и пачками уходят в stage_markets через COPY
+       (при workers > 1 — параллельно, кусками по границам записей);
+    2) локации, рынки и связи с категориями создаются set-based запросами.
+    Семантика та же, что у load_data(): ключ дедупликации markets.identity_hash,
+    правила normalize() для ссылок, первая строка CSV выигрывает,
+    повторная загрузка пропускает/обновляет рынки по FMID и updateTime.
+    Результат (id и строки) не зависит от числа воркеров.
+    """
+    # Таблицы воркеров параллельного режима (имена уникальны для процесса)
+    worker_tables = [f"stage_markets_{os.getpid()}_{n}" for n in range(workers)] if workers > 1 else []
+    conn = None
+    try:
+        started = time.perf_counter()
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+
+        categories_list = read_categories(csv_file)
+        ensure_categories(cur, conn, categories_list)
+
+        cur.execute(STAGE_TABLE_SQL)
+
+        # === Потоковое копирование CSV в staging ===
+        if worker_tables:
+            total_rows, staged_rows = stage_parallel(cur, csv_file, categories_list, worker_tables, batch_rows)
+        else:
+            total_rows, staged_rows = stage_chunk(cur, "stage_markets", iter_csv_dicts(csv_file),
+                                                  categories_list, batch_rows)
+
+        # === Set-based разрешение ключей ===
+        stats = merge_stage(cur, delete_missing=delete_missing)
+        conn.commit()
+
+        cur.close()
+        conn.close()
+        conn = None
+        if worker_tables:
+            drop_worker_tables(worker_tables)
+
+        elapsed = time.perf_counter() - started
+        rate = total_rows / elapsed if elapsed > 0 else 0.0
+        print(f"Bulk-загрузка: строк в CSV {total_rows}, принято {staged_rows}, пропущено {total_rows - staged_rows}.")
+        print(f"Новых локаций: {stats['locations']}, рынков: {stats['markets']}, связей с категориями: {stats['market_categories']}, "
+              f"строк расписания: {stats['market_hours']}.")
+        print(f"Обновлено рынков: {stats['updated']}, без изменений: {stats['unchanged']}, "
+              f"конфликтов: {stats['conflicts']}, удалено: {stats['deleted']}.")
+        print(f"Время: {elapsed:.2f} с ({rate:.0f} строк/с).")
+        return stats
+
+    except Exception as e:
+        print(f"Ошибка при bulk-загрузке данных: {e}")
+        # Откатываем незавершённую загрузку и убираем таблицы воркеров
+        if conn is not None:
+            conn.close()
+        if worker_tables:
+            drop_worker_tables(worker_tables)
 
 
 # === Точка входа ===
 if __name__ == "__main__":
-    load_data()
+    parser = argparse.ArgumentParser(description="Загрузка Export.csv в PostgreSQL")
+    parser.add_argument("--csv", default=CSV_FILE, help="путь к CSV-файлу (по умолчанию setup/Export.csv)")
+    parser.add_argument("--bulk", action="store_true", help="пакетная загрузка через COPY (быстро для больших файлов)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="число процессов для разбора CSV (больше 1 — включает --bulk)")
+    parser.add_argument("--resume", action="store_true",
+                        help="продолжить построчную загрузку с последней сохранённой пачки")
+    parser.add_argument("--batch-size", type=int, default=SERIAL_BATCH_ROWS,
+                        help="строк в одной транзакции построчной загрузки")
+    parser.add_argument("--quarantine", default=None,
+                        help="куда писать отклонённые строки (по умолчанию <CSV>.quarantine.csv)")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="удалить рынки, которых больше нет в CSV (по FMID)")
+    args = parser.parse_args()
+
+    if args.bulk or args.workers > 1:
+        load_data_bulk(args.csv, delete_missing=args.delete_missing, workers=args.workers)
+    else:
+        load_data(args.csv, delete_missing=args.delete_missing, batch_size=args.batch_size,
+                  resume=args.resume, quarantine_file=args.quarantine)
@@ -10,7 +10,12 @@
 # ===========================================================
 
 from .db import execute_query  # импортируем функцию, которая выполняет SQL-запросы
-from .utils import validate_id, validate_coordinates, paginate # импортируем функции для проверки ввода и навигации
+from .geo_index import search_radius, market_deleted, nearest_markets_sql  # гео-индекс в памяти (KD-дерево)
+from .distance_engine import distance_page, reset_distance_engine  # сортировка по расстоянию в NumPy
+from .keyset import KeysetPager  # keyset-пагинация: соседние страницы по ключу, без больших OFFSET
+from .totals import count_total, invalidate_totals  # число строк: из кеша или оценка вместо COUNT(*) каждый раз
+from .schedule import format_hours_row  # строка расписания: "Sat 09:00–13:00 (сезон)"
+from .utils import validate_id, validate_coordinates, paginate, bbox_condition, geohash_condition # импортируем функции для проверки ввода и навигации
 # ===========================================================
 # 1. Список рынков с пагинацией
 # ===========================================================
@@ -20,24 +25,24 @@ def show_markets():
     
     # Получаем общее количество рынков
     count_query = "SELECT COUNT(*) FROM markets"
-    total = execute_query(count_query, fetch=True)[0]['count'] # вытаскиваем число из результата
+    total = count_total(count_query) # число рынков (из кеша или оценка планировщика — см. totals.py)
 
+    # SQL-запрос выводит id, имя, город, штат, рейтинг и число отзывов
+    # (рейтинг и число отзывов — готовые из market_rating_summary, без агрегации reviews)
+    # (ORDER BY и LIMIT добавляет пейджер: следующая страница — WHERE id > последний id)
+    query = """
+        SELECT m.id, m.name, l.city, l.state,
+               COALESCE(s.avg_rating, 0) AS avg_rating,
+               COALESCE(s.review_count, 0) AS review_count
+        FROM markets m
+        JOIN locations l ON m.location_id = l.id
+        LEFT JOIN market_rating_summary s ON s.market_id = m.id
+    """
+    pager = KeysetPager([("id", "ASC")])
 
     while True:
-        # SQL-запрос выводит id, имя, город, штат, рейтинг и число отзывов
-        query = """
-            SELECT m.id, m.name, l.city, l.state,
-                   COALESCE(AVG(r.rating), 0) AS avg_rating,
-                   COUNT(r.id) AS review_count
-            FROM markets m
-            JOIN locations l ON m.location_id = l.id
-            LEFT JOIN reviews r ON r.market_id = m.id
-            GROUP BY m.id, l.city, l.state
-            ORDER BY m.id
-            LIMIT %s OFFSET %s
-        """
         # Выполняем запрос и получаем результат
-        results = execute_query(query, (per_page, offset), fetch=True)
+        results = pager.fetch(execute_query, query, (), total, per_page, offset)
 
         if not results:
             print("Больше данных нет.")
@@ -71,8 +76,6 @@ def search_market():
         WHERE (%s = '' OR l.city ILIKE %s)
           AND (%s = '' OR l.state ILIKE %s)
           AND (%s = '' OR l.zip = %s)
-        ORDER BY m.id
-        LIMIT %s OFFSET %s
     """
 
     # Считаем общее количество подходящих строк
@@ -86,7 +89,7 @@ def search_market():
     """
 
     params = (city, f"%{city}%", state, f"%{state}%", zip_code, zip_code)
-    total = execute_query(count_query, params, fetch=True)[0]['count']
+    total = count_total(count_query, params)
 
     if total == 0:
         print("Ничего не найдено.")
@@ -94,11 +97,11 @@ def search_market():
 
     per_page = 20
     offset = 0
+    pager = KeysetPager([("id", "ASC")])  # страницы по ключу id (ORDER BY id)
 
     while True:
         print(f"\n=== Найдено {total} рынков ===")
-        query_params = (*params, per_page, offset)
-        results = execute_query(base_query, query_params, fetch=True)
+        results = pager.fetch(execute_query, base_query, params, total, per_page, offset)
 
         for r in results:
             print(f"{r['id']}. {r['name']} ({r['city']}, {r['state']} ZIP: {r['zip']})")
@@ -141,6 +144,21 @@ def show_market_details():
     print(f"Youtube: {d['youtube']}")
     print(f"Other: {d['other_media']}")
 
+    # Расписание (разобрано при загрузке в market_hours)
+    hours = execute_query("""
+        SELECT weekday, open_minute, close_minute, season_start, season_end
+        FROM market_hours
+        WHERE market_id = %s
+        ORDER BY season_no, weekday, open_minute
+    """, (market_id,), fetch=True)
+    print("\nРасписание:")
+    if hours:
+        for h in hours:
+            print("  " + format_hours_row(h["weekday"], h["open_minute"], h["close_minute"],
+                                          h["season_start"], h["season_end"]))
+    else:
+        print("Нет расписания.")
+
     # Далее — получаем и выводим отзывы
     print("\nОтзывы:")
     reviews = execute_query("SELECT id, user_name, rating, review_text FROM reviews WHERE market_id = %s",
@@ -176,46 +194,48 @@ def sort_markets():
     per_page = 20
     offset = 0
     
-    # Получаем общее количество рынков для правильной пагинации
-    total_query = "SELECT COUNT(*) FROM markets"
-    total = execute_query(total_query, fetch=True)[0]['count']
+    # Сортировки 1–3 листаются keyset-пейджером: запрос-источник без ORDER BY/LIMIT
+    # и ключ сортировки (последним — уникальный id, чтобы порядок был однозначным)
+    pager = None
+    source_query = None
 
     # Вариант сортировки: по рейтингу
     if choice == "1":
-        order_clause = f"ORDER BY avg_rating {direction}"
-        
-        # Используем шаблон SQL-запроса с группировкой по рынкам
-        query_template = f"""
-            SELECT m.id, m.name, l.city, l.state, COALESCE(AVG(r.rating), 0) AS avg_rating
+        source_query = """
+            SELECT m.id, m.name, l.city, l.state, s.avg_rating, s.review_count
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            LEFT JOIN reviews r ON r.market_id = m.id
-            GROUP BY m.id, l.city, l.state
-            {{order}}
-            LIMIT %s OFFSET %s
+            JOIN market_rating_summary s ON s.market_id = m.id
+        """
+        # Рейтинг — из market_rating_summary; порядок как у индексов idx_rating_summary_top/low
+        pager = KeysetPager([("avg_rating", direction), ("review_count", "DESC"), ("id", "ASC")])
+        # Считаем с теми же JOIN, что и страницы: иначе число страниц разойдётся со строками
+        count_query = """
+            SELECT COUNT(*)
+            FROM markets m
+            JOIN locations l ON m.location_id = l.id
+            JOIN market_rating_summary s ON s.market_id = m.id
         """
     
     # Сортировка по городу
     elif choice == "2":
-        order_clause = f"ORDER BY l.city {direction}"
-        query_template = f"""
+        source_query = """
             SELECT m.id, m.name, l.city, l.state
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            {{order}}
-            LIMIT %s OFFSET %s
         """
+        pager = KeysetPager([("city", direction), ("id", "ASC")])
+        count_query = "SELECT COUNT(*) FROM markets m JOIN locations l ON m.location_id = l.id"
     
     # Сортировка по штату
     elif choice == "3":
-        order_clause = f"ORDER BY l.state {direction}"
-        query_template = f"""
+        source_query = """
             SELECT m.id, m.name, l.city, l.state
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            {{order}}
-            LIMIT %s OFFSET %s
         """
+        pager = KeysetPager([("state", direction), ("id", "ASC")])
+        count_query = "SELECT COUNT(*) FROM markets m JOIN locations l ON m.location_id = l.id"
         
     # Сортировка по расстоянию — отдельный случай, нужна координата
     else:  
@@ -242,7 +262,6 @@ def sort_markets():
             SELECT COUNT(*) FROM markets
             WHERE latitude IS NOT NULL AND longitude IS NOT NULL
         """
-        total = execute_query(count_query, fetch=True)[0]['count']
 
         order_clause = f"ORDER BY distance {direction}"
         
@@ -261,11 +280,26 @@ def sort_markets():
             LIMIT %s OFFSET %s
         """
 
+    # Общее количество строк выбранной сортировки — для правильной пагинации
+    total = count_total(count_query)
+
     # Основной цикл вывода отсортированных данных с постраничным просмотром
     while True:
-        # Вставляем нужный order_by в шаблон запроса
-        query = query_template.format(order=order_clause)
-        results = execute_query(query, (per_page, offset), fetch=True)
+        results = None
+        if choice == "4":
+            # Сортировка по расстоянию — в памяти (NumPy): первая страница без полной
+            # сортировки, следующие — срез готового порядка (None — движок недоступен)
+            results = distance_page(lat, lon, per_page, offset, descending=(direction == "DESC"))
+            if results is None and direction == "ASC":
+                # Без индекса — SQL по ячейкам geohash расширяющимися кругами:
+                # читаются только рынки рядом с точкой, а не вся таблица
+                results = nearest_markets_sql(lat, lon, offset + per_page)[offset:]
+        elif pager is not None:
+            results = pager.fetch(execute_query, source_query, (), total, per_page, offset)
+        if results is None:
+            # Вставляем нужный order_by в шаблон запроса
+            query = query_template.format(order=order_clause)
+            results = execute_query(query, (per_page, offset), fetch=True)
         if not results:
             print("Больше данных нет.")
             break
@@ -304,10 +338,23 @@ def search_by_radius():
         else:
             print("Повторите ввод координат.\n")
 
-    # SQL-запрос: считаем расстояние от введённой точки до каждого рынка
+    # Быстрый путь: гео-индекс в памяти отвечает без расчёта расстояний в базе
+    found = search_radius(lat, lon, 30, limit=20)
+    if found is not None:
+        _, results = found
+        _print_radius_results(results)
+        return
+
+    # Запасной путь — SQL. Сначала отбираем рынки в ячейках geohash вокруг точки
+    # (диапазоны по индексу idx_markets_geohash) и в прямоугольнике вокруг неё,
+    # чтобы формулу расстояния база считала не для всей таблицы
+    geo_sql, geo_params = geohash_condition(lat, lon, 30)
+    bbox_sql, bbox_params = bbox_condition(lat, lon, 30)
+
+    # SQL-запрос: считаем расстояние от введённой точки до каждого рынка в прямоугольнике
     # Используем формулу "Haversine" через функцию acos для расчёта расстояния в милях
     # 3959 — радиус Земли в милях
-    query = """
+    query = f"""
         SELECT m.id, m.name, l.city, l.state,
         (3959 * acos(
             cos(radians(%s)) * cos(radians(m.latitude)) *
@@ -316,7 +363,9 @@ def search_by_radius():
         )) AS distance
         FROM markets m
         JOIN locations l ON m.location_id = l.id
-        WHERE (3959 * acos(
+        WHERE {geo_sql}
+          AND {bbox_sql}
+          AND (3959 * acos(
             cos(radians(%s)) * cos(radians(m.latitude)) *
             cos(radians(m.longitude) - radians(%s)) +
             sin(radians(%s)) * sin(radians(m.latitude))
@@ -324,10 +373,14 @@ def search_by_radius():
         ORDER BY distance ASC
         LIMIT 20
     """
-    # Параметры передаём 6 раз — т.к. формула дублируется в SELECT и WHERE
-    params = (lat, lon, lat, lat, lon, lat)
+    # Параметры формулы передаём дважды — т.к. она дублируется в SELECT и WHERE,
+    # между ними — ячейки geohash и границы прямоугольника
+    params = (lat, lon, lat) + geo_params + bbox_params + (lat, lon, lat)
     results = execute_query(query, params, fetch=True)
+    _print_radius_results(results)
+
 
+def _print_radius_results(results):
     if results:
         print("\n=== Рынки в радиусе 30 миль ===")
         for r in results:
@@ -349,6 +402,9 @@ def delete_market():
     if confirm == "y":
         # Удаляем рынок из таблицы markets по ID
         execute_query("DELETE FROM markets WHERE id = %s", (market_id,))
+        market_deleted(market_id)  # убираем рынок и из гео-индекса
+        reset_distance_engine()  # и из движка расстояний (перечитает координаты)
+        invalidate_totals()  # запомненные числа рынков устарели
         print("Рынок удалён.")
     else:
         print("Удаление отменено.")
@@ -1,4 +1,5 @@
 from .db import execute_query           # импортируем функцию для работы с БД
+from .totals import invalidate_totals   # сбрасываем запомненные числа строк после записи
 from prompt_toolkit import prompt       # современный безопасный ввод
 
 # ===========================================================
@@ -36,6 +37,7 @@ def add_review():
         "INSERT INTO reviews (market_id, user_name, rating, review_text) VALUES (%s, %s, %s, %s)",
         (market_id, user_name, rating, review_text)
     )
+    invalidate_totals()
     print("Отзыв добавлен.")
 
 # ===========================================================
@@ -50,4 +52,5 @@ def delete_review():
         print("Ошибка: ID должен быть числом.")
         
     execute_query("DELETE FROM reviews WHERE id = %s", (review_id,))
+    invalidate_totals()
     print("Отзыв удалён.")
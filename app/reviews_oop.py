@@ -7,6 +7,7 @@
 # ===========================================================
 
 from .db import execute_query  # берём готовую функцию работы с БД (подключение, курсор и т.п.)
+from .totals import invalidate_totals  # сбрасываем запомненные числа строк после записи
 from prompt_toolkit import prompt 
 
 class ReviewManager:
@@ -55,6 +56,7 @@ class ReviewManager:
             "INSERT INTO reviews (market_id, user_name, rating, review_text) VALUES (%s, %s, %s, %s)",
             (market_id, user_name, rating, review_text)
         )
+        invalidate_totals()
         print("Отзыв добавлен.")
 
     # ===========================================================
@@ -69,4 +71,5 @@ class ReviewManager:
             print("Ошибка: ID должен быть числом.")
             
         execute_query("DELETE FROM reviews WHERE id = %s", (review_id,))
+        invalidate_totals()
         print("Отзыв удалён.")
\ No newline at end of file
@@ -0,0 +1,136 @@
+# schedule.py
+# =======================================================
+# Разбор расписания рынка из колонок Export.csv:
+#   Season1Date..Season4Date — даты сезона, например "06/06/2020 to 09/26/2020"
+#   Season1Time..Season4Time — часы работы, например "Wed: 9:00 AM-1:00 PM;Sat: 8:00 AM-12:00 PM;"
+#
+# Результат — строки для таблицы market_hours:
+#   (season_no, weekday, open_minute, close_minute, season_start, season_end)
+# weekday — ISO-номер дня (1 = понедельник ... 7 = воскресенье), как EXTRACT(ISODOW) в PostgreSQL.
+# open_minute / close_minute — минуты от полуночи (9:00 AM -> 540).
+#
+# Разбираем один раз при загрузке, чтобы запросы вида «открыт сейчас» /
+# «открыт в субботу утром» / «работает в июне» шли по индексу, а не по тексту.
+# =======================================================
+
+import re
+from datetime import datetime
+
+# Сколько сезонов в CSV (Season1..Season4)
+SEASON_COUNT = 4
+
+# Дни недели в формате CSV -> ISO-номер
+WEEKDAYS = {"Mon": 1, "Tue": 2, "Wed": 3, "Thu": 4, "Fri": 5, "Sat": 6, "Sun": 7}
+
+# Короткие названия для вывода (индекс = ISO-номер дня)
+WEEKDAY_NAMES = ["", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Один интервал: "Sat: 9:00 AM-1:00 PM"
+TIME_RANGE_RE = re.compile(
+    r"^\s*(Mon|Tue|Wed|Thu|Fri|Sat|Sun)\s*:\s*"
+    r"(\d{1,2}):(\d{2})\s*(AM|PM)\s*-\s*(\d{1,2}):(\d{2})\s*(AM|PM)\s*$",
+    re.IGNORECASE,
+)
+
+DATE_FORMAT = "%m/%d/%Y"
+
+
+def _to_minutes(hours, minutes, am_pm):
+    """
+    "1", "30", "PM" -> 810 (минуты от полуночи)
+    """
+    hours = int(hours) % 12
+    if am_pm.upper() == "PM":
+        hours += 12
+    return hours * 60 + int(minutes)
+
+
+def _parse_date(text):
+    """
+    "06/06/2020" -> date (или None, если формат другой)
+    """
+    try:
+        return datetime.strptime(text.strip(), DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def parse_season_dates(text):
+    """
+    Даты сезона -> (начало, конец). Форматы в CSV:
+    - "06/06/2020 to 09/26/2020" -> обе даты;
+    - "06/06/2020 to"            -> только начало;
+    - "06/06/2020"               -> один день;
+    - прочее (например, "November 99 to April 99") -> (None, None), то есть «круглый год».
+    """
+    text = (text or "").strip()
+    if not text:
+        return None, None
+    if " to" in text:
+        start_text, _, end_text = text.partition(" to")
+        start = _parse_date(start_text)
+        end = _parse_date(end_text) if end_text.strip() else None
+        if start is None:
+            return None, None
+        return start, end
+    single = _parse_date(text)
+    return single, single
+
+
+def parse_season_times(text):
+    """
+    Часы работы -> список (weekday, open_minute, close_minute).
+    Интервалы разделены ";". Нераспознанные куски пропускаются.
+    """
+    result = []
+    for part in (text or "").split(";"):
+        if not part.strip():
+            continue
+        match = TIME_RANGE_RE.match(part)
+        if not match:
+            continue
+        day, oh, om, oap, ch, cm, cap = match.groups()
+        result.append((
+            WEEKDAYS[day.capitalize()],
+            _to_minutes(oh, om, oap),
+            _to_minutes(ch, cm, cap),
+        ))
+    return result
+
+
+def parse_schedule(row):
+    """
+    Строка CSV (словарь из DictReader) -> строки для market_hours:
+    [(season_no, weekday, open_minute, close_minute, season_start, season_end), ...]
+    Сезон без часов работы строк не даёт (неизвестно, в какие дни рынок открыт).
+    """
+    hours = []
+    for season_no in range(1, SEASON_COUNT + 1):
+        intervals = parse_season_times(row.get(f"Season{season_no}Time"))
+        if not intervals:
+            continue
+        start, end = parse_season_dates(row.get(f"Season{season_no}Date"))
+        for weekday, open_minute, close_minute in intervals:
+            hours.append((season_no, weekday, open_minute, close_minute, start, end))
+    return hours
+
+
+def format_minutes(minutes):
+    """
+    810 -> "13:30"
+    """
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def format_hours_row(weekday, open_minute, close_minute, season_start=None, season_end=None):
+    """
+    Строка market_hours для вывода (консоль, Streamlit; в Django — шаблон details.html):
+    (6, 540, 780) -> "Sat 09:00–13:00"
+    с датами сезона -> "Sat 09:00–13:00 (06.06.2020 – 26.09.2020)", неизвестная дата — "…".
+    """
+    text = f"{WEEKDAY_NAMES[weekday]} {format_minutes(open_minute)}–{format_minutes(close_minute)}"
+    if season_start or season_end:
+        start = season_start.strftime("%d.%m.%Y") if season_start else "…"
+        end = season_end.strftime("%d.%m.%Y") if season_end else "…"
+        text += f" ({start} – {end})"
+    return text
@@ -0,0 +1,152 @@
+# search.py
+# =======================================================
+# Поиск рынка по строке: название, город, штат или индекс.
+#
+# Раньше каждая страница писала свой
+#     m.name ILIKE '%q%' OR l.city ILIKE '%q%' OR l.state ILIKE '%q%' ...
+# С % в начале B-tree индексы бесполезны: запрос проходил все рынки
+# вместе с JOIN на locations, и результаты шли просто по алфавиту.
+# Теперь у рынка есть поля search_text и search_tsv (setup/init.sql,
+# их ведут триггеры), а все страницы ищут через search_markets().
+#
+# Способы поиска (SEARCH_BACKEND):
+#   - "trgm" — search_text LIKE '%q%' по триграммному GIN-индексу (pg_trgm):
+#              любая подстрока, как раньше ILIKE ("ston" найдёт Boston);
+#   - "fts"  — полнотекстовый поиск по search_tsv (GIN-индекс есть всегда):
+#              каждое слово запроса — начало слова ("bost" найдёт Boston,
+#              "ston" — нет);
+#   - "auto" — trgm, если расширение pg_trgm установлено, иначе fts (по умолчанию).
+#
+# Порядок результатов — по релевантности: сначала точное совпадение названия,
+# затем названия, начинающиеся с запроса, затем по оценке похожести
+# (trgm — word_similarity, fts — ts_rank_cd с весами: название важнее города,
+# город важнее штата и индекса). При равной оценке — по названию и id.
+# Если совпадений больше SEARCH_RANK_LIMIT («market» — треть базы), страница
+# идёт по названию, как раньше: оценить сотни тысяч строк ради первых 20
+# дорого (секунды), а по названию PostgreSQL читает индекс и останавливается рано.
+# =======================================================
+
+import os
+import re
+
+from .db import execute_query
+from .totals import count_total
+
+SEARCH_BACKENDS = ("auto", "trgm", "fts")
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+# Больше совпадений — страница по алфавиту, а не по релевантности
+SEARCH_RANK_LIMIT = int(os.getenv("SEARCH_RANK_LIMIT", 20000))
+
+# Слова запроса для tsquery: буквы/цифры (кавычки, & | ! : в tsquery — служебные)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Колонки результата (как на страницах поиска)
+SEARCH_SELECT = """
+    SELECT m.id, m.name, l.city, l.state, l.zip, {boost} AS boost, {rank} AS rank
+    FROM markets m
+    JOIN locations l ON l.id = m.location_id
+    {source}
+    WHERE {where}
+    ORDER BY {order}
+    LIMIT %s OFFSET %s
+"""
+
+# Ступень совпадения названия: точное — 2, начинается с запроса — 1, иначе 0.
+# Сортируем сначала по ней, и только внутри ступени — по оценке похожести:
+# ts_rank_cd не ограничен единицей, и прибавка к оценке её не перевешивала
+_NAME_BOOST = "(CASE WHEN lower(m.name) = %s THEN 2 WHEN lower(m.name) LIKE %s THEN 1 ELSE 0 END)"
+
+_state = {"trgm": None}
+
+
+def _like_escape(text):
+    # % и _ в запросе — обычные символы, а не шаблон LIKE
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def has_trigram():
+    """
+    Установлено ли расширение pg_trgm (проверяем один раз на процесс).
+    """
+    if _state["trgm"] is None:
+        rows = execute_query("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'", fetch=True)
+        _state["trgm"] = bool(rows)
+    return _state["trgm"]
+
+
+def search_backend(backend=None):
+    """
+    "trgm" или "fts" — каким способом будет выполнен поиск.
+    """
+    backend = backend if backend in SEARCH_BACKENDS else SEARCH_BACKEND
+    if backend == "auto":
+        return "trgm" if has_trigram() else "fts"
+    return backend
+
+
+def search_parts(q, backend=None):
+    """
+    Части запроса для строки q: словарь
+        source, where, params — условие отбора (для COUNT и для страницы;
+                                params — параметры source и where по порядку);
+        boost, boost_params   — ступень совпадения названия (_NAME_BOOST);
+        rank, rank_params     — оценка похожести внутри ступени.
+    Для запроса без букв и цифр в режиме fts условие ложно (ничего не найдено).
+    """
+    text = (q or "").strip().lower()
+    pattern = f"%{_like_escape(text)}%"
+    boost_params = (text, f"{_like_escape(text)}%")
+
+    if search_backend(backend) == "trgm":
+        return {
+            "source": "",
+            "where": "m.search_text LIKE %s",
+            "params": (pattern,),
+            "boost": _NAME_BOOST,
+            "boost_params": boost_params,
+            "rank": "word_similarity(%s, m.search_text)",
+            "rank_params": (text,),
+        }
+
+    words = _WORD_RE.findall(text)
+    if not words:
+        return {"source": "", "where": "FALSE", "params": (),
+                "boost": "0", "boost_params": (), "rank": "0", "rank_params": ()}
+    # "bost mark" -> 'bost':* & 'mark':* (каждое слово — начало слова в тексте)
+    tsquery = " & ".join(f"'{w}':*" for w in words)
+    return {
+        "source": ", to_tsquery('simple', %s) AS tsq",
+        "where": "m.search_tsv @@ tsq",
+        "params": (tsquery,),
+        "boost": _NAME_BOOST,
+        "boost_params": boost_params,
+        "rank": "ts_rank_cd(m.search_tsv, tsq)",
+        "rank_params": (),
+    }
+
+
+def count_search(q, backend=None):
+    """
+    Сколько рынков находит строка q (Total из totals.count_total).
+    """
+    parts = search_parts(q, backend)
+    return count_total(
+        f"SELECT COUNT(*) FROM markets m {parts['source']} WHERE {parts['where']}",
+        parts["params"],
+    )
+
+
+def search_markets(q, limit, offset=0, backend=None, total=None):
+    """
+    Страница результатов поиска по релевантности:
+    строки id, name, city, state, zip, boost, rank.
+    total — сколько всего найдено (count_search), если уже известно:
+    при total > SEARCH_RANK_LIMIT страница идёт по названию.
+    """
+    parts = search_parts(q, backend)
+    by_rank = total is None or total <= SEARCH_RANK_LIMIT
+    order = "boost DESC, rank DESC, m.name, m.id" if by_rank else "m.name, m.id"
+    sql = SEARCH_SELECT.format(boost=parts["boost"], rank=parts["rank"], source=parts["source"], where=parts["where"], order=order)
+    # Порядок параметров — как в тексте: boost и rank (SELECT), затем source и where, LIMIT/OFFSET
+    params = parts["boost_params"] + parts["rank_params"] + parts["params"] + (limit, offset)
+    return execute_query(sql, params, fetch=True) or []
@@ -0,0 +1,129 @@
+# totals.py
+# =======================================================
+# Сколько всего строк в списке (для пагинации) — без точного COUNT(*)
+# на каждое открытие страницы.
+#
+# Раньше каждый список перед загрузкой страницы выполнял SELECT COUNT(*),
+# и так заново при каждом листании. На большой таблице подсчёт стоит дороже
+# самой страницы. count_total() умеет три режима (TOTALS_MODE):
+#   - "exact"    — честный COUNT(*) каждый раз (как было);
+#   - "cached"   — COUNT(*) один раз, дальше число из памяти, пока не было
+#                  записи в markets/reviews (invalidate_totals()) и не прошло
+#                  TOTALS_CACHE_TTL секунд (записи из других процессов —
+#                  консоль, Streamlit, загрузка CSV — «увидим» по TTL);
+#   - "estimate" — сначала оценка планировщика (EXPLAIN: строки берутся из
+#                  pg_class.reltuples и статистики колонок). Если оценка не
+#                  меньше TOTALS_ESTIMATE_MIN — показываем её («около N»),
+#                  иначе выборка маленькая и считаем точно (как "cached").
+# По умолчанию — "estimate": на небольшой базе он ведёт себя как "cached".
+#
+# count_total() возвращает Total — обычное целое число с признаками
+# total.approximate (True — это оценка, а не точный подсчёт) и
+# total.cached (True — точное число из памяти, за TTL оно могло устареть).
+# =======================================================
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .db import execute_query
+
+TOTALS_MODES = ("exact", "cached", "estimate")
+TOTALS_MODE = os.getenv("TOTALS_MODE", "estimate")
+TOTALS_CACHE_TTL = float(os.getenv("TOTALS_CACHE_TTL", 30))
+TOTALS_CACHE_SIZE = int(os.getenv("TOTALS_CACHE_SIZE", 256))
+# Оценке верим только для больших выборок: маленькие считаются точно быстро,
+# а планировщик на узких фильтрах (ILIKE '%...%') ошибается сильнее
+TOTALS_ESTIMATE_MIN = int(os.getenv("TOTALS_ESTIMATE_MIN", 100000))
+
+# "SELECT COUNT(*) FROM ..." -> "SELECT 1 FROM ..." (для EXPLAIN нужны строки, а не агрегат)
+_COUNT_RE = re.compile(r"^\s*SELECT\s+COUNT\(\s*\*\s*\)", re.IGNORECASE)
+
+
+class Total(int):
+    """
+    Число строк. total.approximate — True, если это оценка планировщика;
+    total.cached — True, если это точный подсчёт, взятый из памяти.
+    """
+
+    def __new__(cls, value, approximate=False, cached=False):
+        obj = super().__new__(cls, value)
+        obj.approximate = approximate
+        obj.cached = cached
+        return obj
+
+
+# (sql, params) -> (число, время подсчёта, поколение)
+_cache = OrderedDict()
+_state = {"generation": 0}
+_lock = threading.Lock()
+
+
+def invalidate_totals():
+    """
+    Забыть все запомненные числа (вызывать после изменения markets/reviews).
+    """
+    with _lock:
+        _state["generation"] += 1
+        _cache.clear()
+
+
+def _exact(sql, params):
+    return int(execute_query(sql, params, fetch=True)[0]["count"])
+
+
+def _cached(sql, params):
+    # -> (число, взято ли оно из памяти)
+    key = (sql, tuple(params))
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        generation = _state["generation"]
+        if hit and hit[2] == generation and now - hit[1] < TOTALS_CACHE_TTL:
+            _cache.move_to_end(key)
+            return hit[0], True
+
+    value = _exact(sql, params)
+    with _lock:
+        # Пока считали, могла пройти запись — тогда число уже устарело, не запоминаем
+        if _state["generation"] == generation:
+            _cache[key] = (value, now, generation)
+            while len(_cache) > TOTALS_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return value, False
+
+
+def estimate_count(sql, params=()):
+    """
+    Оценка планировщика для запроса вида SELECT COUNT(*) FROM ... WHERE ...
+    (или None, если запрос другого вида / EXPLAIN не удался).
+    """
+    if not _COUNT_RE.match(sql):
+        return None
+    rows_sql = _COUNT_RE.sub("SELECT 1", sql, count=1)
+    try:
+        plan = execute_query("EXPLAIN (FORMAT JSON) " + rows_sql, params, fetch=True)[0]["QUERY PLAN"]
+    except Exception:
+        return None
+    if isinstance(plan, str):  # драйвер мог не разобрать JSON сам
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_total(sql, params=(), mode=None):
+    """
+    Total для запроса SELECT COUNT(*) ... (режим — mode или TOTALS_MODE).
+    """
+    mode = mode if mode in TOTALS_MODES else TOTALS_MODE
+    params = tuple(params)
+    if mode == "exact":
+        return Total(_exact(sql, params))
+    if mode == "estimate":
+        estimate = estimate_count(sql, params)
+        if estimate is not None and estimate >= TOTALS_ESTIMATE_MIN:
+            return Total(estimate, approximate=True)
+    value, from_cache = _cached(sql, params)
+    return Total(value, cached=from_cache)
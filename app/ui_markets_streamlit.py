@@ -11,6 +11,14 @@ import streamlit as st
 # Обрати внимание: импорт абсолютный (через пакет app), без точек.
 from app.db import execute_query          # выполнение SQL
 from app.utils import validate_coordinates  # проверка широты/долготы
+from app.utils import build_flags_mask, flags_condition  # фильтр по markets.flags_mask
+from app.utils import bbox_condition, geohash_condition  # прямоугольник и ячейки geohash вокруг точки для поиска по радиусу
+from app.geo_index import search_radius, market_deleted, nearest_markets  # гео-индекс в памяти (KD-дерево)
+from app.distance_engine import distance_page, reset_distance_engine  # сортировка по расстоянию в NumPy
+from app.keyset import KeysetPager  # keyset-пагинация: соседние страницы по ключу, без больших OFFSET
+from app.totals import count_total, invalidate_totals  # число строк: из кеша или оценка вместо COUNT(*) на каждую перерисовку
+from app.search import count_search, search_markets  # поиск рынка по строке: GIN-индекс, результаты по релевантности
+from app.schedule import format_hours_row  # строка расписания: "Sat 09:00–13:00 (сезон)"
 
 
 # -----------------------------
@@ -137,13 +145,29 @@ def st_paginate(total: int, per_page: int, key_prefix: str) -> int:
             st.session_state[page_key] = total_pages
 
     # Подпись-индикатор
-    st.caption(f"Страница {st.session_state[page_key]} из {total_pages} (всего записей: {total})")
+    about = "около " if getattr(total, "approximate", False) else ""  # total — оценка планировщика
+    st.caption(f"Страница {st.session_state[page_key]} из {total_pages} (всего записей: {about}{total})")
 
     # Возвращаем OFFSET для SQL
     offset = (st.session_state[page_key] - 1) * per_page
     return offset
 
 
+def _keyset_pager(key_prefix: str, keys) -> KeysetPager:
+    """
+    Keyset-пейджер раздела, сохранённый в st.session_state (между перерисовками
+    он помнит ключи крайних строк показанной страницы).
+    Использование вместе с st_paginate:
+        offset = st_paginate(total, per_page, key_prefix="list")
+        rows = _keyset_pager("list", [("id", "ASC")]).fetch(execute_query, source_sql, params, total, per_page, offset)
+    """
+    pager_key = f"{key_prefix}_keyset"
+    pager = st.session_state.get(pager_key)
+    if pager is None or pager.keys != keys:
+        pager = st.session_state[pager_key] = KeysetPager(keys)
+    return pager
+
+
 # -----------------------------
 # 1) Список рынков (Streamlit)
 # -----------------------------
@@ -154,14 +178,14 @@ def show_markets_page():
     - Адрес (улица / город / округ / штат / ZIP)
     - Координаты (широта/долгота)
     - Быстрые ссылки (Website/Facebook/Twitter/YouTube/Other)
-    - Рейтинг и число отзывов (через подзапросы — без GROUP BY, чтобы код был проще)
+    - Рейтинг и число отзывов (готовые из market_rating_summary — без GROUP BY и подзапросов)
     """
     st.header("1. Список рынков")
 
     # 1) Сколько всего рынков — для пагинации (оставляем логику как в консоли)
     count_sql = "SELECT COUNT(*) FROM markets"
     try:
-        total = execute_query(count_sql, fetch=True)[0]["count"]
+        total = count_total(count_sql)
     except Exception as e:
         st.error(f"Ошибка при получении количества рынков: {e}")
         return
@@ -173,22 +197,22 @@ def show_markets_page():
     # current_page = offset // per_page + 1
 
     # 3) Основной запрос: забираем больше полей из БД.
-    #    Рейтинг и кол-во отзывов считаем подзапросами, чтобы не городить GROUP BY на все колонки.
+    #    Рейтинг и кол-во отзывов — готовые из market_rating_summary (их ведут триггеры на reviews).
     query = """
         SELECT
             m.id, m.name,
             l.street, l.city, l.county, l.state, l.zip,
             m.website, m.facebook, m.twitter, m.youtube, m.other_media,
             m.latitude, m.longitude,
-            COALESCE((SELECT AVG(r.rating) FROM reviews r WHERE r.market_id = m.id), 0) AS avg_rating,
-            (SELECT COUNT(r2.id) FROM reviews r2 WHERE r2.market_id = m.id) AS review_count
+            COALESCE(s.avg_rating, 0) AS avg_rating,
+            COALESCE(s.review_count, 0) AS review_count
         FROM markets m
         JOIN locations l ON m.location_id = l.id
-        ORDER BY m.id
-        LIMIT %s OFFSET %s
+        LEFT JOIN market_rating_summary s ON s.market_id = m.id
     """
     try:
-        rows = execute_query(query, (per_page, offset), fetch=True)
+        # ORDER BY id и LIMIT добавляет пейджер; соседняя страница — WHERE id > последний id
+        rows = _keyset_pager("list", [("id", "ASC")]).fetch(execute_query, query, (), total, per_page, offset)
     except Exception as e:
         st.error(f"Ошибка при загрузке рынков: {e}")
         return
@@ -307,7 +331,7 @@ def search_market_page():
     params = (city, f"%{city}%", state, f"%{state}%", zip_code, zip_code)
 
     try:
-        total = execute_query(count_query, params, fetch=True)[0]["count"]
+        total = count_total(count_query, params)
     except Exception as e:
         st.error(f"Ошибка при подсчёте результатов: {e}")
         return
@@ -332,13 +356,13 @@ def search_market_page():
         WHERE (%s = '' OR l.city ILIKE %s)
           AND (%s = '' OR l.state ILIKE %s)
           AND (%s = '' OR l.zip = %s)
-        ORDER BY m.id
-        LIMIT %s OFFSET %s
     """
-    query_params = (*params, per_page, offset)
 
     try:
-        rows = execute_query(base_query, query_params, fetch=True)
+        # signature=params — новый поиск не продолжает страницы старого
+        rows = _keyset_pager("search", [("id", "ASC")]).fetch(
+            execute_query, base_query, params, total, per_page, offset, signature=params
+        )
     except Exception as e:
         st.error(f"Ошибка при загрузке результатов: {e}")
         return
@@ -359,6 +383,7 @@ def show_market_details_page():
     - Соцсети/ссылки
     - Рейтинг и количество отзывов
     - Список категорий рынка
+    - Расписание (market_hours)
     - Ниже — сами отзывы (как и было)
     """
     st.header("3. Детали рынка")
@@ -475,11 +500,35 @@ def show_market_details_page():
         except Exception as e:
             st.error(f"Ошибка при загрузке категорий: {e}")
 
+        # 4) Расписание (разобрано при загрузке в market_hours)
+        try:
+            hours = execute_query(
+                """
+                SELECT weekday, open_minute, close_minute, season_start, season_end
+                FROM market_hours
+                WHERE market_id = %s
+                ORDER BY season_no, weekday, open_minute
+                """,
+                (market_id,),
+                fetch=True
+            )
+            if hours:
+                st.write("Расписание:")
+                st.markdown("\n".join(
+                    "- " + format_hours_row(h["weekday"], h["open_minute"], h["close_minute"],
+                                            h["season_start"], h["season_end"])
+                    for h in hours
+                ))
+            else:
+                st.caption("Расписание: нет данных.")
+        except Exception as e:
+            st.error(f"Ошибка при загрузке расписания: {e}")
+
         # --- Разделитель перед отзывами ---
         st.markdown("---")
         st.subheader("Отзывы")
 
-        # 4) Сами отзывы — оставляем логику как было (только ORDER BY для стабильности)
+        # 5) Сами отзывы — оставляем логику как было (только ORDER BY для стабильности)
         reviews_sql = """
             SELECT id, user_name, rating, review_text
             FROM reviews
@@ -544,9 +593,10 @@ def add_review_page():
             else:
                 st.warning("Рынок с таким ID не найден.")
 
-    # --- Блок B. Поиск рынка по строке (название/город/штат) ---
+    # --- Блок B. Поиск рынка по строке (название/город/штат/индекс) — app/search.py ---
     st.subheader("Поиск рынка")
-    st.caption("Введите часть названия рынка, города или штата. Поиск регистронезависимый.")
+    st.caption("Введите название рынка, город, штат или индекс. Поиск регистронезависимый, "
+               "самые подходящие рынки — первыми.")
     query = st.text_input("Поиск", value=st.session_state.get("addrev_last_query", ""), key="addrev_query_text")
 
     # Управление размером страницы через уже принятый паттерн
@@ -563,16 +613,7 @@ def add_review_page():
         else:
             try:
                 # Считаем total
-                total = execute_query(
-                    """
-                    SELECT COUNT(*) 
-                    FROM markets m
-                    JOIN locations l ON m.location_id = l.id
-                    WHERE m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s
-                    """,
-                    (f"%{q}%", f"%{q}%", f"%{q}%"),
-                    fetch=True
-                )[0]["count"]
+                total = count_search(q)
                 st.session_state["addrev_total"] = total
             except Exception as e:
                 st.error(f"Ошибка подсчёта результатов: {e}")
@@ -587,18 +628,7 @@ def add_review_page():
         offset = (current_page - 1) * per_page
 
         try:
-            rows = execute_query(
-                """
-                SELECT m.id, m.name, l.city, l.state
-                FROM markets m
-                JOIN locations l ON m.location_id = l.id
-                WHERE m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s
-                ORDER BY m.name
-                LIMIT %s OFFSET %s
-                """,
-                (f"%{q}%", f"%{q}%", f"%{q}%", per_page, offset),
-                fetch=True
-            )
+            rows = search_markets(q, per_page, offset, total=total)
         except Exception as e:
             st.error(f"Ошибка выборки результатов: {e}")
             rows = []
@@ -673,6 +703,7 @@ def add_review_page():
                     (market_id, name_clean, int(rating), text_clean),
                     fetch=False
                 )
+                invalidate_totals()  # запомненные числа строк устарели
                 st.success("Отзыв успешно сохранён.")
                 # Опционально: сбросить выбор рынка после успешной вставки
                 # st.session_state.pop("addrev_selected_market", None)
@@ -736,6 +767,7 @@ def delete_review_page():
                     else:
                         # Само удаление — простая команда DELETE по первичному ключу
                         execute_query("DELETE FROM reviews WHERE id = %s", (int(review_id_direct),), fetch=False)
+                        invalidate_totals()
                         st.success(f"Отзыв #{int(review_id_direct)} удалён.")
                 except Exception as e:
                     st.error(f"Ошибка удаления: {e}")
@@ -867,6 +899,7 @@ def delete_review_page():
                     else:
                         try:
                             execute_query("DELETE FROM reviews WHERE id = %s", (rid,), fetch=False)
+                            invalidate_totals()
                             st.success(f"Отзыв #{rid} удалён.")
                             # Перерисовываем страницу, чтобы карточка сразу исчезла из списка
                         except Exception as e:
@@ -916,11 +949,19 @@ def sort_markets_page():
             SELECT COUNT(*) FROM markets
             WHERE latitude IS NOT NULL AND longitude IS NOT NULL
         """
+    elif sort_choice[1] == "rating":
+        # Те же JOIN, что у запроса страницы (market_rating_summary — тоже)
+        total_sql = """
+            SELECT COUNT(*)
+            FROM markets m
+            JOIN locations l ON m.location_id = l.id
+            JOIN market_rating_summary s ON s.market_id = m.id
+        """
     else:
-        total_sql = "SELECT COUNT(*) FROM markets"
+        total_sql = "SELECT COUNT(*) FROM markets m JOIN locations l ON m.location_id = l.id"
 
     try:
-        total = execute_query(total_sql, fetch=True)[0]["count"]
+        total = count_total(total_sql)
     except Exception as e:
         st.error(f"Ошибка при подсчёте: {e}")
         return
@@ -931,41 +972,35 @@ def sort_markets_page():
     current_page = offset // per_page + 1
 
 
-    # Собираем SQL под выбранный вариант (в точности как в консоли)
+    # Собираем SQL под выбранный вариант (как в консоли).
+    # Рейтинг/город/штат — запрос-источник + ключ сортировки для keyset-пейджера
+    # (последним в ключе — id, чтобы порядок был однозначным)
+    keys = None
     if sort_choice[1] == "rating":
-        order_clause = f"ORDER BY avg_rating {direction}"
-        query = f"""
-            SELECT m.id, m.name, l.city, l.state, COALESCE(AVG(r.rating), 0) AS avg_rating
+        query = """
+            SELECT m.id, m.name, l.city, l.state, s.avg_rating, s.review_count
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            LEFT JOIN reviews r ON r.market_id = m.id
-            GROUP BY m.id, l.city, l.state
-            {order_clause}
-            LIMIT %s OFFSET %s
+            JOIN market_rating_summary s ON s.market_id = m.id
         """
-        params = (per_page, offset)
+        # Порядок как у индексов idx_rating_summary_top/low — страница читается по индексу
+        keys = [("avg_rating", direction), ("review_count", "DESC"), ("id", "ASC")]
 
     elif sort_choice[1] == "city":
-        order_clause = f"ORDER BY l.city {direction}"
-        query = f"""
+        query = """
             SELECT m.id, m.name, l.city, l.state
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            {order_clause}
-            LIMIT %s OFFSET %s
         """
-        params = (per_page, offset)
+        keys = [("city", direction), ("id", "ASC")]
 
     elif sort_choice[1] == "state":
-        order_clause = f"ORDER BY l.state {direction}"
-        query = f"""
+        query = """
             SELECT m.id, m.name, l.city, l.state
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            {order_clause}
-            LIMIT %s OFFSET %s
         """
-        params = (per_page, offset)
+        keys = [("state", direction), ("id", "ASC")]
 
     else:  # distance
         order_clause = f"ORDER BY distance {direction}"
@@ -984,8 +1019,18 @@ def sort_markets_page():
         """
         params = (per_page, offset)
 
+    rows = None
+    if sort_choice[1] == "distance":
+        # Расстояния считает NumPy в памяти; при листании страниц от той же точки
+        # порядок уже готов и страница — просто срез (None — движок недоступен, тогда SQL)
+        rows = distance_page(lat, lon, per_page, offset, descending=(direction == "DESC"))
     try:
-        rows = execute_query(query, params, fetch=True)
+        if rows is None and keys is not None:
+            rows = _keyset_pager(f"sort_{sort_choice[1]}_{direction}", keys).fetch(
+                execute_query, query, (), total, per_page, offset
+            )
+        elif rows is None:
+            rows = execute_query(query, params, fetch=True)
     except Exception as e:
         st.error(f"Ошибка при загрузке данных: {e}")
         return
@@ -1021,7 +1066,13 @@ def search_by_radius_page():
 
     if st.button("Показать рынки"):
         lat, lon = coords
-        query = """
+        # Быстрый путь — гео-индекс в памяти; если он недоступен, считаем в базе
+        found = search_radius(lat, lon, 30, limit=20)
+        # Ячейки geohash и прямоугольник вокруг точки (по индексам) — формула расстояния
+        # только для попавших в них рынков
+        geo_sql, geo_params = geohash_condition(lat, lon, 30)
+        bbox_sql, bbox_params = bbox_condition(lat, lon, 30)
+        query = f"""
             SELECT m.id, m.name, l.city, l.state,
             (3959 * acos(
                 cos(radians(%s)) * cos(radians(m.latitude)) *
@@ -1030,7 +1081,9 @@ def search_by_radius_page():
             )) AS distance
             FROM markets m
             JOIN locations l ON m.location_id = l.id
-            WHERE (3959 * acos(
+            WHERE {geo_sql}
+              AND {bbox_sql}
+              AND (3959 * acos(
                 cos(radians(%s)) * cos(radians(m.latitude)) *
                 cos(radians(m.longitude) - radians(%s)) +
                 sin(radians(%s)) * sin(radians(m.latitude))
@@ -1038,10 +1091,10 @@ def search_by_radius_page():
             ORDER BY distance ASC
             LIMIT 20
         """
-        params = (lat, lon, lat, lat, lon, lat)
+        params = (lat, lon, lat) + geo_params + bbox_params + (lat, lon, lat)
 
         try:
-            rows = execute_query(query, params, fetch=True)
+            rows = found[1] if found is not None else execute_query(query, params, fetch=True)
         except Exception as e:
             st.error(f"Ошибка запроса: {e}")
             return
@@ -1073,6 +1126,9 @@ def delete_market_page():
             return
         try:
             execute_query("DELETE FROM markets WHERE id = %s", (market_id,))
+            market_deleted(market_id)  # убираем рынок и из гео-индекса
+            reset_distance_engine()  # и из движка расстояний
+            invalidate_totals()  # и забываем запомненные числа рынков
         except Exception as e:
             st.error(f"Ошибка удаления: {e}")
             return
@@ -1091,8 +1147,10 @@ def render_markets_by_category():
     Сценарий работы:
     1) Загружаем список категорий из БД (id, name), сортируем по алфавиту.
     2) Даём поле быстрого поиска по категориям (текстовый фильтр).
-    3) Даём выбор категории (selectbox) из отфильтрованного списка.
-    4) По выбранной категории выводим таблицу рынков (ID, Название, Город, Штат) с простой пагинацией.
+    3) Даём выбор одной или нескольких категорий и способов оплаты (multiselect)
+       и режима: «все выбранные» (AND) или «любой из выбранных» (OR).
+    4) По выбранному выводим таблицу рынков (ID, Название, Город, Штат) с простой пагинацией.
+       Фильтр — одна битовая проверка по markets.flags_mask, без JOIN на каждую категорию.
     
     """
 
@@ -1104,7 +1162,7 @@ def render_markets_by_category():
     # ORDER BY name — отсортируем категории по алфавиту.
     categories = execute_query(
         """
-        SELECT id, name
+        SELECT id, name, bit_no
         FROM categories
         ORDER BY name;
         """,
@@ -1143,45 +1201,58 @@ def render_markets_by_category():
         st.warning("По вашему фильтру категорий не найдено.")
         return
 
-    # --- 3. Виджет выбора категории ---
-    # Для удобства пользователю показываем выпадающий список (selectbox)
-    # уже отфильтрованных категорий. Элементов обычно не очень много.
-    # Если у вас вдруг тысячи категорий — можно будет заменить на автокомплит,
-    # но сейчас оставляем простой вариант + наш текстовый фильтр выше.
+    # --- 3. Виджеты выбора категорий, способов оплаты и режима ---
+    # multiselect уже отфильтрованных категорий; по умолчанию — первая, как раньше.
     category_names = [c.get("name") or f"Категория #{c.get('id')}" for c in filtered_categories]
-    selected_name = st.selectbox(
-        "Выберите категорию",
+    selected_names = st.multiselect(
+        "Выберите категории",
         options=category_names,
-        index=0
+        default=category_names[:1]
     )
 
-    # По выбранному названию найдём сам объект категории (чтобы получить её id)
-    selected_category = None
-    for c in filtered_categories:
-        if (c.get("name") or f"Категория #{c.get('id')}") == selected_name:
-            selected_category = c
-            break
+    # Способы оплаты (Credit, WIC, WICcash, SFMNP, SNAP)
+    payment_types = execute_query(
+        "SELECT name, bit_no FROM payment_types ORDER BY bit_no;",
+        (),
+        fetch=True
+    ) or []
+    selected_payments = st.multiselect(
+        "Способы оплаты",
+        options=[pt["name"] for pt in payment_types]
+    )
 
-    if not selected_category:
-        st.error("Не удалось определить выбранную категорию.")
+    match_all = st.radio(
+        "Условие",
+        options=["Все выбранные (AND)", "Любой из выбранных (OR)"],
+        horizontal=True
+    ).startswith("Все")
+
+    # Собираем битовую маску из выбранного
+    bits = [c["bit_no"] for c in filtered_categories
+            if (c.get("name") or f"Категория #{c.get('id')}") in selected_names]
+    bits += [pt["bit_no"] for pt in payment_types if pt["name"] in selected_payments]
+    mask = build_flags_mask(bits)
+    # Категории без бита (в маску помещается 48) проверяются по market_categories
+    no_bit_ids = [c["id"] for c in filtered_categories
+                  if (c.get("name") or f"Категория #{c.get('id')}") in selected_names and c.get("bit_no") is None]
+
+    if not mask and not no_bit_ids:
+        st.info("Выберите хотя бы одну категорию или способ оплаты.")
         return
 
-    category_id = selected_category["id"]
+    where_sql, where_params = flags_condition(mask, match_all=match_all, category_ids=no_bit_ids)
 
-    # --- 4. Загружаем рынки для выбранной категории (с пагинацией через SQL LIMIT/OFFSET) ---
-    # Сначала узнаём, сколько всего рынков подходит под выбранную категорию — это нужно для пагинации.
+    # --- 4. Загружаем рынки по маске (с пагинацией через SQL LIMIT/OFFSET) ---
+    # Сначала узнаём, сколько всего рынков подходит под фильтр — это нужно для пагинации.
     try:
-        total = execute_query(
-            """
+        total = count_total(
+            f"""
             SELECT COUNT(*)
             FROM markets m
-            JOIN market_categories mc ON mc.market_id = m.id
-            JOIN categories c        ON c.id = mc.category_id
-            WHERE c.id = %s
+            WHERE {where_sql}
             """,
-            (category_id,),
-            fetch=True
-        )[0]["count"]
+            where_params,
+        )
     except Exception as e:
         st.error(f"Ошибка при подсчёте рынков: {e}")
         return
@@ -1190,13 +1261,13 @@ def render_markets_by_category():
     st.write(f"Найдено рынков: **{total}**")
 
     if total == 0:
-        st.info("В этой категории пока нет рынков.")
+        st.info("Под выбранный фильтр пока нет рынков.")
         return
 
     # --- 5. Контрол «сколько строк на странице» + универсальный пагинатор ---
-    # Храним состояние отдельно для каждой выбранной категории, чтобы переключение категорий
-    # не мешало пагинации (ключ включает ID категории).
-    key_prefix = f"cat_{category_id}"
+    # Храним состояние отдельно для каждого фильтра, чтобы смена категорий
+    # не мешала пагинации (ключ включает маску, категории без бита и режим).
+    key_prefix = f"cat_{mask}_{'_'.join(map(str, no_bit_ids))}_{'all' if match_all else 'any'}"
 
     # Простое числовое поле для выбора размера страницы (5..100 шагом 5)
     per_page = _per_page_control(default=10, key_prefix=key_prefix)
@@ -1205,24 +1276,20 @@ def render_markets_by_category():
     offset = st_paginate(total=total, per_page=per_page, key_prefix=key_prefix)
     current_page = offset // per_page + 1  # вычисляем номер текущей страницы для подписи
 
-    # --- 6. Загружаем текущую страницу рынков по категории ---
+    # --- 6. Загружаем текущую страницу рынков по маске ---
     try:
-        page_rows = execute_query(
-            """
+        page_sql = f"""
             SELECT m.id,
                    m.name,
                    l.city,
                    l.state
             FROM markets m
-            JOIN market_categories mc ON mc.market_id = m.id
-            JOIN categories c        ON c.id = mc.category_id
             JOIN locations l         ON l.id = m.location_id
-            WHERE c.id = %s
-            ORDER BY m.name
-            LIMIT %s OFFSET %s
-            """,
-            (category_id, per_page, offset),
-            fetch=True
+            WHERE {where_sql}
+            """
+        # Сортировка по (name, id): соседние страницы — по ключу крайней строки
+        page_rows = _keyset_pager(key_prefix, [("name", "ASC"), ("id", "ASC")]).fetch(
+            execute_query, page_sql, where_params, total, per_page, offset
         )
     except Exception as e:
         st.error(f"Ошибка при загрузке рынков: {e}")
@@ -1246,3 +1313,41 @@ def render_markets_by_category():
     # Подпись о текущей странице (подтягиваем общее число страниц через «потолок»)
     total_pages = max(1, math.ceil(total / max(1, per_page)))
     st.caption(f"Страница {current_page} из {total_pages} (показаны {len(page_rows)} записей)")
+
+
+# -----------------------------
+# 10) k ближайших рынков (k-NN)
+# -----------------------------
+def nearest_markets_page():
+    """
+    k ближайших к точке рынков — без подбора радиуса.
+    Ищет гео-индекс в памяти, а без него — база «расширяющимися кругами» (см. app/geo_index.py).
+    """
+    st.header("10. Ближайшие рынки")
+
+    lat = st.text_input("Широта", value="", key="knn_lat")
+    lon = st.text_input("Долгота", value="", key="knn_lon")
+    k = st.number_input("Сколько рынков (K)", min_value=1, max_value=100, value=10, step=1, key="knn_k")
+
+    coords = validate_coordinates(lat.strip(), lon.strip())
+    if not coords:
+        st.info("Введите корректные координаты и нажмите кнопку ниже.")
+        if st.button("Найти ближайшие", key="knn_btn_bad"):
+            st.warning("Координаты некорректны.")
+        return
+
+    if st.button("Найти ближайшие", key="knn_btn"):
+        lat, lon = coords
+        try:
+            rows = nearest_markets(lat, lon, int(k))
+        except Exception as e:
+            st.error(f"Ошибка запроса: {e}")
+            return
+
+        if not rows:
+            st.warning("Рынков с координатами не найдено.")
+            return
+
+        st.subheader(f"{len(rows)} ближайших рынков:")
+        for r in rows:
+            st.write(f"[{r['id']}] {r['name']} — {r['city']}, {r['state']} | {round(float(r['distance'] or 0), 2)} миль")
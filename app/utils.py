@@ -4,6 +4,7 @@
 # - Проверка корректности ID
 # - Проверка координат (широта и долгота)
 # - Пагинация (переход между страницами в списке)
+# - Фильтр по флагам рынка (markets.flags_mask)
 # ===========================================================
 
 import math  # модуль нужен для округления вверх и тригонометрии
@@ -68,7 +69,8 @@ def paginate(offset, per_page, total=None):
     if total is not None:
         total_pages = math.ceil(total / per_page)  # округляем вверх (например, 52 / 20 = 3 страницы)
         current_page = offset // per_page + 1       # вычисляем текущую страницу (начинается с 1)
-        print(f"\nСтраница {current_page} из {total_pages}")
+        about = "~" if getattr(total, "approximate", False) else ""  # total может быть оценкой (totals.py)
+        print(f"\nСтраница {current_page} из {about}{total_pages}")
     else:
         print("\nПереход между страницами:")
         
@@ -112,3 +114,218 @@ def paginate(offset, per_page, total=None):
         return offset
 
 
+def build_flags_mask(bit_numbers):
+    """
+    Список номеров битов -> маска для markets.flags_mask.
+    Например: [0, 2] -> 0b101 = 5.
+    """
+    mask = 0
+    for bit_no in bit_numbers:
+        if bit_no is not None:
+            mask |= 1 << int(bit_no)
+    return mask
+
+
+def flags_condition(mask, match_all=True, category_ids=()):
+    """
+    Условие WHERE по маске флагов (категории + способы оплаты) — одна проверка
+    вместо JOIN на каждую категорию. Возвращает (sql, params):
+    - match_all=True  — у рынка есть ВСЕ выбранные флаги (AND);
+    - match_all=False — есть ХОТЯ БЫ ОДИН из выбранных флагов (OR).
+    category_ids — выбранные категории без бита (bit_no IS NULL: в маске всего
+    48 мест для категорий), их проверяем по market_categories, как раньше.
+    """
+    parts, params = [], []
+    if mask:
+        if match_all:
+            parts.append("(m.flags_mask & %s) = %s")
+            params += [mask, mask]
+        else:
+            parts.append("(m.flags_mask & %s) <> 0")
+            params.append(mask)
+    if category_ids:
+        # Литерал массива "{3,5}" (строка, а не список — params остаются хешируемыми для totals)
+        ids = "{" + ",".join(str(int(i)) for i in category_ids) + "}"
+        if match_all:
+            parts.append("(SELECT COUNT(*) FROM market_categories mc "
+                         "WHERE mc.market_id = m.id AND mc.category_id = ANY(%s::int[])) = %s")
+            params += [ids, len(category_ids)]
+        else:
+            parts.append("EXISTS (SELECT 1 FROM market_categories mc "
+                         "WHERE mc.market_id = m.id AND mc.category_id = ANY(%s::int[]))")
+            params.append(ids)
+    sql = (" AND " if match_all else " OR ").join(parts)
+    return (f"({sql})" if len(parts) > 1 else sql), tuple(params)
+
+
+# Радиус Земли в милях (тот же, что в формулах расстояния в SQL)
+EARTH_RADIUS_MILES = 3959
+
+
+def bounding_box(lat, lon, radius_miles):
+    """
+    Прямоугольник (min_lat, max_lat, min_lon, max_lon), в который гарантированно
+    попадают все точки не дальше radius_miles от (lat, lon).
+    - по широте: радиус / R, переведённый в градусы;
+    - по долготе: asin(sin(r / R) / cos(lat)) — шире у полюсов.
+    Если круг задевает полюс — берём всю долготу (-180..180).
+    Долгота может выйти за ±180 (круг через 180-й меридиан) — это учитывает bbox_condition.
+    """
+    angular = radius_miles / EARTH_RADIUS_MILES  # угловой радиус в радианах
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(lat))))
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def bbox_condition(lat, lon, radius_miles):
+    """
+    Условие WHERE «рынок внутри прямоугольника вокруг точки» — предварительный фильтр
+    для поиска по радиусу. Идёт по индексу idx_markets_lat_lon, поэтому точную формулу
+    расстояния база считает только для рынков внутри прямоугольника, а не для всей таблицы.
+    Возвращает (sql, params), как flags_condition.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_miles)
+    if min_lon < -180:
+        # Прямоугольник пересекает 180-й меридиан с запада: два куска долготы
+        lon_sql, lon_params = "(m.longitude >= %s OR m.longitude <= %s)", (min_lon + 360, max_lon)
+    elif max_lon > 180:
+        lon_sql, lon_params = "(m.longitude >= %s OR m.longitude <= %s)", (min_lon, max_lon - 360)
+    else:
+        lon_sql, lon_params = "m.longitude BETWEEN %s AND %s", (min_lon, max_lon)
+    return "m.latitude BETWEEN %s AND %s AND " + lon_sql, (min_lat, max_lat) + lon_params
+
+
+# ===========================================================
+# Geohash: поиск по радиусу как несколько диапазонов индекса
+# ===========================================================
+# markets.geohash (см. setup/init.sql) — 12 символов base32. Первые символы
+# задают крупную ячейку, следующие — её части. Все рынки ячейки 'drs'
+# лежат в диапазоне строк 'drs' <= geohash < 'drt', поэтому круг поиска
+# можно покрыть несколькими ячейками и прочитать их обычным B-tree индексом.
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"  # символы по возрастанию (как в ASCII)
+GEOHASH_PRECISION = 12  # длина markets.geohash
+# Сколько ячеек можно взять для покрытия круга: чем больше, тем точнее покрытие,
+# но тем больше диапазонов в запросе (соседние ячейки склеиваются в один диапазон)
+GEOHASH_MAX_CELLS = 32
+
+
+def _geohash_bits(precision):
+    # 5 бит на символ; долготе достаётся на бит больше при нечётном числе бит
+    bits = 5 * precision
+    return bits // 2, (bits + 1) // 2  # (бит широты, бит долготы)
+
+
+def _geohash_row(lat, lat_bits):
+    # Номер ячейки по широте на сетке из 2^lat_bits строк (та же формула, что в geohash_encode() в SQL)
+    row = int(math.floor((lat + 90) / 180 * (1 << lat_bits)))
+    return min(max(row, 0), (1 << lat_bits) - 1)
+
+
+def _geohash_col(lon, lon_bits):
+    col = int(math.floor((lon + 180) / 360 * (1 << lon_bits)))
+    return min(max(col, 0), (1 << lon_bits) - 1)
+
+
+def _geohash_code(row, col, precision):
+    """
+    Номер ячейки (строка, столбец) -> число geohash: биты долготы и широты
+    чередуются, старший — бит долготы.
+    """
+    lat_bits, lon_bits = _geohash_bits(precision)
+    code = 0
+    for k in range(lat_bits + lon_bits):
+        if k % 2 == 0:
+            bit = (col >> (lon_bits - 1 - k // 2)) & 1
+        else:
+            bit = (row >> (lat_bits - 1 - k // 2)) & 1
+        code = (code << 1) | bit
+    return code
+
+
+def _geohash_text(code, precision):
+    # Число -> строка base32 (по 5 бит на символ, старшие первыми)
+    return "".join(GEOHASH_BASE32[(code >> 5 * (precision - 1 - i)) & 31] for i in range(precision))
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    Geohash точки, как в колонке markets.geohash (при precision=12 — символ в символ).
+    Пример: geohash_encode(57.64911, 10.40744) -> 'u4pruydqqvj8'
+    """
+    lat_bits, lon_bits = _geohash_bits(precision)
+    code = _geohash_code(_geohash_row(lat, lat_bits), _geohash_col(lon, lon_bits), precision)
+    return _geohash_text(code, precision)
+
+
+def geohash_ranges(lat, lon, radius_miles, max_cells=GEOHASH_MAX_CELLS):
+    """
+    Покрывает круг радиуса radius_miles ячейками geohash и возвращает диапазоны
+    строк [(от, до), ...]: рынок в круге всегда попадает в один из диапазонов
+    от <= geohash < до (до = None — без верхней границы).
+    Берётся самая мелкая длина ячейки, при которой прямоугольник вокруг круга
+    (bounding_box) закрывают не больше max_cells ячеек.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_miles)
+    # Прямоугольник через 180-й меридиан — два куска долготы
+    if min_lon < -180:
+        lon_spans = [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    elif max_lon > 180:
+        lon_spans = [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    else:
+        lon_spans = [(min_lon, max_lon)]
+
+    def cover(precision):
+        # Все ячейки длины precision, которые задевает прямоугольник
+        lat_bits, lon_bits = _geohash_bits(precision)
+        rows = range(_geohash_row(min_lat, lat_bits), _geohash_row(max_lat, lat_bits) + 1)
+        cols = [c for lo, hi in lon_spans
+                for c in range(_geohash_col(lo, lon_bits), _geohash_col(hi, lon_bits) + 1)]
+        return rows, cols
+
+    # При precision=1 ячеек всего 32, поэтому подходящая длина найдётся всегда
+    precision = 1
+    while precision < GEOHASH_PRECISION:
+        rows, cols = cover(precision + 1)
+        if len(rows) * len(cols) > max_cells:
+            break
+        precision += 1
+    rows, cols = cover(precision)
+
+    # Соседние по номеру ячейки склеиваем в один диапазон
+    codes = sorted({_geohash_code(r, c, precision) for r in rows for c in cols})
+    ranges = []
+    start = prev = codes[0]
+    for code in codes[1:] + [None]:
+        if code is not None and code == prev + 1:
+            prev = code
+            continue
+        upper = prev + 1
+        ranges.append((
+            _geohash_text(start, precision),
+            _geohash_text(upper, precision) if upper < 32 ** precision else None,
+        ))
+        if code is not None:
+            start = prev = code
+    return ranges
+
+
+def geohash_condition(lat, lon, radius_miles):
+    """
+    Условие WHERE «рынок в одной из ячеек geohash вокруг точки» — несколько
+    диапазонов по индексу idx_markets_geohash. Как и bbox_condition, только
+    отбирает кандидатов: точное расстояние всё равно проверяется в запросе.
+    Возвращает (sql, params).
+    """
+    parts, params = [], ()
+    for lower, upper in geohash_ranges(lat, lon, radius_miles):
+        if upper is None:
+            parts.append("m.geohash >= %s")
+            params += (lower,)
+        else:
+            parts.append("(m.geohash >= %s AND m.geohash < %s)")
+            params += (lower, upper)
+    return "(" + " OR ".join(parts) + ")", params
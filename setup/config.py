@@ -9,3 +9,13 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "app_pass") # заменили суперпользователя на нормального юзера
 }
 
+
+# Пул соединений для app/db.py (один на процесс)
+DB_POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN", 1)),            # сколько соединений открыть сразу
+    "max_size": int(os.getenv("DB_POOL_MAX", 10)),           # больше этого числа соединений не будет
+    "max_uses": int(os.getenv("DB_POOL_MAX_USES", 1000)),    # после стольких выдач соединение пересоздаётся
+    "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),  # ... или после стольких секунд жизни
+    "check_idle": float(os.getenv("DB_POOL_CHECK_IDLE", 5)),  # проверять SELECT 1, если соединение простаивало дольше (0 — всегда)
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),      # сколько ждать свободное соединение, секунд
+}
@@ -7,11 +7,14 @@
 -- 4. categories (справочник категорий товаров)
 -- 5. market_categories (связь рынков и категорий)
 -- Также добавляем индексы для ускорения поиска.
+--
+-- Скрипт идемпотентный (IF NOT EXISTS): его можно выполнять повторно
+-- на уже существующей базе — недостающие колонки и индексы будут добавлены.
 
 -- ======================================================
 -- 1. Таблица locations (адреса рынков)
 -- Хранит информацию о месте (улица, город, штат и т.д.)
-CREATE TABLE locations (
+CREATE TABLE IF NOT EXISTS locations (
     id SERIAL PRIMARY KEY,           -- id - уникальный идентификатор локации (автоинкремент)
     street VARCHAR(255),             -- улица (может быть NULL, потому что не всегда указано)
     city VARCHAR(100) NOT NULL,      -- город (обязательно)
@@ -23,7 +26,7 @@ CREATE TABLE locations (
 -- ======================================================
 -- 2. Таблица markets (фермерские рынки)
 -- Хранит основную информацию о каждом рынке.
-CREATE TABLE markets (
+CREATE TABLE IF NOT EXISTS markets (
     id SERIAL PRIMARY KEY,           -- id рынка (уникальный)
     name VARCHAR(255) NOT NULL,      -- название рынка (обязательно)
     location_id INT REFERENCES locations(id) ON DELETE CASCADE,
@@ -35,16 +38,15 @@ CREATE TABLE markets (
     youtube VARCHAR(255),            -- ссылка на YouTube
     other_media TEXT,                -- другие медиа (например, Instagram)
     latitude DECIMAL(10, 6),         -- широта (для поиска по радиусу)
-    longitude DECIMAL(10, 6),        -- долгота
+    longitude DECIMAL(10, 6)         -- долгота
 
-    -- Ограничение уникальности по совокупности полей
-    CONSTRAINT unique_market_entry UNIQUE (name, location_id, website, facebook, twitter, youtube, other_media, latitude, longitude)
+    -- Уникальность рынка обеспечивает identity_hash (см. ниже)
 );
 
 -- ======================================================
 -- 3. Таблица reviews (отзывы)
 -- Теперь с полем user_id для привязки к пользователю Django (auth_user)
-CREATE TABLE reviews (
+CREATE TABLE IF NOT EXISTS reviews (
     id SERIAL PRIMARY KEY,                             -- id отзыва
     market_id INT REFERENCES markets(id) ON DELETE CASCADE,  -- рынок
     user_id INT REFERENCES auth_user(id) ON DELETE SET NULL, -- автор (если есть)
@@ -59,7 +61,7 @@ CREATE TABLE reviews (
 -- 4. Таблица categories (справочник категорий товаров)
 -- Здесь храним все возможные категории из CSV-файла:
 -- Bakedgoods, Cheese, Meat, Fruits, Vegetables и т.д.
-CREATE TABLE categories (
+CREATE TABLE IF NOT EXISTS categories (
     id SERIAL PRIMARY KEY,              -- Уникальный идентификатор категории
     name VARCHAR(100) UNIQUE NOT NULL   -- Название категории (например, "Meat" или "Fruits")
 );
@@ -70,7 +72,7 @@ CREATE TABLE categories (
 -- Один рынок может предлагать несколько категорий товаров.
 -- Одна категория может встречаться на многих рынках.
 -- Это связь "многие ко многим" между markets и categories.
-CREATE TABLE market_categories (
+CREATE TABLE IF NOT EXISTS market_categories (
     market_id INT REFERENCES markets(id) ON DELETE CASCADE,
                                         -- ID рынка, внешний ключ на markets.id
     category_id INT REFERENCES categories(id) ON DELETE CASCADE,
@@ -82,7 +84,555 @@ CREATE TABLE market_categories (
 -- ======================================================
 -- === Индексы для ускорения поиска ===
 -- Индексы ускоряют выполнение запросов, где мы фильтруем по этим колонкам.
-CREATE INDEX idx_city ON locations(city);      -- поиск по городу
-CREATE INDEX idx_state ON locations(state);    -- поиск по штату
-CREATE INDEX idx_zip ON locations(zip);        -- поиск по индексу
-CREATE INDEX idx_market_name ON markets(name); -- поиск по названию рынка
+CREATE INDEX IF NOT EXISTS idx_city ON locations(city);      -- поиск по городу
+CREATE INDEX IF NOT EXISTS idx_state ON locations(state);    -- поиск по штату
+CREATE INDEX IF NOT EXISTS idx_zip ON locations(zip);        -- поиск по индексу
+CREATE INDEX IF NOT EXISTS idx_market_name ON markets(name); -- поиск по названию рынка
+
+-- ======================================================
+-- === Источник данных рынка (Export.csv) ===
+-- fmid              — идентификатор рынка в выгрузке (колонка FMID)
+-- source_updated_at — время последнего изменения в выгрузке (колонка updateTime)
+-- По ним load_data.py при повторной загрузке пропускает неизменённые строки
+-- и обновляет изменённые рынки на месте.
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS fmid BIGINT;
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS source_updated_at TIMESTAMP;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_markets_fmid ON markets(fmid);
+
+-- ======================================================
+-- === Хэш идентичности рынка ===
+-- Рынок уникален по девяти полям (name, location_id, ссылки, координаты).
+-- Раньше это был девятиколоночный UNIQUE (unique_market_entry): большой индекс,
+-- который к тому же считает NULL-ы разными, поэтому load_data.py искал дубликаты
+-- запросом из девяти IS NOT DISTINCT FROM без индекса.
+-- Теперь храним md5 от этих полей (NULL кодируется отдельным символом)
+-- и держим на нём уникальный индекс: поиск рынка — одна проверка по индексу.
+CREATE OR REPLACE FUNCTION market_identity_hash(
+    p_name TEXT, p_location_id INT, p_website TEXT, p_facebook TEXT, p_twitter TEXT,
+    p_youtube TEXT, p_other_media TEXT, p_latitude NUMERIC, p_longitude NUMERIC
+) RETURNS BYTEA
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT decode(md5(
+        coalesce(p_name, E'\x1e') || E'\x1f' ||
+        coalesce(p_location_id::text, E'\x1e') || E'\x1f' ||
+        coalesce(p_website, E'\x1e') || E'\x1f' ||
+        coalesce(p_facebook, E'\x1e') || E'\x1f' ||
+        coalesce(p_twitter, E'\x1e') || E'\x1f' ||
+        coalesce(p_youtube, E'\x1e') || E'\x1f' ||
+        coalesce(p_other_media, E'\x1e') || E'\x1f' ||
+        coalesce(p_latitude::text, E'\x1e') || E'\x1f' ||
+        coalesce(p_longitude::text, E'\x1e')
+    ), 'hex')
+$$;
+
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS identity_hash BYTEA
+    GENERATED ALWAYS AS (market_identity_hash(name, location_id, website, facebook, twitter,
+                                              youtube, other_media, latitude, longitude)) STORED;
+
+-- Переход со старой схемы: дубликаты (построчная загрузка дублировала рынки
+-- с NULL-полями) сливаем в самый ранний id, затем строим уникальный индекс.
+DO $$
+BEGIN
+    IF to_regclass('idx_markets_identity_hash') IS NULL THEN
+        CREATE TEMP TABLE market_duplicates ON COMMIT DROP AS
+            SELECT id, MIN(id) OVER (PARTITION BY identity_hash) AS keep_id FROM markets;
+        DELETE FROM market_duplicates WHERE id = keep_id;
+
+        UPDATE reviews r SET market_id = d.keep_id
+        FROM market_duplicates d WHERE r.market_id = d.id;
+        INSERT INTO market_categories (market_id, category_id)
+            SELECT d.keep_id, mc.category_id
+            FROM market_categories mc JOIN market_duplicates d ON d.id = mc.market_id
+            ON CONFLICT DO NOTHING;
+        DELETE FROM markets m USING market_duplicates d WHERE m.id = d.id;
+
+        CREATE UNIQUE INDEX idx_markets_identity_hash ON markets(identity_hash);
+    END IF;
+END $$;
+
+ALTER TABLE markets DROP CONSTRAINT IF EXISTS unique_market_entry;
+
+-- ======================================================
+-- === Чекпоинты загрузки (load_data.py --resume) ===
+-- Построчная загрузка коммитит строки пачками и вместе с каждой пачкой
+-- запоминает позицию первой ещё не загруженной строки файла.
+CREATE TABLE IF NOT EXISTS load_checkpoints (
+    file_path TEXT PRIMARY KEY,        -- абсолютный путь к CSV
+    byte_offset BIGINT NOT NULL,       -- смещение в байтах, с которого продолжать
+    row_number BIGINT NOT NULL,        -- сколько строк данных уже обработано
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ======================================================
+-- === Расписание рынков (market_hours) ===
+-- Колонки Season1Date..Season4Date / Season1Time..Season4Time из CSV
+-- разбираются при загрузке (app/schedule.py): одна строка = один интервал
+-- работы в один день недели в рамках сезона.
+-- Запросы «открыт сейчас», «открыт в субботу утром», «работает в июне»
+-- идут по индексам, без разбора текста во время запроса.
+CREATE TABLE IF NOT EXISTS market_hours (
+    id SERIAL PRIMARY KEY,
+    market_id INT NOT NULL REFERENCES markets(id) ON DELETE CASCADE,
+    season_no SMALLINT NOT NULL,                 -- номер сезона в CSV (1..4)
+    weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 1 AND 7),
+                                                 -- ISO-день: 1 = понедельник ... 7 = воскресенье (EXTRACT(ISODOW))
+    open_minute SMALLINT NOT NULL,               -- открытие, минуты от полуночи (9:00 AM -> 540)
+    close_minute SMALLINT NOT NULL,              -- закрытие, минуты от полуночи
+    season_start DATE,                           -- начало сезона (NULL — неизвестно)
+    season_end DATE                              -- конец сезона (NULL — без даты окончания)
+);
+
+CREATE INDEX IF NOT EXISTS idx_market_hours_market ON market_hours(market_id);
+-- «открыт в день X в момент T»: weekday = X AND open_minute <= T AND close_minute > T
+CREATE INDEX IF NOT EXISTS idx_market_hours_weekday ON market_hours(weekday, open_minute, close_minute);
+-- «работает в период»: season_start <= конец периода AND season_end >= начало периода
+CREATE INDEX IF NOT EXISTS idx_market_hours_season ON market_hours(season_start, season_end);
+
+-- ======================================================
+-- === Флаги рынка одним числом (markets.flags_mask) ===
+-- Каждой категории товаров и каждому способу оплаты соответствует свой бит
+-- в BIGINT. Фильтр «все выбранные» / «любой из выбранных» — одно условие:
+--   (flags_mask & маска) = маска   -- AND
+--   (flags_mask & маска) <> 0      -- OR
+-- вместо отдельного JOIN на каждую категорию.
+-- Биты 0..47 — категории (categories.bit_no), 48..62 — способы оплаты (payment_types.bit_no).
+
+-- Номер бита категории. Назначается автоматически при добавлении категории.
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS bit_no SMALLINT UNIQUE CHECK (bit_no BETWEEN 0 AND 47);
+
+CREATE OR REPLACE FUNCTION categories_assign_bit() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    next_bit INT;
+BEGIN
+    IF NEW.bit_no IS NULL THEN
+        SELECT COALESCE(MAX(bit_no) + 1, 0) INTO next_bit FROM categories;
+        -- Больше 48 категорий в маску не помещается — такие остаются без бита,
+        -- фильтры (flags_condition) проверяют их по market_categories
+        IF next_bit <= 47 THEN
+            NEW.bit_no := next_bit;
+        END IF;
+    END IF;
+    RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_categories_assign_bit ON categories;
+CREATE TRIGGER trg_categories_assign_bit
+    BEFORE INSERT ON categories
+    FOR EACH ROW EXECUTE FUNCTION categories_assign_bit();
+
+-- Категории, добавленные до появления bit_no, получают биты по порядку id
+UPDATE categories c
+SET bit_no = numbered.bit_no
+FROM (
+    SELECT id, (SELECT COALESCE(MAX(bit_no) + 1, 0) FROM categories)
+               + ROW_NUMBER() OVER (ORDER BY id) - 1 AS bit_no
+    FROM categories
+    WHERE bit_no IS NULL
+) numbered
+WHERE c.id = numbered.id AND numbered.bit_no <= 47;
+
+-- Способы оплаты (колонки Credit, WIC, WICcash, SFMNP, SNAP в CSV)
+CREATE TABLE IF NOT EXISTS payment_types (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(50) UNIQUE NOT NULL,                              -- имя колонки в CSV
+    bit_no SMALLINT UNIQUE NOT NULL CHECK (bit_no BETWEEN 48 AND 62)
+);
+
+INSERT INTO payment_types (name, bit_no) VALUES
+    ('Credit', 48),
+    ('WIC', 49),
+    ('WICcash', 50),
+    ('SFMNP', 51),
+    ('SNAP', 52)
+ON CONFLICT (name) DO NOTHING;
+
+-- Сама маска. При первом добавлении колонки заполняем биты категорий
+-- из market_categories и сбрасываем source_updated_at: биты оплаты есть
+-- только в CSV, и следующая загрузка перечитает все рынки.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'markets' AND column_name = 'flags_mask'
+    ) THEN
+        ALTER TABLE markets ADD COLUMN flags_mask BIGINT NOT NULL DEFAULT 0;
+
+        UPDATE markets m
+        SET flags_mask = bits.mask
+        FROM (
+            SELECT mc.market_id, bit_or(1::bigint << c.bit_no) AS mask
+            FROM market_categories mc
+            JOIN categories c ON c.id = mc.category_id
+            WHERE c.bit_no IS NOT NULL
+            GROUP BY mc.market_id
+        ) bits
+        WHERE m.id = bits.market_id;
+
+        UPDATE markets SET source_updated_at = NULL;
+    END IF;
+END $$;
+
+-- Синхронизация маски с market_categories: триггеры уровня оператора
+-- (одно UPDATE markets на весь INSERT/DELETE, а не на каждую строку связи)
+CREATE OR REPLACE FUNCTION market_categories_set_bits() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE markets m
+    SET flags_mask = m.flags_mask | bits.mask
+    FROM (
+        SELECT n.market_id, bit_or(1::bigint << c.bit_no) AS mask
+        FROM new_links n
+        JOIN categories c ON c.id = n.category_id
+        WHERE c.bit_no IS NOT NULL
+        GROUP BY n.market_id
+    ) bits
+    WHERE m.id = bits.market_id;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION market_categories_clear_bits() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE markets m
+    SET flags_mask = m.flags_mask & ~bits.mask
+    FROM (
+        SELECT o.market_id, bit_or(1::bigint << c.bit_no) AS mask
+        FROM old_links o
+        JOIN categories c ON c.id = o.category_id
+        WHERE c.bit_no IS NOT NULL
+        GROUP BY o.market_id
+    ) bits
+    WHERE m.id = bits.market_id;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_market_categories_set_bits ON market_categories;
+CREATE TRIGGER trg_market_categories_set_bits
+    AFTER INSERT ON market_categories
+    REFERENCING NEW TABLE AS new_links
+    FOR EACH STATEMENT EXECUTE FUNCTION market_categories_set_bits();
+
+DROP TRIGGER IF EXISTS trg_market_categories_clear_bits ON market_categories;
+CREATE TRIGGER trg_market_categories_clear_bits
+    AFTER DELETE ON market_categories
+    REFERENCING OLD TABLE AS old_links
+    FOR EACH STATEMENT EXECUTE FUNCTION market_categories_clear_bits();
+
+-- ======================================================
+-- === Индекс по координатам для поиска по радиусу ===
+-- Запросы «рынки в радиусе N миль» сначала отбирают прямоугольник
+-- latitude BETWEEN .. AND longitude BETWEEN .. (app/utils.bbox_condition),
+-- и только для попавших в него рынков считают точное расстояние.
+CREATE INDEX IF NOT EXISTS idx_markets_lat_lon ON markets(latitude, longitude);
+
+-- ======================================================
+-- === Geohash рынка (пространственный индекс без расширений) ===
+-- geohash — 12 символов base32: земной шар делится на 32 ячейки, каждая ещё на 32
+-- и так далее. Чем длиннее общий префикс, тем ближе точки, поэтому «рынки в
+-- ячейке 'drs'» — это диапазон строк geohash >= 'drs' AND geohash < 'drt',
+-- то есть обычный просмотр B-tree индекса.
+-- Поиск по радиусу (app/utils.geohash_condition) покрывает круг несколькими
+-- ячейками и превращается в несколько таких диапазонов.
+-- Колонка вычисляемая (как identity_hash): заполняется при загрузке
+-- (load_data.py) и пересчитывается при любом изменении координат.
+CREATE OR REPLACE FUNCTION geohash_encode(p_lat DOUBLE PRECISION, p_lon DOUBLE PRECISION)
+RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+DECLARE
+    alphabet CONSTANT TEXT := '0123456789bcdefghjkmnpqrstuvwxyz';
+    -- Номер ячейки по широте и долготе: 30 бит каждый (2^30 = 1073741824)
+    y BIGINT := LEAST(GREATEST(FLOOR((p_lat + 90) / 180 * 1073741824), 0), 1073741823);
+    x BIGINT := LEAST(GREATEST(FLOOR((p_lon + 180) / 360 * 1073741824), 0), 1073741823);
+    code BIGINT;
+    result TEXT := '';
+BEGIN
+    -- Раздвигаем биты через один (abc -> 0a0b0c), чтобы затем чередовать долготу и широту
+    x := (x | (x << 16)) & 0x0000FFFF0000FFFF;
+    x := (x | (x << 8))  & 0x00FF00FF00FF00FF;
+    x := (x | (x << 4))  & 0x0F0F0F0F0F0F0F0F;
+    x := (x | (x << 2))  & 0x3333333333333333;
+    x := (x | (x << 1))  & 0x5555555555555555;
+    y := (y | (y << 16)) & 0x0000FFFF0000FFFF;
+    y := (y | (y << 8))  & 0x00FF00FF00FF00FF;
+    y := (y | (y << 4))  & 0x0F0F0F0F0F0F0F0F;
+    y := (y | (y << 2))  & 0x3333333333333333;
+    y := (y | (y << 1))  & 0x5555555555555555;
+    -- Старший бит — долгота, следующий — широта и т.д. (60 бит = 12 символов по 5 бит)
+    code := (x << 1) | y;
+    FOR i IN 0..11 LOOP
+        result := result || substr(alphabet, ((code >> (55 - 5 * i)) & 31)::INT + 1, 1);
+    END LOOP;
+    RETURN result;
+END $$;
+
+-- COLLATE "C": строки сравниваются по байтам, поэтому префикс ячейки — непрерывный диапазон индекса
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS geohash TEXT COLLATE "C"
+    GENERATED ALWAYS AS (geohash_encode(latitude::DOUBLE PRECISION, longitude::DOUBLE PRECISION)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_markets_geohash ON markets(geohash);
+
+-- ======================================================
+-- === Номер изменения координат (coords_change_no) ===
+-- Индексы в памяти (app/geo_index.py, app/distance_engine.py,
+-- web/markets/geo_index.py) подтягивают из базы только рынки с
+-- coords_change_no больше последнего прочитанного. Номер берётся из
+-- последовательности триггером при вставке и при любом UPDATE координат —
+-- загрузчиком, в админке Django или вручную, — а не из source_updated_at,
+-- который меняет только загрузчик.
+CREATE SEQUENCE IF NOT EXISTS markets_coords_change_seq;
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS coords_change_no BIGINT;
+
+CREATE OR REPLACE FUNCTION markets_bump_coords_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.coords_change_no := nextval('markets_coords_change_seq');
+    RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_markets_bump_coords_change ON markets;
+CREATE TRIGGER trg_markets_bump_coords_change
+    BEFORE INSERT OR UPDATE OF latitude, longitude ON markets
+    FOR EACH ROW EXECUTE FUNCTION markets_bump_coords_change();
+
+-- Рынки, добавленные до появления колонки
+UPDATE markets SET coords_change_no = nextval('markets_coords_change_seq')
+WHERE coords_change_no IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_markets_coords_change ON markets(coords_change_no);
+
+-- ======================================================
+-- === Сводка рейтинга рынка (market_rating_summary) ===
+-- Средняя оценка и число отзывов хранятся готовыми, а не считаются
+-- подзапросами по reviews для каждой строки списка. Сортировка
+-- «по рейтингу» становится проходом по индексу, без агрегации всей reviews.
+-- Строки поддерживают триггеры уровня оператора (в той же транзакции, что и
+-- запись отзыва — через любой путь: Django, консоль, Streamlit, SQL).
+-- Починить расхождение: SELECT rebuild_market_rating_summary();
+-- (или python manage.py rebuild_rating_summary).
+CREATE TABLE IF NOT EXISTS market_rating_summary (
+    market_id INT PRIMARY KEY REFERENCES markets(id) ON DELETE CASCADE,
+    review_count INT NOT NULL DEFAULT 0,     -- всего отзывов (как COUNT(r.id))
+    rated_count INT NOT NULL DEFAULT 0,      -- отзывов с оценкой (rating IS NOT NULL)
+    rating_sum BIGINT NOT NULL DEFAULT 0,    -- сумма оценок
+    -- как COALESCE(AVG(r.rating), 0)
+    avg_rating NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN rated_count > 0 THEN rating_sum::NUMERIC / rated_count ELSE 0 END
+    ) STORED
+);
+
+-- «Лучшие» и «худшие» — в том же порядке, что и сортировка на страницах:
+-- (avg_rating, review_count DESC, id)
+CREATE INDEX IF NOT EXISTS idx_rating_summary_top ON market_rating_summary(avg_rating DESC, review_count DESC, market_id);
+CREATE INDEX IF NOT EXISTS idx_rating_summary_low ON market_rating_summary(avg_rating, review_count DESC, market_id);
+
+-- Пересчитать сводку по reviews; возвращает число исправленных строк
+CREATE OR REPLACE FUNCTION rebuild_market_rating_summary() RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+    fixed INT;
+BEGIN
+    -- Пока пересчитываем, отзывы не меняются (читать их можно)
+    LOCK TABLE reviews IN SHARE MODE;
+
+    WITH actual AS (
+        SELECT m.id AS market_id,
+               COUNT(r.id) AS review_count,
+               COUNT(r.rating) AS rated_count,
+               COALESCE(SUM(r.rating), 0) AS rating_sum
+        FROM markets m
+        LEFT JOIN reviews r ON r.market_id = m.id
+        GROUP BY m.id
+    ), changed AS (
+        INSERT INTO market_rating_summary AS s (market_id, review_count, rated_count, rating_sum)
+        SELECT market_id, review_count, rated_count, rating_sum FROM actual
+        ON CONFLICT (market_id) DO UPDATE
+        SET review_count = EXCLUDED.review_count,
+            rated_count = EXCLUDED.rated_count,
+            rating_sum = EXCLUDED.rating_sum
+        WHERE (s.review_count, s.rated_count, s.rating_sum)
+              IS DISTINCT FROM (EXCLUDED.review_count, EXCLUDED.rated_count, EXCLUDED.rating_sum)
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO fixed FROM changed;
+    RETURN fixed;
+END $$;
+
+-- Отзывы добавлены / удалены / изменены: сдвигаем суммы затронутых рынков
+CREATE OR REPLACE FUNCTION reviews_update_rating_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE market_rating_summary s
+        SET review_count = s.review_count - d.review_count,
+            rated_count = s.rated_count - d.rated_count,
+            rating_sum = s.rating_sum - d.rating_sum
+        FROM (
+            SELECT market_id, COUNT(*) AS review_count, COUNT(rating) AS rated_count,
+                   COALESCE(SUM(rating), 0) AS rating_sum
+            FROM old_reviews
+            WHERE market_id IS NOT NULL
+            GROUP BY market_id
+        ) d
+        WHERE s.market_id = d.market_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO market_rating_summary AS s (market_id, review_count, rated_count, rating_sum)
+        SELECT market_id, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0)
+        FROM new_reviews
+        WHERE market_id IS NOT NULL
+        GROUP BY market_id
+        ON CONFLICT (market_id) DO UPDATE
+        SET review_count = s.review_count + EXCLUDED.review_count,
+            rated_count = s.rated_count + EXCLUDED.rated_count,
+            rating_sum = s.rating_sum + EXCLUDED.rating_sum;
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_reviews_summary_insert ON reviews;
+CREATE TRIGGER trg_reviews_summary_insert
+    AFTER INSERT ON reviews
+    REFERENCING NEW TABLE AS new_reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION reviews_update_rating_summary();
+
+DROP TRIGGER IF EXISTS trg_reviews_summary_delete ON reviews;
+CREATE TRIGGER trg_reviews_summary_delete
+    AFTER DELETE ON reviews
+    REFERENCING OLD TABLE AS old_reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION reviews_update_rating_summary();
+
+DROP TRIGGER IF EXISTS trg_reviews_summary_update ON reviews;
+CREATE TRIGGER trg_reviews_summary_update
+    AFTER UPDATE ON reviews
+    REFERENCING OLD TABLE AS old_reviews NEW TABLE AS new_reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION reviews_update_rating_summary();
+
+-- Новый рынок сразу получает пустую сводку (иначе он выпал бы из сортировки по рейтингу)
+CREATE OR REPLACE FUNCTION markets_add_rating_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO market_rating_summary (market_id)
+    SELECT id FROM new_markets
+    ON CONFLICT (market_id) DO NOTHING;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_markets_add_rating_summary ON markets;
+CREATE TRIGGER trg_markets_add_rating_summary
+    AFTER INSERT ON markets
+    REFERENCING NEW TABLE AS new_markets
+    FOR EACH STATEMENT EXECUTE FUNCTION markets_add_rating_summary();
+
+-- Первое создание таблицы — заполняем по существующим отзывам
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM market_rating_summary) THEN
+        PERFORM rebuild_market_rating_summary();
+    END IF;
+END $$;
+
+-- ======================================================
+-- === Индексы по внешним ключам ===
+-- PostgreSQL сам создаёт индекс только для PRIMARY KEY / UNIQUE, а для
+-- колонки с REFERENCES — нет. Без этих индексов каждый запрос «отзывы рынка»,
+-- «рынки в локации», «рынки категории» читает всю таблицу, а удаление рынка
+-- (ON DELETE CASCADE) ищет его отзывы полным проходом по reviews.
+-- Проверить схему и запросы страниц: python manage.py advise_indexes
+--
+-- Отзывы рынка (детали рынка, страница отзывов): WHERE market_id = .. ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_reviews_market ON reviews(market_id, id);
+-- Отзывы пользователя (и ON DELETE SET NULL при удалении пользователя Django)
+CREATE INDEX IF NOT EXISTS idx_reviews_user ON reviews(user_id);
+-- Рынки локации: поиск по городу/штату/индексу идёт от locations к markets
+CREATE INDEX IF NOT EXISTS idx_markets_location ON markets(location_id);
+-- Рынки категории (первичный ключ (market_id, category_id) помогает только «категориям рынка»)
+CREATE INDEX IF NOT EXISTS idx_market_categories_category ON market_categories(category_id, market_id);
+
+-- ======================================================
+-- === Поиск рынка по строке (название/город/штат/индекс) ===
+-- Раньше поиск был цепочкой m.name ILIKE '%q%' OR l.city ILIKE '%q%' OR ...:
+-- с % в начале B-tree индексы не работают, и каждый запрос проходил
+-- все рынки вместе с JOIN на locations. Теперь у рынка есть готовые поля:
+--   search_text — «название город штат индекс» в нижнем регистре;
+--   search_tsv  — те же слова для полнотекстового поиска с весами
+--                 (название A, город B, штат C, индекс D — для ранжирования).
+-- Их заполняют триггеры (город/штат/индекс лежат в locations, поэтому
+-- GENERATED-колонка тут не подходит). Запросы — app/search.py.
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS search_text TEXT;
+ALTER TABLE markets ADD COLUMN IF NOT EXISTS search_tsv tsvector;
+
+-- Оба поля из названия рынка и его адреса (одна функция — для триггеров и заполнения)
+CREATE OR REPLACE FUNCTION market_search_text(name TEXT, city TEXT, state TEXT, zip TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT lower(concat_ws(' ', name, city, state, zip))
+$$;
+
+CREATE OR REPLACE FUNCTION market_search_tsv(name TEXT, city TEXT, state TEXT, zip TEXT) RETURNS tsvector
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT setweight(to_tsvector('simple', COALESCE(name, '')), 'A')
+        || setweight(to_tsvector('simple', COALESCE(city, '')), 'B')
+        || setweight(to_tsvector('simple', COALESCE(state, '')), 'C')
+        || setweight(to_tsvector('simple', COALESCE(zip, '')), 'D')
+$$;
+
+-- Новый рынок / смена названия или локации
+CREATE OR REPLACE FUNCTION markets_set_search() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    loc RECORD;
+BEGIN
+    SELECT city, state, zip INTO loc FROM locations WHERE id = NEW.location_id;
+    NEW.search_text := market_search_text(NEW.name, loc.city, loc.state, loc.zip);
+    NEW.search_tsv := market_search_tsv(NEW.name, loc.city, loc.state, loc.zip);
+    RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_markets_set_search ON markets;
+CREATE TRIGGER trg_markets_set_search
+    BEFORE INSERT OR UPDATE OF name, location_id ON markets
+    FOR EACH ROW EXECUTE FUNCTION markets_set_search();
+
+-- Изменился адрес — пересчитываем поля у всех рынков этой локации (одним UPDATE на оператор)
+CREATE OR REPLACE FUNCTION locations_update_search() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE markets m
+    SET search_text = market_search_text(m.name, n.city, n.state, n.zip),
+        search_tsv = market_search_tsv(m.name, n.city, n.state, n.zip)
+    FROM new_locations n
+    WHERE m.location_id = n.id;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_locations_update_search ON locations;
+CREATE TRIGGER trg_locations_update_search
+    AFTER UPDATE ON locations
+    REFERENCING NEW TABLE AS new_locations
+    FOR EACH STATEMENT EXECUTE FUNCTION locations_update_search();
+
+-- Рынки, добавленные до появления колонок
+UPDATE markets m
+SET search_text = market_search_text(m.name, l.city, l.state, l.zip),
+    search_tsv = market_search_tsv(m.name, l.city, l.state, l.zip)
+FROM locations l
+WHERE l.id = m.location_id AND m.search_text IS NULL;
+
+-- Полнотекстовый индекс есть всегда (встроен в PostgreSQL): поиск по началу слов
+CREATE INDEX IF NOT EXISTS idx_markets_search_tsv ON markets USING gin (search_tsv);
+
+-- Триграммный индекс — если на сервере есть расширение pg_trgm (пакет postgresql-contrib).
+-- Он ищет любую подстроку: search_text LIKE '%ston%' найдёт Boston.
+-- Нет расширения или прав на CREATE EXTENSION — поиск работает по search_tsv.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_markets_search_trgm ON markets USING gin (search_text gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm недоступен: поиск рынков будет полнотекстовым (search_tsv)';
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'нет прав на CREATE EXTENSION pg_trgm: поиск рынков будет полнотекстовым (search_tsv)';
+END $$;
@@ -0,0 +1,292 @@
+# tools/bench_ingest.py
+# =======================================================
+# Бенчмарк загрузки данных (app/load_data.py).
+#
+# Для каждого размера файла (по умолчанию 10k, 100k и 1M строк) и каждого
+# режима загрузки:
+#   serial   — load_data() (построчно, пачками с чекпоинтами);
+#   bulk     — load_data_bulk() (COPY + set-based SQL);
+#   parallel — load_data_bulk(workers=N) (разбор CSV в N процессов);
+# меряем:
+#   - rows/s          — строк CSV в секунду;
+#   - statements      — сколько SQL-команд отправил клиент (включая COPY и воркеров);
+#   - peak_rss_kb     — пик памяти процесса загрузки (и его воркеров);
+#   - wal_bytes       — сколько байт WAL записал сервер за прогон.
+# Результат — JSON-отчёт. С --baseline отчёт сравнивается с сохранённым:
+# если rows/s упал больше, чем на --threshold, скрипт завершается с кодом 1.
+#
+# ВНИМАНИЕ: перед каждым прогоном таблицы рынков ОЧИЩАЮТСЯ (TRUNCATE),
+# поэтому запускать только на отдельной тестовой базе и с флагом --truncate.
+#
+# Пример:
+#   python tools/bench_ingest.py --truncate --sizes 10000 100000 --modes bulk parallel \
+#       --out bench.json --baseline bench_baseline.json --threshold 0.15
+# =======================================================
+
+import sys
+import os
+# Добавляем путь к корню проекта, чтобы работали импорты app.* и setup.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import multiprocessing
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import psycopg2
+from setup.config import DB_CONFIG
+
+MODES = ("serial", "bulk", "parallel")
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+# Очистка перед прогоном: все таблицы, которые заполняет загрузчик (категории остаются)
+TRUNCATE_SQL = """
+    TRUNCATE market_hours, market_categories, reviews, markets, locations, load_checkpoints
+    RESTART IDENTITY CASCADE
+"""
+
+# Дочерний процесс печатает результат последней строкой с этим префиксом
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+# ===========================================================
+# === Дочерний процесс: один прогон загрузчика ===
+# ===========================================================
+
+def _install_statement_counter(counter):
+    """
+    Подменяет psycopg2.connect так, чтобы каждый курсор считал свои
+    execute / executemany / copy_expert в общий счётчик counter
+    (multiprocessing.Value — его видят и воркеры параллельного режима).
+    """
+    class CountingCursor(psycopg2.extensions.cursor):
+        def _count(self):
+            with counter.get_lock():
+                counter.value += 1
+
+        def execute(self, query, vars=None):
+            self._count()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            # executemany — это отдельная команда на каждый набор параметров
+            vars_list = list(vars_list)
+            with counter.get_lock():
+                counter.value += len(vars_list)
+            return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            self._count()
+            return super().copy_expert(sql, file, size)
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def cursor(self, *args, **kwargs):
+            kwargs.setdefault("cursor_factory", CountingCursor)
+            return super().cursor(*args, **kwargs)
+
+    original_connect = psycopg2.connect
+
+    def counting_connect(*args, **kwargs):
+        kwargs.setdefault("connection_factory", CountingConnection)
+        return original_connect(*args, **kwargs)
+
+    psycopg2.connect = counting_connect
+
+
+def run_child(mode, csv_file, workers):
+    """
+    Выполняет одну загрузку и печатает JSON с замерами.
+    Запускается отдельным процессом, чтобы пик памяти относился только к ней.
+    """
+    counter = multiprocessing.Value("q", 0)
+    _install_statement_counter(counter)
+
+    from app import load_data as loader  # импорт после подмены connect
+
+    started = time.perf_counter()
+    if mode == "serial":
+        loader.load_data(csv_file)
+    elif mode == "bulk":
+        loader.load_data_bulk(csv_file)
+    else:
+        loader.load_data_bulk(csv_file, workers=workers)
+    seconds = time.perf_counter() - started
+
+    # ru_maxrss в Linux — в килобайтах; воркеры учитываются через RUSAGE_CHILDREN
+    peak_rss_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    print(RESULT_PREFIX + json.dumps({
+        "seconds": seconds,
+        "statements": counter.value,
+        "peak_rss_kb": peak_rss_kb,
+    }))
+
+
+# ===========================================================
+# === Основной процесс ===
+# ===========================================================
+
+def count_csv_rows(csv_file):
+    """
+    Число строк данных в CSV (без заголовка).
+    """
+    with open(csv_file, "rb") as f:
+        return sum(1 for _ in f) - 1
+
+
+def ensure_dataset(size, seed, data_dir):
+    """
+    Возвращает путь к сгенерированному CSV на size строк (создаёт, если его нет).
+    Файл определяется seed, поэтому повторные прогоны используют те же данные.
+    """
+    from tools.generate_data import write_csv
+
+    path = os.path.join(data_dir, f"markets_{size}_seed{seed}.csv")
+    if not os.path.exists(path):
+        write_csv(path, size, seed)
+    return path
+
+
+def current_wal_lsn(cur):
+    cur.execute("SELECT pg_current_wal_lsn()")
+    return cur.fetchone()[0]
+
+
+def run_case(mode, csv_file, workers):
+    """
+    Один прогон: очистка таблиц, загрузка в дочернем процессе, замер WAL.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(TRUNCATE_SQL)
+    # Контрольная точка — чтобы full-page writes после TRUNCATE не зависели от предыдущего прогона
+    try:
+        cur.execute("CHECKPOINT")
+    except psycopg2.Error:
+        pass  # CHECKPOINT требует прав суперпользователя — без него замер чуть менее стабилен
+    lsn_before = current_wal_lsn(cur)
+
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, csv_file, str(workers)],
+        capture_output=True, text=True,
+    )
+
+    lsn_after = current_wal_lsn(cur)
+    cur.execute("SELECT pg_wal_lsn_diff(%s, %s)", (lsn_after, lsn_before))
+    wal_bytes = int(cur.fetchone()[0])
+    cur.close()
+    conn.close()
+
+    result_lines = [l for l in proc.stdout.splitlines() if l.startswith(RESULT_PREFIX)]
+    if proc.returncode != 0 or not result_lines:
+        raise RuntimeError(f"прогон {mode} упал:\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+    # Загрузчик сообщает об ошибках через print, а не исключением
+    if "Ошибка при" in proc.stdout:
+        raise RuntimeError(f"прогон {mode} завершился с ошибкой:\n{proc.stdout[-2000:]}")
+
+    measured = json.loads(result_lines[-1][len(RESULT_PREFIX):])
+    measured["wal_bytes"] = wal_bytes
+    return measured
+
+
+def compare_with_baseline(report, baseline, threshold):
+    """
+    Сравнивает rows/s с базовым отчётом. Возвращает список строк-регрессий.
+    """
+    baseline_results = {(r["mode"], r["rows"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        base = baseline_results.get((result["mode"], result["rows"]))
+        if not base:
+            continue
+        limit = base["rows_per_sec"] * (1 - threshold)
+        result["baseline_rows_per_sec"] = base["rows_per_sec"]
+        if result["rows_per_sec"] < limit:
+            regressions.append(
+                f"{result['mode']} / {result['rows']} строк: {result['rows_per_sec']:.0f} строк/с "
+                f"< {limit:.0f} (база {base['rows_per_sec']:.0f}, порог {threshold:.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки CSV в PostgreSQL")
+    parser.add_argument("--truncate", action="store_true",
+                        help="подтверждение: перед каждым прогоном таблицы рынков очищаются")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="размеры сгенерированных CSV (строк)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES),
+                        help="режимы загрузки")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                        help="число воркеров для режима parallel")
+    parser.add_argument("--seed", type=int, default=42, help="seed генератора данных")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "fm_bench"),
+                        help="куда складывать сгенерированные CSV")
+    parser.add_argument("--out", default="bench_ingest.json", help="куда записать JSON-отчёт")
+    parser.add_argument("--baseline", help="JSON-отчёт, с которым сравниваем rows/s")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="допустимое падение rows/s относительно базы (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if not args.truncate:
+        print("Бенчмарк очищает таблицы markets/locations/reviews перед каждым прогоном.")
+        print("Запускайте его только на тестовой базе и с флагом --truncate.")
+        sys.exit(2)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "seed": args.seed,
+        "workers": args.workers,
+        "results": [],
+    }
+
+    for size in args.sizes:
+        csv_file = ensure_dataset(size, args.seed, args.data_dir)
+        rows = count_csv_rows(csv_file)
+        for mode in args.modes:
+            print(f"== {mode}, {rows} строк ...", flush=True)
+            measured = run_case(mode, csv_file, args.workers)
+            result = {
+                "mode": mode,
+                "rows": rows,
+                "seconds": round(measured["seconds"], 3),
+                "rows_per_sec": round(rows / measured["seconds"], 1) if measured["seconds"] > 0 else 0.0,
+                "statements": measured["statements"],
+                "peak_rss_kb": measured["peak_rss_kb"],
+                "wal_bytes": measured["wal_bytes"],
+            }
+            report["results"].append(result)
+            print(f"   {result['rows_per_sec']:.0f} строк/с, команд: {result['statements']}, "
+                  f"пик памяти: {result['peak_rss_kb'] // 1024} МБ, WAL: {result['wal_bytes'] / 2**20:.1f} МБ")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчёт: {args.out}")
+
+    if regressions:
+        print("РЕГРЕССИЯ производительности:")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+
+
+# === Точка входа ===
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
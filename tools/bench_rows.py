@@ -0,0 +1,111 @@
+# tools/bench_rows.py
+# =======================================================
+# Микробенчмарк: сколько стоит превращение строки результата в Python-объект
+# в web/markets/db.execute_query при разных row_factory.
+#
+# Сравниваются:
+#   loop       — старый способ (вложенный цикл по enumerate(columns), как было в views.py);
+#   dict / tuple / namedtuple / row — варианты row_factory.
+#
+# Для каждого варианта печатается:
+#   convert — только преобразование уже полученных кортежей (мкс на строку);
+#   query   — execute_query(..., fetch=True) целиком: запрос + fetchall + преобразование.
+#
+# Пример:
+#   python tools/bench_rows.py --rows 200000 --repeat 5
+# =======================================================
+
+import sys
+import os
+# Добавляем пути: корень проекта и папку web (там Django-проект fm_project)
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'web'))
+
+import argparse
+import gc
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fm_project.settings")
+import django
+django.setup()
+
+from django.db import connection
+from markets.db import execute_query, _row_converter, ROW_FACTORIES
+
+# Строки, похожие на выборку рынков: число, два текста, координаты, дата
+BENCH_SQL = """
+    SELECT g AS id,
+           'Market ' || g AS name,
+           'City ' || (g %% 500) AS city,
+           (g %% 90)::numeric(10, 6) AS latitude,
+           (g %% 180)::numeric(10, 6) AS longitude,
+           now() AS updated_at
+    FROM generate_series(1, %s) g
+"""
+
+
+def convert_loop(columns, rows):
+    """
+    Старый способ из dashboard_home/execute_query: словарь собирается вложенным циклом.
+    """
+    result = []
+    for r in rows:
+        item = {}
+        for i, v in enumerate(r):
+            item[columns[i]] = v
+        result.append(item)
+    return result
+
+
+def best_time(func, repeat):
+    """
+    Лучшее время из repeat запусков (секунды) — меньше шума от планировщика.
+    Сборщик мусора на время замера выключаем (как timeit): иначе его проходы
+    по сотням тысяч новых объектов перемешивают результаты между режимами.
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость row_factory на строку")
+    parser.add_argument("--rows", type=int, default=100000, help="сколько строк в выборке")
+    parser.add_argument("--repeat", type=int, default=5, help="сколько повторов (берём лучший)")
+    args = parser.parse_args()
+
+    # Один раз получаем «сырые» кортежи для замера чистого преобразования
+    with connection.cursor() as cur:
+        cur.execute(BENCH_SQL, (args.rows,))
+        columns = [c[0] for c in cur.description]
+        raw_rows = cur.fetchall()
+
+    print(f"Строк: {args.rows}, повторов: {args.repeat} (лучшее время)")
+    print(f"{'режим':<12}{'convert, мкс/строка':>22}{'query, мкс/строка':>20}")
+
+    convert = best_time(lambda: convert_loop(columns, raw_rows), args.repeat)
+    print(f"{'loop':<12}{convert / args.rows * 1e6:>22.3f}{'—':>20}")
+
+    for factory in ROW_FACTORIES:
+        converter = _row_converter(columns, factory)
+        convert = best_time(lambda: converter(raw_rows), args.repeat)
+        query = best_time(
+            lambda: execute_query(BENCH_SQL, (args.rows,), fetch=True, row_factory=factory),
+            args.repeat,
+        )
+        print(f"{factory:<12}{convert / args.rows * 1e6:>22.3f}{query / args.rows * 1e6:>20.3f}")
+
+
+# === Точка входа ===
+if __name__ == "__main__":
+    main()
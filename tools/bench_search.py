@@ -0,0 +1,117 @@
+# tools/bench_search.py
+# =======================================================
+# Бенчмарк поиска рынка по строке (app/search.py) против прежней цепочки
+#     m.name ILIKE '%q%' OR l.city ILIKE '%q%' OR l.state ILIKE '%q%' OR l.zip ILIKE '%q%'
+#
+# Для каждого запроса и каждого способа печатается лучшее время (мс):
+#   count — SELECT COUNT(*) (точный, без кеша totals);
+#   page  — первая страница (20 строк): для старого способа ORDER BY m.name,
+#           для нового — по релевантности (или по названию, если найдено
+#           больше search.SEARCH_RANK_LIMIT).
+# Способы: ilike (как было), fts (search_tsv) и trgm (search_text, если
+# установлен pg_trgm).
+#
+# Данные — синтетические, например 1 млн рынков:
+#   python tools/generate_data.py db --rows 1000000
+#   python tools/bench_search.py --repeat 5
+#   python tools/bench_search.py --queries "boston" "farm" "9021" --out bench_search.json
+# =======================================================
+
+import sys
+import os
+# Добавляем путь к корню проекта, чтобы работали импорты app.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import time
+
+from app.db import execute_query
+from app import search
+
+# Запросы по умолчанию: город, начало слова, слово из названия, штат, индекс, редкое слово
+DEFAULT_QUERIES = ["boston", "spring", "farmers market", "texas", "021", "orchard"]
+
+PAGE_SIZE = 20
+
+OLD_WHERE = "m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s OR l.zip ILIKE %s"
+
+
+def best_ms(func, repeat):
+    """
+    Лучшее время из repeat запусков (мс) и результат последнего запуска.
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_ilike(q, repeat):
+    params = (f"%{q}%",) * 4
+    count_ms, count = best_ms(lambda: execute_query(
+        f"SELECT COUNT(*) FROM markets m JOIN locations l ON l.id = m.location_id WHERE {OLD_WHERE}",
+        params, fetch=True,
+    )[0]["count"], repeat)
+    page_ms, _ = best_ms(lambda: execute_query(
+        f"""
+        SELECT m.id, m.name, l.city, l.state, l.zip
+        FROM markets m
+        JOIN locations l ON l.id = m.location_id
+        WHERE {OLD_WHERE}
+        ORDER BY m.name
+        LIMIT %s
+        """,
+        params + (PAGE_SIZE,), fetch=True,
+    ), repeat)
+    return count_ms, page_ms, count
+
+
+def bench_backend(q, backend, repeat):
+    parts = search.search_parts(q, backend)
+    count_ms, count = best_ms(lambda: execute_query(
+        f"SELECT COUNT(*) FROM markets m {parts['source']} WHERE {parts['where']}",
+        parts["params"], fetch=True,
+    )[0]["count"], repeat)
+    page_ms, _ = best_ms(lambda: search.search_markets(q, PAGE_SIZE, 0, backend, total=count), repeat)
+    return count_ms, page_ms, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск рынка по строке: ILIKE против GIN-индексов")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES, help="строки поиска")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько повторов (берём лучший)")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    markets = execute_query("SELECT COUNT(*) FROM markets", fetch=True)[0]["count"]
+    backends = ["ilike", "fts"] + (["trgm"] if search.has_trigram() else [])
+    print(f"Рынков: {markets}, повторов: {args.repeat} (лучшее время)")
+    if "trgm" not in backends:
+        print("pg_trgm не установлен — способ trgm пропущен.")
+    print(f"{'запрос':<18}{'способ':<8}{'найдено':>10}{'count, мс':>12}{'page, мс':>12}")
+
+    results = []
+    for q in args.queries:
+        for backend in backends:
+            if backend == "ilike":
+                count_ms, page_ms, found = bench_ilike(q, args.repeat)
+            else:
+                count_ms, page_ms, found = bench_backend(q, backend, args.repeat)
+            print(f"{q:<18}{backend:<8}{found:>10}{count_ms:>12.1f}{page_ms:>12.1f}")
+            results.append({"query": q, "backend": backend, "found": found,
+                            "count_ms": round(count_ms, 2), "page_ms": round(page_ms, 2)})
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"markets": markets, "repeat": args.repeat, "results": results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.out}")
+
+
+# === Точка входа ===
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# tools/generate_data.py
+# =======================================================
+# Генератор синтетических данных для нагрузочных тестов и бенчмарков.
+#
+# Export.csv содержит всего ~1.7 тыс. рынков, поэтому на нём не видно,
+# как проект ведёт себя на миллионе рынков и десятках миллионов отзывов.
+# Этот скрипт создаёт данные «как настоящие»:
+# - координаты кучкуются вокруг реальных городов из Export.csv;
+# - доля "Y" в каждой категории и способе оплаты — как в реальном файле;
+# - доля заполненных ссылок (Website, Facebook, ...) — как в реальном файле;
+# - сезоны/часы работы берутся из реальных строк.
+# Всё определяется параметром --seed: один и тот же seed даёт один и тот же
+# результат, поэтому замеры можно сравнивать между запусками.
+#
+# Режимы:
+#   csv     — пишет CSV в формате Export.csv (дальше его грузит app/load_data.py):
+#             python tools/generate_data.py csv --rows 100000 --out /tmp/markets_100k.csv
+#   db      — сразу пишет рынки в базу через COPY (тот же staging, что у load_data.py --bulk),
+#             плюс отзывы:
+#             python tools/generate_data.py db --rows 1000000 --reviews 50000000
+#   reviews — только отзывы к уже загруженным рынкам:
+#             python tools/generate_data.py reviews --count 1000000
+# =======================================================
+
+import sys
+import os
+# Добавляем путь к корню проекта, чтобы работали импорты app.* и setup.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import csv
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from setup.config import DB_CONFIG
+from app import load_data as loader
+
+# Реальный файл — образец для всех распределений
+SOURCE_CSV = os.path.join(os.path.dirname(__file__), '..', 'setup', 'Export.csv')
+
+# Синтетические FMID начинаются отсюда, чтобы не пересекаться с реальными
+FMID_START = 90_000_000
+
+# Разброс координат вокруг города (в градусах, ~0.1° ≈ 11 км)
+CLUSTER_SIGMA_DEG = 0.08
+
+# Сколько строк держим в памяти перед записью / COPY
+BATCH_ROWS = 50_000
+
+# Колонки со ссылками, которые заполняются не у всех рынков
+LINK_COLUMNS = ["Website", "Facebook", "Twitter", "Youtube", "OtherMedia"]
+
+# Способы оплаты (колонки CSV)
+PAYMENT_COLUMNS = ["Credit", "WIC", "WICcash", "SFMNP", "SNAP"]
+
+# Части названий рынков
+NAME_PATTERNS = [
+    "{city} Farmers Market",
+    "{city} Farmers' Market",
+    "{city} Community Market",
+    "{city} Market on the Square",
+    "Downtown {city} Market",
+    "{city} Saturday Market",
+    "{city} Growers Market",
+    "{county} County Farmers Market",
+    "{street} Market",
+]
+
+# Оценки в отзывах: чаще хорошие, как в реальных отзывах
+RATING_WEIGHTS = [(1, 5), (2, 8), (3, 17), (4, 35), (5, 35)]
+
+REVIEW_TEXTS = [
+    "Great selection of fresh produce.",
+    "Friendly vendors, a bit crowded on weekends.",
+    "Good prices, limited parking.",
+    "Nice place to spend a Saturday morning.",
+    "Not much choice this time.",
+    "Excellent honey and baked goods!",
+    "Would come again.",
+    "",
+]
+
+
+# ===========================================================
+# === Профиль реального файла ===
+# ===========================================================
+
+def build_profile(source_csv=SOURCE_CSV):
+    """
+    Читает Export.csv и собирает всё, что нужно генератору:
+    - header: заголовок CSV (генерируемый файл совместим с load_data.py);
+    - cities: реальные (city, state, county, zip, lat, lon, street) как центры кластеров;
+    - flag_density: доля "Y" для каждой категории и способа оплаты;
+    - link_density: доля заполненных ссылок;
+    - seasons: реальные наборы Season1..4 Date/Time.
+    """
+    with open(source_csv, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames
+        rows = list(reader)
+
+    category_columns = loader.read_categories(source_csv)
+    flag_columns = category_columns + PAYMENT_COLUMNS
+    flag_density = {
+        col: sum(1 for r in rows if r.get(col) == "Y") / len(rows)
+        for col in flag_columns
+    }
+    link_density = {
+        col: sum(1 for r in rows if (r.get(col) or "").strip()) / len(rows)
+        for col in LINK_COLUMNS
+    }
+
+    cities = []
+    seasons = []
+    for r in rows:
+        if r["city"] and r["State"] and r["x"] and r["y"]:
+            cities.append((
+                r["city"].strip(), r["State"].strip(), (r["County"] or "").strip(),
+                (r["zip"] or "").strip(), float(r["y"]), float(r["x"]), (r["street"] or "").strip(),
+            ))
+        seasons.append({
+            key: r[key] for key in header if key.startswith("Season")
+        })
+
+    return {
+        "header": header,
+        "category_columns": category_columns,
+        "flag_density": flag_density,
+        "link_density": link_density,
+        "cities": cities,
+        "seasons": seasons,
+    }
+
+
+def _slug(text):
+    """
+    "Lake City Market" -> "lakecitymarket" (для синтетических ссылок)
+    """
+    return re.sub(r"[^a-z0-9]+", "", text.lower()) or "market"
+
+
+def _update_time(rng):
+    """
+    Случайное время обновления в формате Export.csv: "8/3/2020 3:23:12 PM"
+    """
+    moment = datetime(2018, 1, 1) + timedelta(seconds=rng.randrange(5 * 365 * 24 * 3600))
+    hour12 = moment.hour % 12 or 12
+    am_pm = "AM" if moment.hour < 12 else "PM"
+    return f"{moment.month}/{moment.day}/{moment.year} {hour12}:{moment.minute:02d}:{moment.second:02d} {am_pm}"
+
+
+def iter_market_rows(profile, count, seed):
+    """
+    Генерирует count строк-словарей с теми же ключами, что у csv.DictReader
+    для Export.csv. Порядок и содержимое полностью определяются seed.
+    """
+    rng = random.Random(seed)
+    header = profile["header"]
+    cities = profile["cities"]
+    seasons = profile["seasons"]
+
+    for n in range(count):
+        city, state, county, zip_code, lat, lon, street = rng.choice(cities)
+        name = rng.choice(NAME_PATTERNS).format(
+            city=city, county=county or city, street=street or city,
+        )
+        slug = _slug(name)
+
+        row = dict.fromkeys(header, "")
+        row.update(rng.choice(seasons))
+        row.update({
+            "FMID": str(FMID_START + n),
+            "MarketName": name,
+            "street": street,
+            "city": city,
+            "County": county,
+            "State": state,
+            "zip": zip_code,
+            # Кластер вокруг реального города; округляем как в Export.csv
+            "y": f"{max(-90.0, min(90.0, rng.gauss(lat, CLUSTER_SIGMA_DEG))):.6f}",
+            "x": f"{max(-180.0, min(180.0, rng.gauss(lon, CLUSTER_SIGMA_DEG))):.6f}",
+            "updateTime": _update_time(rng),
+        })
+
+        links = {
+            "Website": f"https://www.{slug}.org",
+            "Facebook": f"https://www.facebook.com/{slug}",
+            "Twitter": f"https://twitter.com/{slug}",
+            "Youtube": f"https://www.youtube.com/@{slug}",
+            "OtherMedia": f"https://www.instagram.com/{slug}",
+        }
+        for col, density in profile["link_density"].items():
+            if rng.random() < density:
+                row[col] = links[col]
+
+        for col, density in profile["flag_density"].items():
+            row[col] = "Y" if rng.random() < density else "N"
+
+        yield row
+
+
+# ===========================================================
+# === Режим csv: файл в формате Export.csv ===
+# ===========================================================
+
+def write_csv(out_path, count, seed, source_csv=SOURCE_CSV):
+    """
+    Пишет count синтетических рынков в CSV, совместимый с app/load_data.py.
+    """
+    started = time.perf_counter()
+    profile = build_profile(source_csv)
+    with open(out_path, "w", newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=profile["header"])
+        writer.writeheader()
+        for row in iter_market_rows(profile, count, seed):
+            writer.writerow(row)
+    print(f"Записано рынков: {count} -> {out_path} ({time.perf_counter() - started:.1f} с)")
+
+
+# ===========================================================
+# === Режим db: рынки сразу в базу через COPY ===
+# ===========================================================
+
+def load_markets_direct(conn, count, seed, source_csv=SOURCE_CSV):
+    """
+    Генерирует рынки и загружает их через staging load_data.py
+    (COPY в stage_markets + merge_stage), минуя промежуточный файл.
+    """
+    profile = build_profile(source_csv)
+    cur = conn.cursor()
+    loader.ensure_categories(cur, conn, loader.read_categories(source_csv))
+    payment_bits = loader.load_payment_bits(cur)
+
+    cur.execute(loader.STAGE_TABLE_SQL)
+    batch = []
+    for row_no, row in enumerate(iter_market_rows(profile, count, seed), start=1):
+        staged = loader.stage_row(row_no, row, profile["category_columns"], payment_bits)
+        if staged is not None:
+            batch.append(staged)
+        if len(batch) >= BATCH_ROWS:
+            loader.copy_rows(cur, "stage_markets", loader.STAGE_COLUMNS, batch)
+            batch = []
+    if batch:
+        loader.copy_rows(cur, "stage_markets", loader.STAGE_COLUMNS, batch)
+
+    stats = loader.merge_stage(cur)
+    conn.commit()
+    cur.close()
+    return stats
+
+
+# ===========================================================
+# === Отзывы ===
+# ===========================================================
+
+def load_reviews_direct(conn, count, seed):
+    """
+    Добавляет count отзывов к существующим рынкам через COPY.
+    Популярность рынков неравномерная: небольшая часть рынков
+    собирает большую часть отзывов (как в реальной жизни).
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM markets ORDER BY id")
+    market_ids = [r[0] for r in cur.fetchall()]
+    if not market_ids:
+        print("В базе нет рынков — отзывы не добавлены.")
+        return 0
+
+    rng = random.Random(seed + 1)  # отдельный поток случайных чисел, чтобы не зависеть от рынков
+    ratings = [r for r, _ in RATING_WEIGHTS]
+    weights = [w for _, w in RATING_WEIGHTS]
+    # Порядок популярности рынков — тоже из seed
+    popularity = market_ids[:]
+    rng.shuffle(popularity)
+    base_time = datetime(2020, 1, 1)
+
+    columns = ("market_id", "user_name", "rating", "review_text", "created_at")
+    written = 0
+    while written < count:
+        size = min(BATCH_ROWS * 4, count - written)
+        batch = []
+        for _ in range(size):
+            # Квадрат случайного числа смещает выбор к началу списка — «популярным» рынкам
+            market_id = popularity[int(len(popularity) * rng.random() ** 2)]
+            batch.append((
+                market_id,
+                f"user{rng.randrange(1_000_000)}",
+                rng.choices(ratings, weights)[0],
+                rng.choice(REVIEW_TEXTS) or None,
+                base_time + timedelta(seconds=rng.randrange(5 * 365 * 24 * 3600)),
+            ))
+        loader.copy_rows(cur, "reviews", columns, batch)
+        conn.commit()
+        written += size
+        print(f"Отзывов добавлено: {written}/{count}")
+    cur.close()
+    return written
+
+
+# === Точка входа ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных фермерских рынков")
+    parser.add_argument("--seed", type=int, default=42, help="seed генератора (одинаковый seed — одинаковые данные)")
+    parser.add_argument("--source", default=SOURCE_CSV, help="реальный CSV — образец распределений")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p_csv = sub.add_parser("csv", help="записать CSV в формате Export.csv")
+    p_csv.add_argument("--rows", type=int, required=True, help="сколько рынков сгенерировать")
+    p_csv.add_argument("--out", required=True, help="куда записать CSV")
+
+    p_db = sub.add_parser("db", help="загрузить рынки (и отзывы) сразу в базу через COPY")
+    p_db.add_argument("--rows", type=int, required=True, help="сколько рынков сгенерировать")
+    p_db.add_argument("--reviews", type=int, default=0, help="сколько отзывов добавить")
+
+    p_rev = sub.add_parser("reviews", help="добавить отзывы к уже загруженным рынкам")
+    p_rev.add_argument("--count", type=int, required=True, help="сколько отзывов добавить")
+
+    args = parser.parse_args()
+
+    if args.mode == "csv":
+        write_csv(args.out, args.rows, args.seed, args.source)
+    else:
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            started = time.perf_counter()
+            if args.mode == "db":
+                stats = load_markets_direct(conn, args.rows, args.seed, args.source)
+                print(f"Новых локаций: {stats['locations']}, рынков: {stats['markets']}, "
+                      f"связей с категориями: {stats['market_categories']}.")
+                if args.reviews:
+                    load_reviews_direct(conn, args.reviews, args.seed)
+            else:
+                load_reviews_direct(conn, args.count, args.seed)
+            print(f"Готово за {time.perf_counter() - started:.1f} с.")
+        finally:
+            conn.close()
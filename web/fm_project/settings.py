@@ -58,6 +58,8 @@ INSTALLED_APPS = [
 # ----------------- MIDDLEWARE -----------------
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Замер SQL на каждый запрос (Server-Timing + лог "markets.sql"); стоит рано, чтобы видеть и запросы сессий/авторизации
+    'markets.middleware.SQLInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
 
     # ↓↓↓ Должен идти сразу после SessionMiddleware и до CommonMiddleware
@@ -71,6 +73,28 @@ MIDDLEWARE = [
 ]
 # ----------------------------------------------
 
+# === Замер SQL (markets.middleware.SQLInstrumentationMiddleware) ===
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "1") in ("1", "true", "True")
+SQL_BUDGET_QUERIES = int(os.getenv("SQL_BUDGET_QUERIES", "20"))   # больше запросов на страницу — предупреждение в лог
+SQL_BUDGET_MS = float(os.getenv("SQL_BUDGET_MS", "200"))          # ... или больше стольких миллисекунд в БД
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "3")) # одинаковый SQL столько раз и больше — подозрение на N+1
+
+# Логи: строка JSON на каждый HTTP-запрос в логгер "markets.sql" (уровень — SQL_LOG_LEVEL)
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "markets.sql": {
+            "handlers": ["console"],
+            "level": os.getenv("SQL_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
 ROOT_URLCONF = 'fm_project.urls'
 
 TEMPLATES = [
@@ -118,6 +142,10 @@ DATABASES = {
         "PASSWORD": DB_PASSWORD,  # пароль
         "HOST": DB_HOST,       # адрес сервера БД
         "PORT": DB_PORT,       # порт (по умолчанию 5432)
+        # Соединение живёт между запросами (секунды), а не открывается заново на каждый:
+        # так подготовленные запросы (markets/prepared.py) переиспользуются.
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": True,  # перед повторным использованием проверить, что соединение живо
     }
 }
 # ============================================================================
@@ -8,17 +8,115 @@
 # - Если fetch=False, просто выполним запрос (INSERT/UPDATE/DELETE) и вернём None.
 #
 # Это позволит переносить логику из Streamlit (ui_markets_streamlit.py) практически без изменений.
+#
+# iter_query(sql, params, itersize) — то же для больших выборок: строки отдаются по одной
+# через серверный курсор, без загрузки всего результата в память (аналог app.db.iter_query).
+#
+# row_factory — в каком виде отдавать строки (у обеих функций):
+#   "dict"       — словарь {колонка: значение} (по умолчанию, как раньше);
+#   "tuple"      — кортеж как есть из драйвера (самый дешёвый вариант);
+#   "namedtuple" — namedtuple, класс кешируется для каждого набора колонок;
+#   "row"        — лёгкий объект Row (__slots__): row["name"], row.name и row[0].
+# В шаблонах Django работают все варианты, кроме "tuple" ({{ row.name }}).
+# Замер стоимости на строку: tools/bench_rows.py.
 # ============================================================
 
-from typing import Iterable, List, Dict, Optional, Tuple
-from django.db import connection
+from collections import namedtuple
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Sequence, Tuple
+from django.db import connection, transaction
+
+# Размер порции по умолчанию для iter_query (строк за один запрос к серверу)
+DEFAULT_ITERSIZE = 2000
+
+ROW_FACTORIES = ("dict", "tuple", "namedtuple", "row")
 
-def execute_query(sql: str, params: Iterable = (), fetch: bool = False) -> Optional[List[Dict]]:
+
+class Row:
+    """
+    Лёгкая строка результата: хранит кортеж значений и общий на весь результат
+    словарь {колонка: позиция}. Создаётся почти так же дёшево, как кортеж,
+    но позволяет обращаться по имени: row["name"] или row.name.
+    """
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index: Dict[str, int], values: Sequence):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        # Строка — имя колонки, число/срез — позиция
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __getattr__(self, name):
+        # Вызывается только для имён, которых нет в __slots__ (или слот ещё не заполнен:
+        # copy/pickle создают объект без __init__) — служебные имена сразу не найдены,
+        # иначе self._index ниже снова попал бы сюда и ушёл в бесконечную рекурсию
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, key, default=None):
+        pos = self._index.get(key)
+        return default if pos is None else self._values[pos]
+
+    def keys(self):
+        return self._index.keys()
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._index == other._index and tuple(self._values) == tuple(other._values)
+        return NotImplemented
+
+    def __repr__(self):
+        return "Row(" + ", ".join(f"{k}={self._values[i]!r}" for k, i in self._index.items()) + ")"
+
+
+@lru_cache(maxsize=256)
+def _namedtuple_class(columns: Tuple[str, ...]):
+    # rename=True: колонки вроде "?column?" или повторяющиеся имена заменятся на _0, _1, ...
+    return namedtuple("Row", columns, rename=True)
+
+
+def _row_converter(columns: List[str], row_factory: str) -> Callable[[List[tuple]], list]:
+    """
+    Возвращает функцию, которая превращает порцию строк-кортежей в строки нужного вида.
+    Все «накладные» вещи (имена колонок, класс namedtuple, индекс для Row)
+    готовятся один раз на весь результат, а не на каждую строку.
+    """
+    if row_factory == "tuple":
+        return lambda rows: rows  # fetchall()/fetchmany() и так отдают список кортежей
+    if row_factory == "dict":
+        # Построение словаря на каждую строку — самый дорогой вариант; если строк много,
+        # дешевле "tuple" или "row" (см. tools/bench_rows.py)
+        return lambda rows, columns=tuple(columns): [dict(zip(columns, r)) for r in rows]
+    if row_factory == "namedtuple":
+        make = _namedtuple_class(tuple(columns))._make
+        return lambda rows: list(map(make, rows))
+    if row_factory == "row":
+        index = {col: i for i, col in enumerate(columns)}
+        return lambda rows: [Row(index, r) for r in rows]
+    raise ValueError(f"неизвестный row_factory: {row_factory!r} (допустимо: {', '.join(ROW_FACTORIES)})")
+
+
+def execute_query(sql: str, params: Iterable = (), fetch: bool = False, row_factory: str = "dict") -> Optional[List]:
     """
     Унифицированный вызов SQL:
-    - sql     — строка SQL с плейсхолдерами %s
-    - params  — кортеж/список параметров
-    - fetch   — если True, вернуть данные как список словарей (имя_колонки -> значение)
+    - sql         — строка SQL с плейсхолдерами %s
+    - params      — кортеж/список параметров
+    - fetch       — если True, вернуть данные (по умолчанию — список словарей имя_колонки -> значение)
+    - row_factory — вид строк: "dict", "tuple", "namedtuple" или "row" (см. шапку модуля)
     """
     # Открываем курсор через django.db.connection — соединение управляет Django.
     with connection.cursor() as cur:
@@ -28,14 +126,32 @@ def execute_query(sql: str, params: Iterable = (), fetch: bool = False) -> Optio
             # Если нам не нужны результаты — просто выходим, коммит сделает Django автоматически
             return None
 
-        # Если нужны строки — получаем имена колонок и строки, формируем список словарей
-        columns = [col[0] for col in cur.description]
-        rows = cur.fetchall()
-        result: List[Dict] = []
-        for row in rows:
-            # Склеиваем имена колонок и значения в словарь
-            d = {}
-            for idx, col in enumerate(columns):
-                d[col] = row[idx]
-            result.append(d)
-        return result
+        # Если нужны строки — получаем имена колонок и строки и приводим к нужному виду
+        columns = [col[0] for col in cur.description] if cur.description else []
+        return _row_converter(columns, row_factory)(cur.fetchall())
+
+
+def iter_query(sql: str, params: Iterable = (), itersize: int = DEFAULT_ITERSIZE,
+               row_factory: str = "dict") -> Iterator:
+    """
+    Ленивый вариант execute_query(fetch=True): отдаёт строки по одной.
+    - sql         — строка SELECT с плейсхолдерами %s
+    - params      — кортеж/список параметров
+    - itersize    — сколько строк забирать с сервера за раз
+    - row_factory — вид строк, как в execute_query
+
+    connection.chunked_cursor() в PostgreSQL — это именованный (серверный) курсор:
+    результат остаётся на сервере, клиент читает его порциями через fetchmany().
+    Внутри transaction.atomic() курсор обычный (без WITH HOLD), поэтому сервер тоже
+    не материализует весь результат. Пока обход не закончен, транзакция открыта.
+    """
+    with transaction.atomic():
+        with connection.chunked_cursor() as cur:
+            cur.execute(sql, tuple(params))
+            # У серверного курсора description заполняется только после первой порции
+            rows = cur.fetchmany(itersize)
+            columns = [col[0] for col in cur.description] if cur.description else []
+            convert = _row_converter(columns, row_factory)
+            while rows:
+                yield from convert(rows)
+                rows = cur.fetchmany(itersize)
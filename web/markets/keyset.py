@@ -0,0 +1,223 @@
+# web/markets/keyset.py
+
+# ============================================================
+# Keyset-пагинация (seek) для страниц Django.
+# Перенос из app/keyset.py (plan_page, seek_condition, page_query, finish_page),
+# плюс «курсоры» для ссылок «Назад»/«Вперёд»:
+#   ?page=6&cursor=<токен>
+# Токен — подписанная (django.core.signing) и непрозрачная строка с номером
+# страницы и ключом сортировки крайней строки текущей страницы. Подделать его
+# нельзя, а если он не подходит (другая сортировка/фильтры/размер страницы,
+# истёк, испорчен) — страница просто строится по номеру.
+#
+# Использование во view:
+#     keys = [("city", "ASC"), ("id", "ASC")]
+#     rows, pagination = keyset_paginate(request, total, keys, source_sql, params, run, scope="sort:city")
+# где run(sql, params, kind) выполняет запрос страницы (kind — вид запроса,
+# удобно для имён подготовленных запросов).
+# ============================================================
+
+import hashlib
+import math
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from django.core import signing
+
+PAGE_SQL = """
+    SELECT * FROM ({source}) AS page_src
+    {where}
+    ORDER BY {order}
+    LIMIT %s OFFSET %s
+"""
+
+# Соль подписи: токен этих страниц не подойдёт ни к чему другому
+CURSOR_SALT = "markets.keyset"
+# Сколько секунд действителен токен (старые ссылки просто откроют страницу по номеру)
+CURSOR_MAX_AGE = 24 * 3600
+
+Keys = Sequence[Tuple[str, str]]
+
+
+def _flip(direction: str) -> str:
+    return "DESC" if direction == "ASC" else "ASC"
+
+
+def order_sql(keys: Keys, reverse: bool = False) -> str:
+    return ", ".join(f"{col} {_flip(d) if reverse else d}" for col, d in keys)
+
+
+def seek_condition(keys: Keys, values: Sequence, forward: bool = True) -> Tuple[str, tuple]:
+    # Одинаковые направления — сравнение кортежей (идёт по индексу), разные — развёрнутая форма
+    directions = {d for _, d in keys}
+    if len(directions) == 1:
+        ascending = directions.pop() == "ASC"
+        op = ">" if ascending == forward else "<"
+        cols = ", ".join(col for col, _ in keys)
+        marks = ", ".join(["%s"] * len(keys))
+        return f"({cols}) {op} ({marks})", tuple(values)
+
+    parts, params = [], []
+    for i, (col, direction) in enumerate(keys):
+        op = ">" if (direction == "ASC") == forward else "<"
+        equal = [f"{c} = %s" for c, _ in keys[:i]]
+        parts.append("(" + " AND ".join(equal + [f"{col} {op} %s"]) + ")")
+        params.extend(list(values[:i]) + [values[i]])
+    # Лишнее, но полезное условие на первую колонку (a <= x): по нему индекс
+    # начинает чтение сразу с ключа, а не с начала списка
+    first_col, first_dir = keys[0]
+    first_op = ">=" if (first_dir == "ASC") == forward else "<="
+    return f"({first_col} {first_op} %s AND (" + " OR ".join(parts) + "))", (values[0],) + tuple(params)
+
+
+def row_key(row: dict, keys: Keys) -> tuple:
+    return tuple(row[col] for col, _ in keys)
+
+
+def plan_page(keys: Keys, total: int, per_page: int, page: int, anchor: Optional[dict] = None,
+              exact: bool = True, fresh: bool = True) -> dict:
+    # Первая — LIMIT; соседняя — по ключу (anchor); последняя — обратный порядок;
+    # прыжок — OFFSET от ближнего конца (exact=False, total — оценка: OFFSET от начала;
+    # fresh=False, total из кеша и мог устареть: тоже OFFSET от начала)
+    pages = max(1, math.ceil(max(0, total) / max(1, per_page)))
+    if exact:
+        page = max(1, min(page, pages))
+    else:
+        # total — оценка: настоящих страниц может быть больше, номер не обрезаем
+        page = max(1, page)
+        pages = max(pages, page)
+    plan = {
+        "page": page, "pages": pages, "offset": (page - 1) * per_page,
+        "where": "", "params": (), "order": order_sql(keys),
+        "limit": per_page, "skip": 0, "reverse": False, "exact": exact,
+    }
+
+    if anchor and anchor.get("page") == page and ("after" in anchor or "before" in anchor):
+        forward = "after" in anchor
+        where, params = seek_condition(keys, anchor["after" if forward else "before"], forward)
+        plan.update(kind="after" if forward else "before", where="WHERE " + where, params=params)
+        if not forward:
+            plan.update(order=order_sql(keys, reverse=True), reverse=True)
+    elif page == 1:
+        plan["kind"] = "first"
+    elif exact and fresh and page == pages:
+        plan.update(kind="last", order=order_sql(keys, reverse=True), reverse=True,
+                    limit=total - (pages - 1) * per_page)
+    elif exact and fresh and page > pages / 2:
+        plan.update(kind="offset_rev", order=order_sql(keys, reverse=True), reverse=True,
+                    skip=total - page * per_page)
+    else:
+        plan.update(kind="offset", skip=plan["offset"])
+    return plan
+
+
+def page_query(source: str, plan: dict, extra_params: Sequence = ()) -> Tuple[str, tuple]:
+    sql = PAGE_SQL.format(source=source, where=plan["where"], order=plan["order"])
+    return sql, tuple(extra_params) + plan["params"] + (plan["limit"], plan["skip"])
+
+
+def finish_page(plan: dict, rows: List[dict], keys: Keys) -> Tuple[List[dict], Dict[str, Optional[dict]]]:
+    rows = list(rows)
+    if plan["reverse"]:
+        rows.reverse()
+    anchors = {"next": None, "prev": None}
+    # При оценке total конец списка узнаём по неполной странице
+    more = plan["page"] < plan["pages"] if plan["exact"] else len(rows) == plan["limit"]
+    if rows and more:
+        anchors["next"] = {"page": plan["page"] + 1, "after": row_key(rows[-1], keys)}
+    if rows and plan["page"] > 1:
+        anchors["prev"] = {"page": plan["page"] - 1, "before": row_key(rows[0], keys)}
+    return rows, anchors
+
+
+# ---------------------------
+# Курсоры (токены для ссылок)
+# ---------------------------
+
+def _scope_hash(scope: str, per_page: int) -> str:
+    # Короткий отпечаток «какой список»: сортировка, фильтры и размер страницы
+    return hashlib.sha1(f"{scope}|{per_page}".encode("utf-8")).hexdigest()[:12]
+
+
+def _encode_value(value):
+    # Decimal (AVG) в JSON не помещается — передаём строкой, PostgreSQL сам приведёт её к numeric
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def make_cursor(anchor: Optional[dict], scope: str, per_page: int) -> str:
+    if not anchor:
+        return ""
+    direction = "after" if "after" in anchor else "before"
+    payload = {
+        "p": anchor["page"],
+        "d": direction[0],  # "a" / "b"
+        "k": [_encode_value(v) for v in anchor[direction]],
+        "s": _scope_hash(scope, per_page),
+    }
+    return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+
+def read_cursor(token: str, scope: str, per_page: int) -> Optional[dict]:
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=CURSOR_SALT, max_age=CURSOR_MAX_AGE)
+    except signing.BadSignature:  # SignatureExpired — его подкласс
+        return None
+    if not isinstance(payload, dict) or payload.get("s") != _scope_hash(scope, per_page):
+        return None
+    direction = "after" if payload.get("d") == "a" else "before"
+    return {"page": payload.get("p"), direction: tuple(payload.get("k") or ())}
+
+
+def _get_int(request, name: str, default: int, min_v: int, max_v: int) -> int:
+    try:
+        val = int(request.GET.get(name))
+    except (TypeError, ValueError):
+        val = default
+    return max(min_v, min(val, max_v))
+
+
+def keyset_paginate(request, total: int, keys: Keys, source: str, params: Sequence,
+                    run: Callable[[str, tuple, str], List[dict]], scope: str = "",
+                    default_per: int = 10, min_per: int = 5, max_per: int = 100):
+    """
+    Страница списка с keyset-пагинацией.
+    - total  — сколько всего строк (totals.count_total по тем же фильтрам; оценка — тоже можно)
+    - keys   — ключ сортировки [(колонка, "ASC"|"DESC"), ...], последняя колонка уникальна
+    - source — запрос-источник без ORDER BY/LIMIT (колонки ключа — в его SELECT)
+    - params — параметры source
+    - run    — run(sql, params, kind) -> строки-словари
+    - scope  — строка, описывающая сортировку и фильтры (чтобы курсор не «перепрыгнул» в другой список)
+    Возвращает (rows, pagination), где pagination совместим с build_pagination_context
+    (page, pages, per, per_options, has_prev, has_next, prev_page, next_page, offset)
+    и дополнительно содержит prev_cursor / next_cursor для ссылок и approximate (total — оценка).
+    """
+    per = _get_int(request, "per", default_per, min_per, max_per)
+    page = _get_int(request, "page", 1, 1, 10**9)
+    anchor = read_cursor(request.GET.get("cursor", ""), scope, per)
+    approximate = getattr(total, "approximate", False)  # total из totals.count_total может быть оценкой
+
+    plan = plan_page(keys, total, per, page, anchor, exact=not approximate,
+                     fresh=not getattr(total, "cached", False))
+    rows = []
+    if total > 0:
+        sql, sql_params = page_query(source, plan, params)
+        rows = run(sql, sql_params, plan["kind"]) or []
+    rows, anchors = finish_page(plan, rows, keys)
+
+    pagination = {
+        "page": plan["page"],
+        "pages": plan["pages"],
+        "per": per,
+        "per_options": [5, 10, 15, 20, 50, 100],
+        "has_prev": plan["page"] > 1,
+        "has_next": anchors["next"] is not None if approximate else plan["page"] < plan["pages"],
+        "prev_page": max(1, plan["page"] - 1),
+        "next_page": plan["page"] + 1 if approximate else min(plan["pages"], plan["page"] + 1),
+        "offset": plan["offset"],
+        "approximate": approximate,
+        "prev_cursor": make_cursor(anchors["prev"], scope, per),
+        "next_cursor": make_cursor(anchors["next"], scope, per),
+    }
+    return rows, pagination
@@ -0,0 +1,366 @@
+# web/markets/management/commands/advise_indexes.py
+# ---------------------------------------------
+# «Советчик» по индексам: прогоняет каталог запросов страниц проекта через
+#     EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+# и ищет полные проходы (Seq Scan) по большим таблицам, где индекс помог бы:
+# условие отбрасывает почти все прочитанные строки или таблица читается
+# заново на каждой строке соседней (Nested Loop). Для каждого такого места
+# предлагается CREATE INDEX. Отдельно проверяется схема: внешние ключи
+# (REFERENCES), у которых нет индекса.
+#
+# На ~1.7 тыс. рынков из Export.csv любой запрос быстрый, а таблицы меньше
+# --min-rows строк команда не проверяет. Поэтому сначала нагенерируйте данные:
+#     python tools/generate_data.py db --rows 100000 --reviews 1000000
+# и затем:
+#     python manage.py advise_indexes
+#     python manage.py advise_indexes --min-rows 50000 --query market_reviews --plans
+#
+# Команда ничего не меняет в базе: EXPLAIN ANALYZE выполняет только SELECT-запросы,
+# а предложенные индексы нужно добавить в setup/init.sql самим.
+
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from markets import views
+from markets.db import execute_query
+from markets.keyset import page_query, plan_page
+from markets.utils import build_flags_mask, flags_condition
+
+# Каталог запросов страниц. Тексты не копируются, а берутся из views.py
+# (константы запросов и ключи сортировки), страницы списков строятся так же,
+# как их строит keyset_paginate (keyset.plan_page + keyset.page_query), —
+# поэтому каталог не расходится с тем, что на самом деле выполняют страницы.
+# needs — имена значений из SAMPLES_SQL (подставляются реальные id/город из базы),
+# build(samples) -> (sql, params).
+
+
+def _first_page(source, keys, params=(), per_page=10):
+    # Первая страница списка — как её запрашивает keyset_paginate
+    plan = plan_page(keys, per_page, per_page, 1)
+    return page_query(source, plan, params)
+
+
+def _category_filter(samples):
+    # Условие страницы «Рынки по категориям» для одной категории (режим «все»)
+    return flags_condition(build_flags_mask([samples["category_bit"]]), match_all=True)
+
+
+QUERY_CATALOG = [
+    {
+        "name": "market_details",
+        "where": "детали рынка (views.market_details)",
+        "needs": ("market_id",),
+        "build": lambda s: (views.MARKET_DETAILS_SQL, (s["market_id"],)),
+    },
+    {
+        "name": "market_rating",
+        "where": "рейтинг на странице деталей (views.market_details)",
+        "needs": ("market_id",),
+        "build": lambda s: (views.MARKET_RATING_SQL, (s["market_id"],)),
+    },
+    {
+        "name": "market_categories",
+        "where": "категории рынка (views.market_details)",
+        "needs": ("market_id",),
+        "build": lambda s: (views.MARKET_CATEGORIES_SQL, (s["market_id"],)),
+    },
+    {
+        "name": "market_reviews",
+        "where": "отзывы рынка (views.market_details)",
+        "needs": ("market_id",),
+        "build": lambda s: (views.MARKET_REVIEWS_SQL, (s["market_id"],)),
+    },
+    {
+        "name": "market_hours",
+        "where": "расписание рынка (views.market_details)",
+        "needs": ("market_id",),
+        "build": lambda s: (views.MARKET_HOURS_SQL, (s["market_id"],)),
+    },
+    {
+        "name": "reviews_page_reviews",
+        "where": "отзывы выбранного рынка (views.reviews_page)",
+        "needs": ("market_id",),
+        "build": lambda s: (views.REVIEWS_PAGE_REVIEWS_SQL, (s["market_id"],)),
+    },
+    {
+        # Не страница, а действие базы: ON DELETE SET NULL при удалении auth_user
+        "name": "user_reviews",
+        "where": "отзывы пользователя (ON DELETE SET NULL при удалении auth_user)",
+        "needs": ("user_id",),
+        "build": lambda s: ("SELECT id FROM reviews WHERE user_id = %s", (s["user_id"],)),
+    },
+    {
+        "name": "markets_list_page",
+        "where": "список рынков, первая страница (views.markets_list)",
+        "needs": (),
+        "build": lambda s: _first_page(views.MARKETS_LIST_SQL, views.MARKETS_LIST_KEYS, per_page=15),
+    },
+    {
+        "name": "markets_in_zip",
+        "where": "поиск по индексу, первая страница (views.markets_search)",
+        "needs": ("zip",),
+        "build": lambda s: _first_page(views.MARKETS_SEARCH_SQL, views.MARKETS_SEARCH_KEYS,
+                                       views.search_params("", "", s["zip"])),
+    },
+    {
+        "name": "markets_in_city",
+        "where": "поиск по городу, число строк (views.markets_search, фильтр ILIKE)",
+        "needs": ("city",),
+        "build": lambda s: (views.MARKETS_SEARCH_COUNT_SQL, views.search_params(s["city"][:4], "", "")),
+    },
+    {
+        "name": "sort_by_rating",
+        "where": "сортировка по рейтингу, первая страница (views.sort_markets)",
+        "needs": (),
+        "build": lambda s: _first_page(views.SORT_MARKETS_SQL, views.sort_keys("rating", "DESC")),
+    },
+    {
+        "name": "sort_by_city",
+        "where": "сортировка по городу, первая страница (views.sort_markets)",
+        "needs": (),
+        "build": lambda s: _first_page(views.SORT_MARKETS_SQL, views.sort_keys("city", "ASC")),
+    },
+    {
+        "name": "sort_count",
+        "where": "число строк сортировки (views.sort_markets)",
+        "needs": (),
+        "build": lambda s: (views.SORT_COUNT_SQL, ()),
+    },
+    {
+        "name": "category_markets",
+        "where": "рынки категории, первая страница (views.markets_by_category)",
+        "needs": ("category_bit",),
+        "build": lambda s: _first_page(views.BY_CATEGORY_SQL.format(where=_category_filter(s)[0]),
+                                       views.BY_CATEGORY_KEYS, _category_filter(s)[1]),
+    },
+    {
+        "name": "category_count",
+        "where": "число рынков категории (views.markets_by_category)",
+        "needs": ("category_bit",),
+        "build": lambda s: (views.BY_CATEGORY_COUNT_SQL.format(where=_category_filter(s)[0]),
+                            _category_filter(s)[1]),
+    },
+    {
+        "name": "review_by_id",
+        "where": "проверка автора перед удалением отзыва (views.reviews_page, views.delete_review)",
+        "needs": ("review_id",),
+        "build": lambda s: (views.REVIEW_AUTHOR_SQL, (s["review_id"],)),
+    },
+]
+
+# Значения для параметров каталога: самый «отзывчивый» рынок, самая редкая
+# категория (её бит в flags_mask), реальные город и индекс — чтобы план был
+# как у настоящей страницы
+SAMPLES_SQL = """
+    SELECT
+        (SELECT market_id FROM market_rating_summary
+         ORDER BY review_count DESC, market_id LIMIT 1)                          AS market_id,
+        (SELECT c.bit_no FROM categories c
+         JOIN market_categories mc ON mc.category_id = c.id
+         WHERE c.bit_no IS NOT NULL
+         GROUP BY c.id ORDER BY COUNT(*), c.id LIMIT 1)                          AS category_bit,
+        (SELECT MAX(id) FROM reviews)                                            AS review_id,
+        (SELECT MIN(id) FROM auth_user)                                          AS user_id,
+        (SELECT city FROM locations ORDER BY id LIMIT 1)                         AS city,
+        (SELECT zip FROM locations WHERE zip IS NOT NULL ORDER BY id LIMIT 1)    AS zip
+"""
+
+# Оценка числа строк в таблицах (pg_class.reltuples — без COUNT(*))
+TABLE_SIZES_SQL = """
+    SELECT c.relname AS table_name, GREATEST(c.reltuples, 0)::BIGINT AS n
+    FROM pg_class c
+    JOIN pg_namespace ns ON ns.oid = c.relnamespace
+    WHERE ns.nspname = 'public' AND c.relkind = 'r'
+"""
+
+# Колонки всех индексов: индекс помогает условию, если эта колонка у него первая
+INDEX_COLUMNS_SQL = """
+    SELECT t.relname AS table_name, i.relname AS index_name,
+           ARRAY(
+               SELECT a.attname
+               FROM unnest(ix.indkey) WITH ORDINALITY AS k(attnum, pos)
+               JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+               ORDER BY k.pos
+           ) AS columns
+    FROM pg_index ix
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_namespace ns ON ns.oid = t.relnamespace
+    WHERE ns.nspname = 'public'
+"""
+
+# Внешние ключи (из одной колонки) нашей схемы
+FOREIGN_KEYS_SQL = """
+    SELECT t.relname AS table_name, a.attname AS column_name, r.relname AS ref_table
+    FROM pg_constraint con
+    JOIN pg_class t ON t.oid = con.conrelid
+    JOIN pg_class r ON r.oid = con.confrelid
+    JOIN pg_namespace ns ON ns.oid = t.relnamespace
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = con.conkey[1]
+    WHERE con.contype = 'f' AND ns.nspname = 'public' AND array_length(con.conkey, 1) = 1
+    ORDER BY t.relname, a.attname
+"""
+
+# Слово перед оператором сравнения в условии плана: "(market_id = 42)", "(r.user_id = $1)"
+_COMPARED_RE = re.compile(r"(?:\w+\.)?(\w+)\)?(?:::[\w ]+)?\s*(=|<>|<=|>=|<|>|~~\*?)\s")
+
+
+def _walk(node, parent=None):
+    # Все узлы плана вместе с родителем (условие соединения — у родителя)
+    yield node, parent
+    for child in node.get("Plans", []):
+        yield from _walk(child, node)
+
+
+def _compared_columns(condition, columns):
+    """
+    Колонки таблицы, которые сравниваются в условии: сначала «=», затем остальные.
+    Второе значение — есть ли сравнение через LIKE/ILIKE (обычный индекс ему не поможет).
+    """
+    equal, other, like = [], [], False
+    for name, op in _COMPARED_RE.findall(condition or ""):
+        if name not in columns:
+            continue
+        if op.startswith("~~"):
+            like = True
+        elif op == "=":
+            equal.append(name)
+        else:
+            other.append(name)
+    ordered = []
+    for name in equal + other:
+        if name not in ordered:
+            ordered.append(name)
+    return ordered, like
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN ANALYZE запросов страниц: ищет полные проходы по большим таблицам и предлагает индексы"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-rows", type=int, default=10000,
+                            help="проверять Seq Scan только по таблицам от стольких строк (по умолчанию 10000)")
+        parser.add_argument("--query", action="append", default=[],
+                            help="проверить только этот запрос каталога (можно несколько раз)")
+        parser.add_argument("--plans", action="store_true",
+                            help="печатать план (EXPLAIN) каждого запроса")
+
+    def handle(self, *args, **options):
+        min_rows = options["min_rows"]
+        catalog = QUERY_CATALOG
+        if options["query"]:
+            known = {q["name"] for q in QUERY_CATALOG}
+            unknown = [name for name in options["query"] if name not in known]
+            if unknown:
+                raise CommandError(f"Нет в каталоге: {', '.join(unknown)}. Есть: {', '.join(sorted(known))}")
+            catalog = [q for q in QUERY_CATALOG if q["name"] in options["query"]]
+
+        sizes = {r["table_name"]: r["n"] for r in execute_query(TABLE_SIZES_SQL, fetch=True)}
+        columns = {}
+        for r in execute_query(
+            "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = 'public'",
+            fetch=True,
+        ):
+            columns.setdefault(r["table_name"], set()).add(r["column_name"])
+        indexes = {}
+        for r in execute_query(INDEX_COLUMNS_SQL, fetch=True):
+            indexes.setdefault(r["table_name"], []).append((r["index_name"], list(r["columns"])))
+
+        if sizes.get("markets", 0) < min_rows and sizes.get("reviews", 0) < min_rows:
+            self.stdout.write(self.style.WARNING(
+                f"В markets и reviews меньше {min_rows} строк — на таких данных полные проходы дешёвые "
+                "и не покажутся. Сгенерируйте данные: "
+                "python tools/generate_data.py db --rows 100000 --reviews 1000000"
+            ))
+
+        samples = execute_query(SAMPLES_SQL, fetch=True)[0]
+
+        proposals = {}  # (таблица, колонки) -> причины
+        notes = []
+
+        def leading_index(table, column):
+            return next((name for name, cols in indexes.get(table, []) if cols and cols[0] == column), None)
+
+        # 1) Каталог запросов
+        for query in catalog:
+            if any(samples.get(name) is None for name in query["needs"]):
+                self.stdout.write(f"- {query['name']}: пропущен (в базе нет данных для параметров)")
+                continue
+            sql, params = query["build"](samples)
+            plan = execute_query("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params, fetch=True)
+            plan = plan[0]["QUERY PLAN"]
+            if isinstance(plan, str):  # драйвер мог не разобрать JSON сам
+                plan = json.loads(plan)
+            root = plan[0]["Plan"]
+            hit = root.get("Shared Hit Blocks", 0)
+            read = root.get("Shared Read Blocks", 0)
+            self.stdout.write(
+                f"- {query['name']}: {plan[0]['Execution Time']:.2f} мс, "
+                f"буферов {hit} из кеша / {read} с диска — {query['where']}"
+            )
+            if options["plans"]:
+                text = execute_query("EXPLAIN " + sql, params, fetch=True, row_factory="tuple")
+                for (line,) in text:
+                    self.stdout.write(f"      {line}")
+
+            for node, parent in _walk(root):
+                if node.get("Node Type") != "Seq Scan":
+                    continue
+                table = node.get("Relation Name")
+                if sizes.get(table, 0) < min_rows:
+                    continue
+                # У параллельного прохода Actual Loops — число процессов, а не повторы
+                loops = 1 if node.get("Parallel Aware") else (node.get("Actual Loops", 1) or 1)
+                returned = node.get("Actual Rows", 0)
+                removed = node.get("Rows Removed by Filter", 0)
+                # Индекс нужен, если проход выбрасывает почти всё (>90%) или повторяется в цикле
+                if loops <= 1 and removed <= 9 * returned:
+                    continue
+
+                condition = node.get("Filter", "")
+                if loops > 1 and parent is not None:
+                    condition += " " + (parent.get("Join Filter") or "")
+                wanted, like = _compared_columns(condition, columns.get(table, set()))
+                where = f"{query['name']}: Seq Scan по {table} ({sizes[table]} строк"
+                where += f", проходов: {loops})" if loops > 1 else f", отброшено {removed} из {removed + returned})"
+                if not wanted and like:
+                    notes.append(f"{where} — LIKE/ILIKE с % в начале: B-tree индекс тут не помогает "
+                                 f"(нужен триграммный индекс pg_trgm)")
+                    continue
+                if not wanted:
+                    notes.append(f"{where} — условие по выражению "
+                                 f"({condition.strip() or 'нет'}), обычный индекс по колонке не поможет")
+                    continue
+                existing = leading_index(table, wanted[0])
+                if existing:
+                    reason = "условие LIKE/ILIKE с % в начале" if like else "планировщик выбрал полный проход"
+                    notes.append(f"{where} — индекс {existing} по {wanted[0]} уже есть, но не используется: {reason}")
+                    continue
+                key = (table, tuple(wanted[:2]))
+                proposals.setdefault(key, []).append(where)
+
+        # 2) Схема: внешние ключи без индекса (JOIN по ним и ON DELETE CASCADE читают всю таблицу)
+        for fk in execute_query(FOREIGN_KEYS_SQL, fetch=True):
+            table, column = fk["table_name"], fk["column_name"]
+            if leading_index(table, column) is None:
+                key = (table, (column,))
+                proposals.setdefault(key, []).append(
+                    f"внешний ключ {table}.{column} -> {fk['ref_table']} без индекса"
+                )
+
+        # 3) Итог
+        self.stdout.write("")
+        for note in notes:
+            self.stdout.write(self.style.WARNING(f"! {note}"))
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS("Новых индексов не требуется."))
+            return
+        self.stdout.write(self.style.WARNING(f"Предлагаемые индексы ({len(proposals)}):"))
+        for (table, cols), reasons in proposals.items():
+            for reason in reasons:
+                self.stdout.write(f"  -- {reason}")
+            self.stdout.write(
+                f"  CREATE INDEX IF NOT EXISTS idx_{table}_{'_'.join(cols)} ON {table}({', '.join(cols)});"
+            )
@@ -0,0 +1,21 @@
+# web/markets/management/commands/rebuild_rating_summary.py
+# ---------------------------------------------
+# Пересчёт сводки рейтингов market_rating_summary по таблице reviews.
+# Обычно сводку ведут триггеры на reviews, но если данные правили в обход
+# (отключённые триггеры, восстановление из копии и т.п.), запускаем:
+#     python manage.py rebuild_rating_summary
+# Команда выводит, сколько строк сводки пришлось исправить.
+
+from django.core.management.base import BaseCommand
+
+from markets.db import execute_query
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает market_rating_summary (средний рейтинг и число отзывов) по таблице reviews"
+
+    def handle(self, *args, **options):
+        # Вся работа — в SQL-функции из setup/init.sql (она же блокирует reviews на время пересчёта)
+        fixed = execute_query("SELECT rebuild_market_rating_summary() AS fixed", fetch=True)[0]["fixed"]
+        total = execute_query("SELECT COUNT(*) FROM market_rating_summary", fetch=True)[0]["count"]
+        self.stdout.write(self.style.SUCCESS(f"Сводка рейтингов: {total} рынков, исправлено строк: {fixed}"))
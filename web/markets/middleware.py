@@ -4,8 +4,14 @@
 # всех НЕавторизованных пользователей на страницу логина.
 # Исключения: страницы логина/логаута, регистрации, админка, статика/медиа.
 
+import json
+import logging
 import re
+import time
+from contextlib import ExitStack
+
 from django.conf import settings
+from django.db import connections
 from django.shortcuts import redirect
 from django.urls import reverse
 
@@ -66,3 +72,121 @@ class LoginRequiredMiddleware:
         # чтобы после входа вернуться обратно на исходную страницу.
         login_url = settings.LOGIN_URL  # например, "/login/"
         return redirect(f"{login_url}?next={path}")
+
+
+# -------------------------
+# Замер SQL-запросов каждого HTTP-запроса.
+# -------------------------
+
+sql_logger = logging.getLogger("markets.sql")
+
+# Нормализация SQL в «шаблон»: значения заменяем на ?, пробелы схлопываем.
+# Одинаковые шаблоны в одном HTTP-запросе — признак N+1 (запрос в цикле).
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_PARAM_RE = re.compile(r"%s|\$\d+")
+_SQL_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_SPACES_RE = re.compile(r"\s+")
+
+
+def sql_pattern(sql: str) -> str:
+    """
+    "SELECT * FROM reviews WHERE market_id = 5" -> "SELECT * FROM reviews WHERE market_id = ?"
+    """
+    text = _SQL_STRING_RE.sub("?", sql)
+    text = _SQL_PARAM_RE.sub("?", text)
+    text = _SQL_NUMBER_RE.sub("?", text)
+    text = _SQL_IN_LIST_RE.sub("(?)", text)
+    return _SQL_SPACES_RE.sub(" ", text).strip()
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Считает SQL-запросы, которые сделал один HTTP-запрос:
+    1) через connection.execute_wrapper оборачивает каждый execute курсора
+       (это видно для execute_query, prepared.py, ORM — всего, что идёт через Django);
+    2) собирает число запросов, суммарное время в БД, самый медленный запрос
+       и повторяющиеся шаблоны (N+1: один и тот же SQL в цикле);
+    3) добавляет заголовок Server-Timing (его показывает вкладка Network в браузере)
+       и пишет одну строку JSON в лог "markets.sql";
+    4) если превышен бюджет (SQL_BUDGET_QUERIES запросов или SQL_BUDGET_MS миллисекунд),
+       пишет предупреждение с полным списком запросов.
+
+    Настройки (settings.py): SQL_INSTRUMENTATION, SQL_BUDGET_QUERIES, SQL_BUDGET_MS,
+    SQL_REPEAT_THRESHOLD (со скольких повторов шаблон считается подозрительным).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "SQL_INSTRUMENTATION", True)
+        self.budget_queries = getattr(settings, "SQL_BUDGET_QUERIES", 20)
+        self.budget_ms = getattr(settings, "SQL_BUDGET_MS", 200)
+        self.repeat_threshold = getattr(settings, "SQL_REPEAT_THRESHOLD", 3)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        queries = []  # [(sql, миллисекунды, many)]
+
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, (time.perf_counter() - started) * 1000, many))
+
+        # Оборачиваем все настроенные базы (в проекте одна — default)
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(record))
+            response = self.get_response(request)
+
+        self._report(request, response, queries)
+        return response
+
+    def _report(self, request, response, queries):
+        total_ms = sum(ms for _, ms, _ in queries)
+        slowest_sql, slowest_ms = "", 0.0
+        for sql, ms, _ in queries:
+            if ms > slowest_ms:
+                slowest_sql, slowest_ms = sql, ms
+
+        patterns = {}
+        for sql, _, _ in queries:
+            pattern = sql_pattern(sql)
+            patterns[pattern] = patterns.get(pattern, 0) + 1
+        repeated = sorted(
+            ({"sql": p[:200], "count": n} for p, n in patterns.items() if n >= self.repeat_threshold),
+            key=lambda item: -item["count"],
+        )
+
+        # Server-Timing: только числа и ASCII-описания (SQL в заголовок не кладём)
+        timings = [
+            f'db;dur={total_ms:.1f};desc="{len(queries)} queries"',
+            f"db-slowest;dur={slowest_ms:.1f}",
+        ]
+        if repeated:
+            timings.append(f'db-repeated;desc="{len(repeated)} patterns, max {repeated[0]["count"]}x"')
+        response["Server-Timing"] = ", ".join(timings)
+
+        over_budget = len(queries) > self.budget_queries or total_ms > self.budget_ms
+        line = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": len(queries),
+            "db_ms": round(total_ms, 2),
+            "slowest_ms": round(slowest_ms, 2),
+            "slowest_sql": sql_pattern(slowest_sql)[:200],
+            "repeated": repeated,
+            "over_budget": over_budget,
+        }
+        if over_budget:
+            # Полный список — чтобы было видно, откуда взялись лишние запросы
+            line["all_queries"] = [
+                {"sql": sql_pattern(sql)[:500], "ms": round(ms, 2), "many": many} for sql, ms, many in queries
+            ]
+            sql_logger.warning(json.dumps(line, ensure_ascii=False))
+        else:
+            sql_logger.info(json.dumps(line, ensure_ascii=False))
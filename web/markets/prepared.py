@@ -0,0 +1,157 @@
+# web/markets/prepared.py
+
+# ============================================================
+# Подготовленные (PREPARE) запросы для «горячих» страниц.
+#
+# Обычный execute_query каждый раз отправляет на сервер полный текст SQL,
+# а PostgreSQL его заново разбирает и планирует. Для запросов, которые
+# выполняются на каждом открытии страницы (список рынков, детали рынка,
+# рынки по категории), это лишняя работа.
+#
+# Здесь запрос один раз на соединение готовится командой
+#     PREPARE имя AS <SQL с $1, $2 ...>
+# а дальше выполняется как
+#     EXECUTE имя(параметры)
+#
+# Использование (SQL пишется как обычно, с %s):
+#     rows = execute_prepared("market_details", "SELECT ... WHERE m.id = %s", (market_id,))
+#
+# - Какие запросы уже подготовлены, помним отдельно для каждого «сырого» соединения
+#   psycopg2. Если Django переподключился (новое соединение), запрос
+#   подготовится заново автоматически.
+# - Если сервер «забыл» запрос (DISCARD ALL, перезапуск пулера) или план стал
+#   несовместим после ALTER TABLE, запрос готовится заново и выполняется повторно.
+# - statement_stats() — число выполнений и суммарное время по каждому запросу.
+#
+# Чтобы подготовка окупалась, соединения должны жить дольше одного запроса:
+# см. CONN_MAX_AGE в settings.py.
+# ============================================================
+
+import re
+import threading
+import time
+import weakref
+from typing import Dict, Iterable, List, Optional
+
+from django.db import connection
+from django.db.utils import DatabaseError
+
+from .db import _row_converter
+
+# Текст запроса для каждого имени (одно имя — один SQL на весь процесс)
+_registry: Dict[str, str] = {}
+
+# Статистика по именам: {"calls", "total_ms", "prepares"}
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+# «Сырое» соединение psycopg2 -> множество имён, уже подготовленных на нём.
+# WeakKeyDictionary: закрытое и удалённое соединение само пропадёт из словаря.
+_prepared_on = weakref.WeakKeyDictionary()
+
+# %% -> %, %s -> $1, $2, ... (как это сделал бы psycopg2 при подстановке)
+_PLACEHOLDER_RE = re.compile(r"%%|%s")
+
+# SQLSTATE, при которых запрос нужно подготовить заново:
+#   26000 — подготовленного запроса с таким именем нет на сервере;
+#   0A000 — "cached plan must not change result type" (таблица изменилась).
+_REPREPARE_CODES = {"26000", "0A000"}
+
+
+def _to_dollar_placeholders(sql: str) -> str:
+    """
+    "WHERE id = %s AND name LIKE 'a%%'" -> "WHERE id = $1 AND name LIKE 'a%'"
+    """
+    counter = iter(range(1, 10_000))
+    return _PLACEHOLDER_RE.sub(lambda m: "%" if m.group(0) == "%%" else f"${next(counter)}", sql)
+
+
+def register(name: str, sql: str) -> None:
+    """
+    Запоминает SQL под именем. Повторная регистрация того же текста ничего не делает,
+    а другой текст под тем же именем — ошибка (иначе соединения разойдутся в версиях).
+    """
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+        raise ValueError(f"недопустимое имя подготовленного запроса: {name!r}")
+    with _lock:
+        old = _registry.get(name)
+        if old is not None and old != sql:
+            raise ValueError(f"запрос {name!r} уже зарегистрирован с другим SQL")
+        _registry[name] = sql
+        _stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "prepares": 0})
+
+
+def _prepared_names(raw_conn) -> set:
+    names = _prepared_on.get(raw_conn)
+    if names is None:
+        names = _prepared_on[raw_conn] = set()
+    return names
+
+
+def _prepare(cur, raw_conn, name: str, deallocate: bool = False) -> None:
+    # deallocate=True — старый вариант ещё есть на сервере, его надо убрать перед PREPARE
+    if deallocate:
+        cur.execute(f"DEALLOCATE PREPARE {name}")
+    # Без параметров Django/psycopg2 не трогают % в тексте — он уходит как есть
+    cur.execute(f"PREPARE {name} AS {_to_dollar_placeholders(_registry[name])}")
+    _prepared_names(raw_conn).add(name)
+    with _lock:
+        _stats[name]["prepares"] += 1
+
+
+def _execute(cur, name: str, params: tuple) -> None:
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name}({placeholders})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def execute_prepared(name: str, sql: str, params: Iterable = (), fetch: bool = True,
+                     row_factory: str = "dict") -> Optional[List]:
+    """
+    Аналог execute_query, но через PREPARE/EXECUTE.
+    - name        — имя запроса (латиница, цифры, _)
+    - sql         — текст запроса с %s (регистрируется при первом вызове)
+    - params      — параметры
+    - fetch       — вернуть строки (по умолчанию True: подготавливают в основном SELECT)
+    - row_factory — вид строк, как в execute_query
+    """
+    register(name, sql)
+    params = tuple(params)
+    started = time.perf_counter()
+
+    with connection.cursor() as cur:
+        raw_conn = connection.connection  # «сырое» соединение psycopg2 (после открытия курсора)
+        if name not in _prepared_names(raw_conn):
+            _prepare(cur, raw_conn, name)
+        try:
+            _execute(cur, name, params)
+        except DatabaseError as exc:
+            code = getattr(exc.__cause__, "pgcode", None)
+            # Повторяем только вне транзакции: внутри atomic() ошибка уже «сломала» транзакцию
+            if code not in _REPREPARE_CODES or connection.in_atomic_block:
+                raise
+            # 0A000: запрос на сервере есть, но план устарел; 26000: запроса нет вовсе
+            _prepare(cur, raw_conn, name, deallocate=(code == "0A000"))
+            _execute(cur, name, params)
+
+        result = None
+        if fetch:
+            columns = [col[0] for col in cur.description] if cur.description else []
+            result = _row_converter(columns, row_factory)(cur.fetchall())
+
+    with _lock:
+        stats = _stats[name]
+        stats["calls"] += 1
+        stats["total_ms"] += (time.perf_counter() - started) * 1000
+    return result
+
+
+def statement_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Копия статистики: {имя: {"calls": N, "total_ms": T, "prepares": P}}.
+    prepares — сколько раз запрос готовился (по разу на соединение + повторные подготовки).
+    """
+    with _lock:
+        return {name: dict(values) for name, values in _stats.items()}
@@ -0,0 +1,124 @@
+# web/markets/search.py
+
+# ============================================================
+# Поиск рынка по строке (название/город/штат/индекс) для страниц Django.
+# Перенос из app/search.py (search_parts, count_search, search_markets):
+# вместо цепочки ILIKE '%q%' по markets и locations — поля search_text /
+# search_tsv рынка (setup/init.sql) и их GIN-индексы.
+#   SEARCH_BACKEND=trgm — любая подстрока, триграммный индекс (нужен pg_trgm);
+#   SEARCH_BACKEND=fts  — слова запроса как начала слов, полнотекстовый индекс;
+#   SEARCH_BACKEND=auto — trgm, если pg_trgm установлен, иначе fts (по умолчанию).
+# Результаты — по релевантности (точное название, начало названия, оценка
+# похожести), при равной оценке — по названию и id; при большом числе
+# совпадений (total > SEARCH_RANK_LIMIT) — по названию, как раньше.
+# ============================================================
+
+import os
+import re
+from typing import Dict, List, Optional
+
+from .db import execute_query
+from .totals import Total, count_total
+
+SEARCH_BACKENDS = ("auto", "trgm", "fts")
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+# Больше совпадений — страница по алфавиту, а не по релевантности
+SEARCH_RANK_LIMIT = int(os.getenv("SEARCH_RANK_LIMIT", 20000))
+
+# Слова запроса для tsquery: буквы/цифры (кавычки, & | ! : в tsquery — служебные)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+SEARCH_SELECT = """
+    SELECT m.id, m.name, l.city, l.state, l.zip, {boost} AS boost, {rank} AS rank
+    FROM markets m
+    JOIN locations l ON l.id = m.location_id
+    {source}
+    WHERE {where}
+    ORDER BY {order}
+    LIMIT %s OFFSET %s
+"""
+
+# Ступень совпадения названия: точное — 2, начинается с запроса — 1, иначе 0.
+# Сортируем сначала по ней, и только внутри ступени — по оценке похожести:
+# ts_rank_cd не ограничен единицей, и прибавка к оценке её не перевешивала
+_NAME_BOOST = "(CASE WHEN lower(m.name) = %s THEN 2 WHEN lower(m.name) LIKE %s THEN 1 ELSE 0 END)"
+
+_state: Dict[str, Optional[bool]] = {"trgm": None}
+
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def has_trigram() -> bool:
+    # Установлено ли расширение pg_trgm (проверяем один раз на процесс)
+    if _state["trgm"] is None:
+        rows = execute_query("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'", fetch=True)
+        _state["trgm"] = bool(rows)
+    return _state["trgm"]
+
+
+def search_backend(backend: Optional[str] = None) -> str:
+    backend = backend if backend in SEARCH_BACKENDS else SEARCH_BACKEND
+    if backend == "auto":
+        return "trgm" if has_trigram() else "fts"
+    return backend
+
+
+def search_parts(q: str, backend: Optional[str] = None) -> dict:
+    # source/where/params — условие отбора, boost — ступень совпадения названия,
+    # rank — оценка похожести внутри ступени
+    text = (q or "").strip().lower()
+    pattern = f"%{_like_escape(text)}%"
+    boost_params = (text, f"{_like_escape(text)}%")
+
+    if search_backend(backend) == "trgm":
+        return {
+            "source": "",
+            "where": "m.search_text LIKE %s",
+            "params": (pattern,),
+            "boost": _NAME_BOOST,
+            "boost_params": boost_params,
+            "rank": "word_similarity(%s, m.search_text)",
+            "rank_params": (text,),
+        }
+
+    words = _WORD_RE.findall(text)
+    if not words:
+        return {"source": "", "where": "FALSE", "params": (),
+                "boost": "0", "boost_params": (), "rank": "0", "rank_params": ()}
+    tsquery = " & ".join(f"'{w}':*" for w in words)
+    return {
+        "source": ", to_tsquery('simple', %s) AS tsq",
+        "where": "m.search_tsv @@ tsq",
+        "params": (tsquery,),
+        "boost": _NAME_BOOST,
+        "boost_params": boost_params,
+        "rank": "ts_rank_cd(m.search_tsv, tsq)",
+        "rank_params": (),
+    }
+
+
+def count_search(q: str, backend: Optional[str] = None) -> Total:
+    """
+    Сколько рынков находит строка q (Total: может быть оценкой — total.approximate).
+    """
+    parts = search_parts(q, backend)
+    return count_total(
+        f"SELECT COUNT(*) FROM markets m {parts['source']} WHERE {parts['where']}",
+        parts["params"],
+    )
+
+
+def search_markets(q: str, limit: int, offset: int = 0, backend: Optional[str] = None,
+                   total: Optional[int] = None) -> List[dict]:
+    """
+    Страница результатов по релевантности: id, name, city, state, zip, boost, rank.
+    total — сколько всего найдено (count_search): больше SEARCH_RANK_LIMIT — по названию.
+    """
+    parts = search_parts(q, backend)
+    by_rank = total is None or total <= SEARCH_RANK_LIMIT
+    order = "boost DESC, rank DESC, m.name, m.id" if by_rank else "m.name, m.id"
+    sql = SEARCH_SELECT.format(boost=parts["boost"], rank=parts["rank"], source=parts["source"], where=parts["where"], order=order)
+    params = parts["boost_params"] + parts["rank_params"] + parts["params"] + (limit, offset)
+    return execute_query(sql, params, fetch=True) or []
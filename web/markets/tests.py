@@ -1,3 +1,233 @@
-from django.test import TestCase
+# web/markets/tests.py
 
-# Create your tests here.
+# ============================================================
+# Тесты без базы данных (SimpleTestCase): чистые функции, от которых
+# зависят страницы. Запуск из папки web:
+#     python manage.py test markets
+# ============================================================
+
+import os
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.core import signing
+from django.test import SimpleTestCase
+
+from .keyset import CURSOR_MAX_AGE, finish_page, make_cursor, plan_page, read_cursor
+
+# Разбор расписания живёт в app/schedule.py (его вызывает загрузчик) —
+# добавляем корень проекта в путь, как это делают скрипты в app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from app.schedule import parse_schedule, parse_season_dates, parse_season_times  # noqa: E402
+
+
+class SeasonDatesTests(SimpleTestCase):
+    """
+    parse_season_dates: непонятная дата не должна ронять загрузку — сезон
+    становится «круглый год» (None, None) или теряет только конец.
+    """
+
+    def test_full_range(self):
+        self.assertEqual(parse_season_dates("06/06/2020 to 09/26/2020"),
+                         (date(2020, 6, 6), date(2020, 9, 26)))
+
+    def test_open_end(self):
+        self.assertEqual(parse_season_dates("06/06/2020 to"), (date(2020, 6, 6), None))
+
+    def test_single_day(self):
+        self.assertEqual(parse_season_dates("06/06/2020"), (date(2020, 6, 6), date(2020, 6, 6)))
+
+    def test_empty(self):
+        self.assertEqual(parse_season_dates(""), (None, None))
+        self.assertEqual(parse_season_dates(None), (None, None))
+        self.assertEqual(parse_season_dates("   "), (None, None))
+
+    def test_month_names(self):
+        # Так в Export.csv записаны сезоны без точных дат
+        self.assertEqual(parse_season_dates("November 99 to April 99"), (None, None))
+
+    def test_invalid_start(self):
+        self.assertEqual(parse_season_dates("13/45/2020 to 09/26/2020"), (None, None))
+
+    def test_invalid_end(self):
+        self.assertEqual(parse_season_dates("06/06/2020 to sometime"), (date(2020, 6, 6), None))
+
+    def test_garbage(self):
+        self.assertEqual(parse_season_dates("summer"), (None, None))
+
+
+class SeasonTimesTests(SimpleTestCase):
+    """
+    parse_season_times: минуты от полуночи, нераспознанные куски пропускаются.
+    """
+
+    def test_several_days(self):
+        self.assertEqual(
+            parse_season_times("Wed: 9:00 AM-1:00 PM;Sat: 8:00 AM-12:00 PM;"),
+            [(3, 540, 780), (6, 480, 720)],
+        )
+
+    def test_noon_and_midnight(self):
+        # 12:00 AM — полночь (0), 12:00 PM — полдень (720)
+        self.assertEqual(parse_season_times("Sun: 12:00 AM-12:00 PM"), [(7, 0, 720)])
+
+    def test_overnight(self):
+        # Рынок работает через полночь: закрытие меньше открытия, день — день открытия
+        self.assertEqual(parse_season_times("Fri: 10:00 PM-2:00 AM"), [(5, 1320, 120)])
+
+    def test_case_and_spaces(self):
+        self.assertEqual(parse_season_times("  sat :9:30 am - 1:15 pm "), [(6, 570, 795)])
+
+    def test_malformed_parts_skipped(self):
+        self.assertEqual(
+            parse_season_times("Funday: 9:00 AM-1:00 PM;Sat 9:00 AM-1:00 PM;Sun: 9 AM-1 PM;Tue: 7:00 AM-11:00 AM"),
+            [(2, 420, 660)],
+        )
+
+    def test_empty(self):
+        self.assertEqual(parse_season_times(""), [])
+        self.assertEqual(parse_season_times(None), [])
+        self.assertEqual(parse_season_times(";;"), [])
+
+
+class ParseScheduleTests(SimpleTestCase):
+    """
+    parse_schedule: строка CSV -> строки market_hours.
+    """
+
+    def test_season_without_hours_skipped(self):
+        row = {
+            "Season1Date": "06/06/2020 to 09/26/2020", "Season1Time": "",
+            "Season2Date": "November 99 to April 99", "Season2Time": "Sat: 10:00 PM-1:00 AM;",
+        }
+        self.assertEqual(parse_schedule(row), [(2, 6, 1320, 60, None, None)])
+
+    def test_missing_columns(self):
+        # Обрезанная строка CSV: колонок расписания нет совсем
+        self.assertEqual(parse_schedule({}), [])
+
+
+class CursorTests(SimpleTestCase):
+    """
+    Курсоры ссылок «Назад»/«Вперёд»: испорченный, чужой или просроченный
+    токен не ломает страницу — read_cursor возвращает None, и страница
+    строится по номеру.
+    """
+
+    anchor = {"page": 3, "after": ("Boston", 42)}
+
+    def test_round_trip(self):
+        token = make_cursor(self.anchor, "sort:city", 10)
+        self.assertEqual(read_cursor(token, "sort:city", 10), self.anchor)
+
+    def test_before_and_decimal(self):
+        # AVG(rating) — Decimal: в токене строкой
+        token = make_cursor({"page": 2, "before": (Decimal("4.50"), 7)}, "sort:rating", 10)
+        self.assertEqual(read_cursor(token, "sort:rating", 10), {"page": 2, "before": ("4.50", 7)})
+
+    def test_no_anchor(self):
+        self.assertEqual(make_cursor(None, "sort:city", 10), "")
+        self.assertIsNone(read_cursor("", "sort:city", 10))
+
+    def test_tampered(self):
+        token = make_cursor(self.anchor, "sort:city", 10)
+        # Меняем символ внутри данных — подпись больше не сходится
+        i = len(token) // 3
+        tampered = token[:i] + ("A" if token[i] != "A" else "B") + token[i + 1:]
+        self.assertIsNone(read_cursor(tampered, "sort:city", 10))
+        self.assertIsNone(read_cursor(token[:-1], "sort:city", 10))
+        self.assertIsNone(read_cursor("garbage", "sort:city", 10))
+
+    def test_other_salt(self):
+        # Подписан тем же ключом, но не для пагинации
+        token = signing.dumps({"p": 3, "d": "a", "k": ["Boston", 42]}, salt="other")
+        self.assertIsNone(read_cursor(token, "sort:city", 10))
+
+    def test_other_list(self):
+        token = make_cursor(self.anchor, "sort:city", 10)
+        self.assertIsNone(read_cursor(token, "sort:state", 10))
+        self.assertIsNone(read_cursor(token, "sort:city", 20))
+
+    def test_expired(self):
+        signed_at = time.time() - CURSOR_MAX_AGE - 60
+        with mock.patch("django.core.signing.time.time", return_value=signed_at):
+            token = make_cursor(self.anchor, "sort:city", 10)
+        self.assertIsNone(read_cursor(token, "sort:city", 10))
+
+    def test_not_expired_yet(self):
+        signed_at = time.time() - CURSOR_MAX_AGE + 60
+        with mock.patch("django.core.signing.time.time", return_value=signed_at):
+            token = make_cursor(self.anchor, "sort:city", 10)
+        self.assertEqual(read_cursor(token, "sort:city", 10), self.anchor)
+
+
+class PlanPageTests(SimpleTestCase):
+    """
+    plan_page у конца списка: последняя страница и страница перед ней
+    читаются в обратном порядке и после finish_page совпадают со срезом
+    по номеру страницы.
+    """
+
+    keys = [("id", "ASC")]
+
+    def run_plan(self, plan, ids):
+        # Как выполнит PAGE_SQL: ORDER BY (возможно обратный), затем OFFSET skip LIMIT limit
+        ordered = list(reversed(ids)) if plan["reverse"] else list(ids)
+        rows = [{"id": i} for i in ordered[plan["skip"]:plan["skip"] + plan["limit"]]]
+        return finish_page(plan, rows, self.keys)
+
+    def assert_page(self, total, per_page, page, kind):
+        ids = list(range(1, total + 1))
+        plan = plan_page(self.keys, total, per_page, page)
+        self.assertEqual(plan["kind"], kind)
+        rows, anchors = self.run_plan(plan, ids)
+        expected = ids[(page - 1) * per_page:page * per_page]
+        self.assertEqual([r["id"] for r in rows], expected)
+        return plan, anchors
+
+    def test_last_page_partial(self):
+        plan, anchors = self.assert_page(95, 10, 10, "last")
+        self.assertEqual((plan["limit"], plan["skip"], plan["order"]), (5, 0, "id DESC"))
+        self.assertIsNone(anchors["next"])
+        self.assertEqual(anchors["prev"], {"page": 9, "before": (91,)})
+
+    def test_last_page_full(self):
+        plan, _ = self.assert_page(100, 10, 10, "last")
+        self.assertEqual(plan["limit"], 10)
+
+    def test_page_before_last(self):
+        plan, anchors = self.assert_page(95, 10, 9, "offset_rev")
+        self.assertEqual((plan["limit"], plan["skip"]), (10, 5))
+        self.assertEqual(anchors["next"], {"page": 10, "after": (90,)})
+        self.assertEqual(anchors["prev"], {"page": 8, "before": (81,)})
+
+    def test_page_before_last_full(self):
+        plan, _ = self.assert_page(100, 10, 9, "offset_rev")
+        self.assertEqual(plan["skip"], 10)
+
+    def test_two_pages(self):
+        # Страниц всего две: вторая — и последняя
+        self.assert_page(15, 10, 2, "last")
+
+    def test_page_past_end_clamped(self):
+        plan = plan_page(self.keys, 95, 10, 50)
+        self.assertEqual((plan["page"], plan["kind"]), (10, "last"))
+
+    def test_cached_total_reads_forward(self):
+        # total из кеша мог устареть: обратный порядок дал бы чужие строки
+        plan = plan_page(self.keys, 95, 10, 10, fresh=False)
+        self.assertEqual((plan["kind"], plan["skip"], plan["reverse"]), ("offset", 90, False))
+        plan = plan_page(self.keys, 95, 10, 9, fresh=False)
+        self.assertEqual((plan["kind"], plan["skip"]), ("offset", 80))
+
+    def test_estimated_total_reads_forward(self):
+        plan = plan_page(self.keys, 95, 10, 10, exact=False)
+        self.assertEqual((plan["kind"], plan["skip"], plan["reverse"]), ("offset", 90, False))
+
+    def test_anchor_for_other_page_ignored(self):
+        plan = plan_page(self.keys, 95, 10, 10, anchor={"page": 4, "after": (30,)})
+        self.assertEqual(plan["kind"], "last")
@@ -0,0 +1,121 @@
+# web/markets/totals.py
+
+# ============================================================
+# Сколько всего строк в списке (для пагинации) без точного COUNT(*)
+# на каждое открытие страницы.
+# Перенос из app/totals.py (count_total, invalidate_totals, Total):
+#   TOTALS_MODE=exact    — COUNT(*) каждый раз;
+#   TOTALS_MODE=cached   — COUNT(*) один раз, дальше из памяти до записи
+#                          в markets/reviews (invalidate_totals()) или TTL;
+#   TOTALS_MODE=estimate — оценка планировщика (EXPLAIN), если она
+#                          не меньше TOTALS_ESTIMATE_MIN, иначе как cached.
+# total.approximate=True — это оценка: в шаблонах пишем «около N».
+# total.cached=True — точное число из памяти (за TTL могло устареть).
+# ============================================================
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+from .db import execute_query
+
+TOTALS_MODES = ("exact", "cached", "estimate")
+TOTALS_MODE = os.getenv("TOTALS_MODE", "estimate")
+TOTALS_CACHE_TTL = float(os.getenv("TOTALS_CACHE_TTL", 30))
+TOTALS_CACHE_SIZE = int(os.getenv("TOTALS_CACHE_SIZE", 256))
+# Оценке верим только для больших выборок: маленькие считаются точно быстро,
+# а планировщик на узких фильтрах (ILIKE '%...%') ошибается сильнее
+TOTALS_ESTIMATE_MIN = int(os.getenv("TOTALS_ESTIMATE_MIN", 100000))
+
+# "SELECT COUNT(*) FROM ..." -> "SELECT 1 FROM ..." (для EXPLAIN нужны строки, а не агрегат)
+_COUNT_RE = re.compile(r"^\s*SELECT\s+COUNT\(\s*\*\s*\)", re.IGNORECASE)
+
+
+class Total(int):
+    """
+    Число строк. total.approximate — True, если это оценка планировщика;
+    total.cached — True, если это точный подсчёт, взятый из памяти.
+    """
+
+    def __new__(cls, value: int, approximate: bool = False, cached: bool = False):
+        obj = super().__new__(cls, value)
+        obj.approximate = approximate
+        obj.cached = cached
+        return obj
+
+
+# (sql, params) -> (число, время подсчёта, поколение)
+_cache = OrderedDict()
+_state = {"generation": 0}
+_lock = threading.Lock()
+
+
+def invalidate_totals() -> None:
+    """
+    Забыть все запомненные числа (вызывать после изменения markets/reviews).
+    """
+    with _lock:
+        _state["generation"] += 1
+        _cache.clear()
+
+
+def _exact(sql: str, params: tuple) -> int:
+    return int(execute_query(sql, params, fetch=True)[0]["count"])
+
+
+def _cached(sql: str, params: tuple) -> Tuple[int, bool]:
+    # -> (число, взято ли оно из памяти)
+    key = (sql, tuple(params))
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        generation = _state["generation"]
+        if hit and hit[2] == generation and now - hit[1] < TOTALS_CACHE_TTL:
+            _cache.move_to_end(key)
+            return hit[0], True
+
+    value = _exact(sql, params)
+    with _lock:
+        # Пока считали, могла пройти запись — тогда число уже устарело, не запоминаем
+        if _state["generation"] == generation:
+            _cache[key] = (value, now, generation)
+            while len(_cache) > TOTALS_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return value, False
+
+
+def estimate_count(sql: str, params: Sequence = ()) -> Optional[int]:
+    """
+    Оценка планировщика для запроса вида SELECT COUNT(*) FROM ... WHERE ...
+    (или None, если запрос другого вида / EXPLAIN не удался).
+    """
+    if not _COUNT_RE.match(sql):
+        return None
+    rows_sql = _COUNT_RE.sub("SELECT 1", sql, count=1)
+    try:
+        plan = execute_query("EXPLAIN (FORMAT JSON) " + rows_sql, params, fetch=True)[0]["QUERY PLAN"]
+    except Exception:
+        return None
+    if isinstance(plan, str):  # драйвер мог не разобрать JSON сам
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_total(sql: str, params: Sequence = (), mode: Optional[str] = None) -> Total:
+    """
+    Total для запроса SELECT COUNT(*) ... (режим — mode или TOTALS_MODE).
+    """
+    mode = mode if mode in TOTALS_MODES else TOTALS_MODE
+    params = tuple(params)
+    if mode == "exact":
+        return Total(_exact(sql, params))
+    if mode == "estimate":
+        estimate = estimate_count(sql, params)
+        if estimate is not None and estimate >= TOTALS_ESTIMATE_MIN:
+            return Total(estimate, approximate=True)
+    value, from_cache = _cached(sql, params)
+    return Total(value, cached=from_cache)
@@ -16,6 +16,8 @@ urlpatterns = [
     path("reviews/", views.reviews_page, name="reviews"),
     path("sort/", views.sort_markets, name="sort_markets"),
     path("radius/", views.search_by_radius, name="search_by_radius"),
+    path("nearest/", views.nearest_page, name="nearest"),
+    path("api/nearest/", views.nearest_api, name="nearest_api"),
     path("delete_market/", views.delete_market, name="delete_market"),
     path("by_category/", views.markets_by_category, name="by_category"),
     path("register/", views.register, name="register"),
@@ -6,7 +6,8 @@
 # Это перенос базовой логики из app.utils.validate_coordinates.
 # ============================================================
 
-from typing import Optional, Tuple
+import math
+from typing import List, Optional, Sequence, Tuple
 
 def validate_coordinates(lat_str: str, lon_str: str) -> Optional[Tuple[float, float]]:
     # Удаляем пробелы по краям на всякий случай
@@ -30,3 +31,202 @@ def validate_coordinates(lat_str: str, lon_str: str) -> Optional[Tuple[float, fl
         return None
 
     return (lat, lon)
+
+
+# ============================================================
+# Расписание рынка (таблица market_hours).
+# Перенос форматирования из app.schedule:
+# weekday — ISO-день (1 = понедельник ... 7 = воскресенье),
+# время — минуты от полуночи.
+# ============================================================
+
+WEEKDAY_NAMES = ["", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def format_minutes(minutes: int) -> str:
+    # 810 -> "13:30"
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# ============================================================
+# Фильтр по флагам рынка (markets.flags_mask).
+# Перенос логики из app.utils.build_flags_mask / flags_condition.
+# Биты 0..47 — категории (categories.bit_no), 48..62 — способы оплаты.
+# ============================================================
+
+def build_flags_mask(bit_numbers) -> int:
+    # [0, 2] -> 0b101 = 5
+    mask = 0
+    for bit_no in bit_numbers:
+        if bit_no is not None:
+            mask |= 1 << int(bit_no)
+    return mask
+
+
+def flags_condition(mask: int, match_all: bool = True, category_ids: Sequence[int] = ()) -> Tuple[str, tuple]:
+    # AND: у рынка есть все выбранные флаги; OR: хотя бы один.
+    # category_ids — категории без бита (не поместились в маску): по market_categories
+    parts, params = [], []
+    if mask:
+        if match_all:
+            parts.append("(m.flags_mask & %s) = %s")
+            params += [mask, mask]
+        else:
+            parts.append("(m.flags_mask & %s) <> 0")
+            params.append(mask)
+    if category_ids:
+        # Литерал массива "{3,5}" (строка, а не список — params остаются хешируемыми для totals)
+        ids = "{" + ",".join(str(int(i)) for i in category_ids) + "}"
+        if match_all:
+            parts.append("(SELECT COUNT(*) FROM market_categories mc "
+                         "WHERE mc.market_id = m.id AND mc.category_id = ANY(%s::int[])) = %s")
+            params += [ids, len(category_ids)]
+        else:
+            parts.append("EXISTS (SELECT 1 FROM market_categories mc "
+                         "WHERE mc.market_id = m.id AND mc.category_id = ANY(%s::int[]))")
+            params.append(ids)
+    sql = (" AND " if match_all else " OR ").join(parts)
+    return (f"({sql})" if len(parts) > 1 else sql), tuple(params)
+
+
+# ============================================================
+# Предварительный фильтр для поиска по радиусу.
+# Перенос логики из app.utils.bounding_box / bbox_condition:
+# сначала отбираем рынки в прямоугольнике вокруг точки (по индексу
+# idx_markets_lat_lon), точное расстояние считаем только для них.
+# ============================================================
+
+EARTH_RADIUS_MILES = 3959
+
+
+def bounding_box(lat: float, lon: float, radius_miles: float) -> Tuple[float, float, float, float]:
+    # (min_lat, max_lat, min_lon, max_lon); у полюса — вся долгота
+    angular = radius_miles / EARTH_RADIUS_MILES
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(lat))))
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def bbox_condition(lat: float, lon: float, radius_miles: float) -> Tuple[str, tuple]:
+    # Условие WHERE по прямоугольнику; через 180-й меридиан — два куска долготы
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_miles)
+    if min_lon < -180:
+        lon_sql, lon_params = "(m.longitude >= %s OR m.longitude <= %s)", (min_lon + 360, max_lon)
+    elif max_lon > 180:
+        lon_sql, lon_params = "(m.longitude >= %s OR m.longitude <= %s)", (min_lon, max_lon - 360)
+    else:
+        lon_sql, lon_params = "m.longitude BETWEEN %s AND %s", (min_lon, max_lon)
+    return "m.latitude BETWEEN %s AND %s AND " + lon_sql, (min_lat, max_lat) + lon_params
+
+
+# ============================================================
+# Geohash-ячейки для поиска по радиусу.
+# Перенос логики из app.utils.geohash_ranges / geohash_condition:
+# круг покрывается несколькими ячейками markets.geohash, каждая ячейка —
+# диапазон строк по индексу idx_markets_geohash (см. setup/init.sql).
+# ============================================================
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+GEOHASH_MAX_CELLS = 32
+
+
+def _geohash_bits(precision: int) -> Tuple[int, int]:
+    # (бит широты, бит долготы): 5 бит на символ, долготе — на бит больше при нечётном числе
+    bits = 5 * precision
+    return bits // 2, (bits + 1) // 2
+
+
+def _geohash_row(lat: float, lat_bits: int) -> int:
+    row = int(math.floor((lat + 90) / 180 * (1 << lat_bits)))
+    return min(max(row, 0), (1 << lat_bits) - 1)
+
+
+def _geohash_col(lon: float, lon_bits: int) -> int:
+    col = int(math.floor((lon + 180) / 360 * (1 << lon_bits)))
+    return min(max(col, 0), (1 << lon_bits) - 1)
+
+
+def _geohash_code(row: int, col: int, precision: int) -> int:
+    # Чередуем биты долготы и широты, старший — бит долготы
+    lat_bits, lon_bits = _geohash_bits(precision)
+    code = 0
+    for k in range(lat_bits + lon_bits):
+        if k % 2 == 0:
+            bit = (col >> (lon_bits - 1 - k // 2)) & 1
+        else:
+            bit = (row >> (lat_bits - 1 - k // 2)) & 1
+        code = (code << 1) | bit
+    return code
+
+
+def _geohash_text(code: int, precision: int) -> str:
+    return "".join(GEOHASH_BASE32[(code >> 5 * (precision - 1 - i)) & 31] for i in range(precision))
+
+
+def geohash_encode(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    # Как колонка markets.geohash (при precision=12 — символ в символ)
+    lat_bits, lon_bits = _geohash_bits(precision)
+    code = _geohash_code(_geohash_row(lat, lat_bits), _geohash_col(lon, lon_bits), precision)
+    return _geohash_text(code, precision)
+
+
+def geohash_ranges(lat: float, lon: float, radius_miles: float,
+                   max_cells: int = GEOHASH_MAX_CELLS) -> List[Tuple[str, Optional[str]]]:
+    # [(от, до), ...]: рынок в круге попадает в один из диапазонов от <= geohash < до
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_miles)
+    if min_lon < -180:
+        lon_spans = [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    elif max_lon > 180:
+        lon_spans = [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    else:
+        lon_spans = [(min_lon, max_lon)]
+
+    def cover(precision):
+        lat_bits, lon_bits = _geohash_bits(precision)
+        rows = range(_geohash_row(min_lat, lat_bits), _geohash_row(max_lat, lat_bits) + 1)
+        cols = [c for lo, hi in lon_spans
+                for c in range(_geohash_col(lo, lon_bits), _geohash_col(hi, lon_bits) + 1)]
+        return rows, cols
+
+    # Самая мелкая длина ячейки, при которой хватает max_cells ячеек (при длине 1 их всего 32)
+    precision = 1
+    while precision < GEOHASH_PRECISION:
+        rows, cols = cover(precision + 1)
+        if len(rows) * len(cols) > max_cells:
+            break
+        precision += 1
+    rows, cols = cover(precision)
+
+    # Соседние по номеру ячейки — один диапазон
+    codes = sorted({_geohash_code(r, c, precision) for r in rows for c in cols})
+    ranges = []
+    start = prev = codes[0]
+    for code in codes[1:] + [None]:
+        if code is not None and code == prev + 1:
+            prev = code
+            continue
+        upper = prev + 1
+        ranges.append((
+            _geohash_text(start, precision),
+            _geohash_text(upper, precision) if upper < 32 ** precision else None,
+        ))
+        if code is not None:
+            start = prev = code
+    return ranges
+
+
+def geohash_condition(lat: float, lon: float, radius_miles: float) -> Tuple[str, tuple]:
+    # Условие WHERE по ячейкам geohash (только отбор кандидатов, расстояние проверяется отдельно)
+    parts, params = [], ()
+    for lower, upper in geohash_ranges(lat, lon, radius_miles):
+        if upper is None:
+            parts.append("m.geohash >= %s")
+            params += (lower,)
+        else:
+            parts.append("(m.geohash >= %s AND m.geohash < %s)")
+            params += (lower, upper)
+    return "(" + " OR ".join(parts) + ")", params
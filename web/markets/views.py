@@ -1,13 +1,19 @@
 # web/markets/views.py
 
 from math import ceil
+from urllib.parse import urlencode
 
 from django.shortcuts import render, redirect
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.urls import reverse
+from django.utils.html import escape
 from .db import execute_query
-from .utils import validate_coordinates
-from django.db import connection  # даёт доступ к "сырым" SQL-запросам
+from .prepared import execute_prepared  # PREPARE/EXECUTE для «горячих» запросов
+from .keyset import keyset_paginate  # keyset-пагинация (по ключу сортировки, без больших OFFSET)
+from .totals import count_total, invalidate_totals  # число строк для пагинации: кеш/оценка вместо COUNT(*) на каждый показ
+from .search import count_search, search_markets  # поиск рынка по строке: GIN-индекс, результаты по релевантности
+from .geo_index import radius_hits, load_hit_rows, market_deleted, nearest_markets  # гео-индекс в памяти (KD-дерево)
+from .utils import validate_coordinates, WEEKDAY_NAMES, format_minutes, build_flags_mask, flags_condition, bbox_condition, geohash_condition
 import json  # нужен для превращения Python-списков в JSON для JS в шаблоне
 from django.contrib.auth.decorators import login_required
 from .forms import CustomUserCreationForm
@@ -61,28 +67,10 @@ def dashboard_home(request):
 
     # Вспомогательная функция: вернуть одно целое число (например, COUNT(*))
     def fetch_one_value(sql: str) -> int:
-        # Открываем соединение и выполняем запрос
-        with connection.cursor() as cur:
-            cur.execute(sql)
-            row = cur.fetchone()  # ожидаем одну строку, вида (123,)
+        # row_factory="tuple" — строки как есть из драйвера, без построения словарей
+        rows = execute_query(sql, fetch=True, row_factory="tuple")
         # Если строка есть — берём первый столбец, иначе 0
-        return int(row[0]) if row and row[0] is not None else 0
-
-    # Вспомогательная функция: вернуть все строки как список словарей
-    def fetch_all_dicts(sql: str):
-        # Выполняем запрос
-        with connection.cursor() as cur:
-            cur.execute(sql)
-            cols = [c[0] for c in cur.description] if cur.description else []
-            rows = cur.fetchall()
-        # Собираем список словарей вида [{"state": "CA", "markets_count": 123}, ...]
-        result = []
-        for r in rows:
-            item = {}
-            for i, v in enumerate(r):
-                item[cols[i]] = v
-            result.append(item)
-        return result
+        return int(rows[0][0]) if rows and rows[0][0] is not None else 0
 
     # -------- KPI (4 счётчика) --------
     total_markets = fetch_one_value("SELECT COUNT(*) FROM markets;")                       # всего рынков
@@ -92,31 +80,31 @@ def dashboard_home(request):
 
     # -------- График 1: ТОП-10 штатов по числу рынков (бар-чарт) --------
     # Логика: соединяем markets с locations по location_id и считаем рынки по state.
-    rows_states = fetch_all_dicts("""
+    rows_states = execute_query("""
         SELECT l.state AS state, COUNT(m.id) AS markets_count
         FROM markets m
         JOIN locations l ON l.id = m.location_id
         GROUP BY l.state
         ORDER BY COUNT(m.id) DESC
         LIMIT 10;
-    """)
+    """, fetch=True, row_factory="tuple")
     # Два параллельных списка: подписи (штаты) и значения (кол-во рынков)
-    top_states_labels = json.dumps([(r["state"] or "—") for r in rows_states], ensure_ascii=False)
-    top_states_values = json.dumps([int(r["markets_count"] or 0) for r in rows_states])
+    top_states_labels = json.dumps([(state or "—") for state, _ in rows_states], ensure_ascii=False)
+    top_states_values = json.dumps([int(count or 0) for _, count in rows_states])
 
     # -------- График 2: Распределение рынков по категориям (pie) --------
     # Логика: таблица связей market_categories (market_id, category_id).
     # COUNT(mc.market_id) = сколько рынков относится к категории.
-    rows_cat = fetch_all_dicts("""
+    rows_cat = execute_query("""
         SELECT c.name AS category, COUNT(mc.market_id) AS markets_count
         FROM categories c
         JOIN market_categories mc ON mc.category_id = c.id
         GROUP BY c.name
         ORDER BY COUNT(mc.market_id) DESC, c.name ASC
         LIMIT 10;
-    """)
-    cat_labels = json.dumps([(r["category"] or "—") for r in rows_cat], ensure_ascii=False)
-    cat_values = json.dumps([int(r["markets_count"] or 0) for r in rows_cat])
+    """, fetch=True, row_factory="tuple")
+    cat_labels = json.dumps([(category or "—") for category, _ in rows_cat], ensure_ascii=False)
+    cat_values = json.dumps([int(count or 0) for _, count in rows_cat])
 
     # Передаём всё в шаблон
     context = {
@@ -198,43 +186,47 @@ def build_pagination_context(request, total: int, default_per: int = 10, min_per
         "prev_page": p["prev_page"],
         "next_page": p["next_page"],
         "offset": p["offset"],
+        "approximate": getattr(total, "approximate", False),  # total — оценка («около N»)
     }
 
 # ---------------------------
 # 1) СПИСОК РЫНКОВ
 # ---------------------------
 
+# Запрос-источник страницы списка (ключ — id). Тексты запросов страниц вынесены
+# в константы модуля: их же проверяет команда advise_indexes.
+MARKETS_LIST_SQL = """
+    SELECT
+        m.id, m.name,
+        l.street, l.city, l.county, l.state, l.zip,
+        m.website, m.facebook, m.twitter, m.youtube, m.other_media,
+        m.latitude, m.longitude,
+        COALESCE(s.avg_rating, 0) AS avg_rating,
+        COALESCE(s.review_count, 0) AS review_count
+    FROM markets m
+    JOIN locations l ON m.location_id = l.id
+    LEFT JOIN market_rating_summary s ON s.market_id = m.id
+"""
+MARKETS_LIST_KEYS = [("id", "ASC")]
+
+
 def markets_list(request: HttpRequest) -> HttpResponse:
     """
     Django-версия списка рынков (адаптация Streamlit-функции).
-    Пагинация через build_pagination_context + универсальный шаблон.
+    Пагинация — keyset по id (keyset_paginate) + универсальный шаблон.
     """
 
-    # 1) Считаем общее количество рынков
-    total_row = execute_query("SELECT COUNT(*) FROM markets", fetch=True)[0]
-    total = int(total_row.get("count") or 0)
+    # 1) Общее количество рынков (из кеша или оценка планировщика — см. totals.py)
+    total = count_total("SELECT COUNT(*) FROM markets")
 
-    # 2) Строим словарь пагинации
-    pagination = build_pagination_context(request, total, default_per=15)
-
-    # 3) Основной запрос — отдаём поля
-    rows = execute_query(
-        """
-        SELECT
-            m.id, m.name,
-            l.street, l.city, l.county, l.state, l.zip,
-            m.website, m.facebook, m.twitter, m.youtube, m.other_media,
-            m.latitude, m.longitude,
-            COALESCE((SELECT AVG(r.rating) FROM reviews r WHERE r.market_id = m.id), 0) AS avg_rating,
-            (SELECT COUNT(r2.id) FROM reviews r2 WHERE r2.market_id = m.id) AS review_count
-        FROM markets m
-        JOIN locations l ON m.location_id = l.id
-        ORDER BY m.id
-        LIMIT %s OFFSET %s
-        """,
-        (pagination["per"], pagination["offset"]),
-        fetch=True,
-    ) or []
+    # 2) Страница: «Вперёд/Назад» — WHERE id > последний id (по первичному ключу),
+    #    поэтому страница 5000 открывается так же быстро, как первая
+    rows, pagination = keyset_paginate(
+        request, total, MARKETS_LIST_KEYS, MARKETS_LIST_SQL, (),
+        # Каждый вид запроса страницы (first/after/before/last/offset) — свой подготовленный запрос
+        lambda sql, params, kind: execute_prepared(f"markets_list_page_{kind}", sql, params),
+        scope="list", default_per=15,
+    )
 
     # 4) Подготовка данных (как раньше)
     prepared = []
@@ -301,6 +293,33 @@ def markets_list(request: HttpRequest) -> HttpResponse:
 # ---------------------------
 # 2) ПОИСК
 # ---------------------------
+
+# Фильтр поиска: пустое поле — без условия
+_SEARCH_FILTER = """
+    WHERE (%s = '' OR l.city ILIKE %s)
+      AND (%s = '' OR l.state ILIKE %s)
+      AND (%s = '' OR l.zip = %s)
+"""
+MARKETS_SEARCH_COUNT_SQL = """
+    SELECT COUNT(*)
+    FROM markets m
+    JOIN locations l ON m.location_id = l.id
+""" + _SEARCH_FILTER
+MARKETS_SEARCH_SQL = """
+    SELECT m.id, m.name, l.city, l.state, l.zip
+    FROM markets m
+    JOIN locations l ON m.location_id = l.id
+""" + _SEARCH_FILTER
+MARKETS_SEARCH_KEYS = [("id", "ASC")]
+
+
+def search_params(city: str, state: str, zip_code: str) -> tuple:
+    """
+    Параметры _SEARCH_FILTER для значений полей формы.
+    """
+    return (city, f"%{city}%", state, f"%{state}%", zip_code, zip_code)
+
+
 def markets_search(request: HttpRequest) -> HttpResponse:
     """
     Поиск по городу/штату/ZIP: форма GET (city/state/zip) + пагинация.
@@ -312,49 +331,22 @@ def markets_search(request: HttpRequest) -> HttpResponse:
     zip_code = (request.GET.get("zip") or "").strip()
 
     # 2) Считаем total — сколько всего строк подходит под фильтр
-    total = execute_query(
-        """
-        SELECT COUNT(*) 
-        FROM markets m
-        JOIN locations l ON m.location_id = l.id
-        WHERE (%s = '' OR l.city ILIKE %s)
-          AND (%s = '' OR l.state ILIKE %s)
-          AND (%s = '' OR l.zip = %s)
-        """,
-        (city, f"%{city}%", state, f"%{state}%", zip_code, zip_code),
-        fetch=True
-    )[0]["count"]
+    #    (count_total запоминает число, и при листании COUNT(*) не повторяется)
+    params = search_params(city, state, zip_code)
+    total = count_total(MARKETS_SEARCH_COUNT_SQL, params)
 
-    # 3) Универсальная пагинация (одна на всю функцию)
-    pagination = build_pagination_context(request, total, default_per=10)
-    # В pagination уже есть:
+    # 3) Keyset-пагинация по id (одна на всю функцию)
+    # В pagination есть:
     # - per         → сколько на страницу
-    # - offset      → смещение
+    # - offset      → номер первой строки страницы
     # - page/pages  → текущая и общее число страниц
     # - has_prev/has_next, prev_page/next_page, per_options
-
-    rows = []
-    if total > 0:
-        rows = execute_query(
-            """
-            SELECT m.id, m.name, l.city, l.state, l.zip
-            FROM markets m
-            JOIN locations l ON m.location_id = l.id
-            WHERE (%s = '' OR l.city ILIKE %s)
-              AND (%s = '' OR l.state ILIKE %s)
-              AND (%s = '' OR l.zip = %s)
-            ORDER BY m.id
-            LIMIT %s OFFSET %s
-            """,
-            (
-                city, f"%{city}%",
-                state, f"%{state}%",
-                zip_code, zip_code,
-                pagination["per"],          # ← берём per из одного источника
-                pagination["offset"]        # ← берём offset из одного источника
-            ),
-            fetch=True
-        )
+    # - prev_cursor/next_cursor → токены для ссылок «Назад»/«Вперёд»
+    rows, pagination = keyset_paginate(
+        request, total, MARKETS_SEARCH_KEYS, MARKETS_SEARCH_SQL, params,
+        lambda sql, params, kind: execute_query(sql, params, fetch=True),
+        scope=f"search|{city}|{state}|{zip_code}",
+    )
 
     # 4) Готовим контекст
     ctx = {
@@ -363,7 +355,7 @@ def markets_search(request: HttpRequest) -> HttpResponse:
         "state": state,
         "zip": zip_code,
     }
-    ctx.update(pagination)  # добавит page/pages/per/has_prev/.../per_options/offset
+    ctx.update(pagination)  # добавит page/pages/per/has_prev/.../per_options/offset/курсоры
     return render(request, "markets_search.html", ctx)
 
 
@@ -371,6 +363,44 @@ def markets_search(request: HttpRequest) -> HttpResponse:
 # 3) ДЕТАЛИ РЫНКА
 # ---------------------------
 
+MARKET_DETAILS_SQL = """
+    SELECT
+        m.name,
+        l.street, l.city, l.county, l.state, l.zip,
+        m.website, m.facebook, m.twitter, m.youtube, m.other_media,
+        m.latitude, m.longitude
+    FROM markets m
+    JOIN locations l ON m.location_id = l.id
+    WHERE m.id = %s
+"""
+MARKET_RATING_SQL = """
+    SELECT
+        COALESCE(AVG(r.rating), 0) AS avg_rating,
+        COUNT(r.id) AS review_count
+    FROM reviews r
+    WHERE r.market_id = %s
+"""
+MARKET_CATEGORIES_SQL = """
+    SELECT c.name
+    FROM categories c
+    JOIN market_categories mc ON mc.category_id = c.id
+    WHERE mc.market_id = %s
+    ORDER BY c.name
+"""
+MARKET_REVIEWS_SQL = """
+    SELECT id, user_name, rating, review_text
+    FROM reviews
+    WHERE market_id = %s
+    ORDER BY id
+"""
+MARKET_HOURS_SQL = """
+    SELECT season_no, weekday, open_minute, close_minute, season_start, season_end
+    FROM market_hours
+    WHERE market_id = %s
+    ORDER BY season_no, weekday, open_minute
+"""
+
+
 def market_details(request: HttpRequest) -> HttpResponse:
     """
     Одна страница: форма для ввода ID рынка + вывод деталей.
@@ -383,64 +413,29 @@ def market_details(request: HttpRequest) -> HttpResponse:
 
     if market_id:
         # Загружаем основные данные
-        details = execute_query(
-            """
-            SELECT 
-                m.name,
-                l.street, l.city, l.county, l.state, l.zip,
-                m.website, m.facebook, m.twitter, m.youtube, m.other_media,
-                m.latitude, m.longitude
-            FROM markets m
-            JOIN locations l ON m.location_id = l.id
-            WHERE m.id = %s
-            """,
-            (market_id,),
-            fetch=True
-        )
+        details = execute_prepared("market_details", MARKET_DETAILS_SQL, (market_id,))
         if not details:
             context["not_found"] = True
         else:
             d = details[0]
 
             # Рейтинг
-            agg = execute_query(
-                """
-                SELECT 
-                    COALESCE(AVG(r.rating), 0) AS avg_rating,
-                    COUNT(r.id) AS review_count
-                FROM reviews r
-                WHERE r.market_id = %s
-                """,
-                (market_id,),
-                fetch=True
-            )[0]
+            agg = execute_prepared("market_rating", MARKET_RATING_SQL, (market_id,))[0]
             avg_rating = round(float(agg.get("avg_rating") or 0), 1)
             review_count = int(agg.get("review_count") or 0)
 
             # Категории
-            cats = execute_query(
-                """
-                SELECT c.name
-                FROM categories c
-                JOIN market_categories mc ON mc.category_id = c.id
-                WHERE mc.market_id = %s
-                ORDER BY c.name
-                """,
-                (market_id,),
-                fetch=True
-            )
+            cats = execute_prepared("market_categories", MARKET_CATEGORIES_SQL, (market_id,))
 
             # Отзывы
-            reviews = execute_query(
-                """
-                SELECT id, user_name, rating, review_text
-                FROM reviews
-                WHERE market_id = %s
-                ORDER BY id
-                """,
-                (market_id,),
-                fetch=True
-            )
+            reviews = execute_prepared("market_reviews", MARKET_REVIEWS_SQL, (market_id,))
+
+            # Расписание (разобрано при загрузке в market_hours)
+            hours = execute_prepared("market_hours", MARKET_HOURS_SQL, (market_id,))
+            for h in hours:
+                h["weekday_name"] = WEEKDAY_NAMES[h["weekday"]]
+                h["opens"] = format_minutes(h["open_minute"])
+                h["closes"] = format_minutes(h["close_minute"])
 
             context.update({
                 "d": d,
@@ -448,6 +443,7 @@ def market_details(request: HttpRequest) -> HttpResponse:
                 "review_count": review_count,
                 "cats": cats,
                 "reviews": reviews,
+                "hours": hours,
             })
 
     return render(request, "details.html", context)
@@ -462,7 +458,7 @@ def add_review(request: HttpRequest) -> HttpResponse:
     """
     Два пути:
     1) Знаем ID рынка — вводим и проверяем.
-    2) Не знаем — ищем по подстроке (название/город/штат), листаем, выбираем рынок.
+    2) Не знаем — ищем по строке (название/город/штат/индекс), листаем, выбираем рынок.
     После выбора рынка — форма отзыва (имя/оценка/текст + подтверждение).
     """
     ctx = {}
@@ -492,7 +488,7 @@ def add_review(request: HttpRequest) -> HttpResponse:
         else:
             ctx["error_check_id"] = "Введите корректный ID (> 0)."
 
-    # B) Поиск рынка по строке (название/город/штат)
+    # B) Поиск рынка по строке (название/город/штат/индекс) — search.py
     q = (request.GET.get("q") or "").strip()
     ctx["q"] = q
 
@@ -503,33 +499,14 @@ def add_review(request: HttpRequest) -> HttpResponse:
     rows = []
     if q:
         # Счётчик
-        total = execute_query(
-            """
-            SELECT COUNT(*) 
-            FROM markets m
-            JOIN locations l ON m.location_id = l.id
-            WHERE m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s
-            """,
-            (f"%{q}%", f"%{q}%", f"%{q}%"),
-            fetch=True
-        )[0]["count"]
+        total = count_search(q)
 
         p = _paginate(total, per_page, page)
         ctx["p"] = p
 
         if total > 0:
-            rows = execute_query(
-                """
-                SELECT m.id, m.name, l.city, l.state
-                FROM markets m
-                JOIN locations l ON m.location_id = l.id
-                WHERE m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s
-                ORDER BY m.name
-                LIMIT %s OFFSET %s
-                """,
-                (f"%{q}%", f"%{q}%", f"%{q}%", p["per_page"], p["offset"]),
-                fetch=True
-            )
+            # Самые подходящие рынки — первыми
+            rows = search_markets(q, p["per_page"], p["offset"], total=total)
 
     ctx["rows"] = rows
     ctx["total"] = total
@@ -590,6 +567,7 @@ def add_review(request: HttpRequest) -> HttpResponse:
                 (market_id, user_name, rating, review_text, user_id),
                 fetch=False
             )
+            invalidate_totals()  # запомненные числа строк устарели
             # Редиректим на детали рынка — так исключаем повторную отправку формы F5
             return redirect(f"{reverse('markets:details')}?id={market_id}")
 
@@ -602,6 +580,10 @@ def add_review(request: HttpRequest) -> HttpResponse:
 
 from django.contrib import messages  # ← убедись, что импорт есть вверху файла
 
+# Автор отзыва — для проверки прав перед удалением
+REVIEW_AUTHOR_SQL = "SELECT id, user_id, user_name FROM reviews WHERE id = %s"
+
+
 @login_required
 def delete_review(request: HttpRequest) -> HttpResponse:
     """
@@ -649,11 +631,7 @@ def delete_review(request: HttpRequest) -> HttpResponse:
             return redirect(go_back)
 
         # 4) Ищем отзыв в базе и берём данные автора
-        row = execute_query(
-            "SELECT id, user_id, user_name FROM reviews WHERE id = %s",
-            (review_id,),
-            fetch=True
-        )
+        row = execute_query(REVIEW_AUTHOR_SQL, (review_id,), fetch=True)
         if not row:
             messages.error(request, "Отзыв с таким ID не найден.")
             return redirect(go_back)
@@ -671,6 +649,7 @@ def delete_review(request: HttpRequest) -> HttpResponse:
         if is_super or can_moderate or (is_author_by_name and is_author_by_id):
             # 6) Всё ок — удаляем
             execute_query("DELETE FROM reviews WHERE id = %s", (review_id,), fetch=False)
+            invalidate_totals()
             messages.success(request, f"Отзыв #{review_id} удалён.")
             return redirect(go_back)
         else:
@@ -701,11 +680,7 @@ def delete_review(request: HttpRequest) -> HttpResponse:
             return redirect(go_back)
 
         # 2) Ищем отзыв и автора
-        row = execute_query(
-            "SELECT id, user_id, user_name FROM reviews WHERE id = %s",
-            (rid,),
-            fetch=True
-        )
+        row = execute_query(REVIEW_AUTHOR_SQL, (rid,), fetch=True)
         if not row:
             messages.error(request, "Отзыв не найден.")
             return redirect(go_back)
@@ -721,6 +696,7 @@ def delete_review(request: HttpRequest) -> HttpResponse:
 
         if is_super or can_moderate or (is_author_by_name and is_author_by_id):
             execute_query("DELETE FROM reviews WHERE id = %s", (rid,), fetch=False)
+            invalidate_totals()
             messages.success(request, f"Отзыв #{rid} удалён.")
             return redirect(go_back)
         else:
@@ -734,6 +710,15 @@ def delete_review(request: HttpRequest) -> HttpResponse:
 
 
 
+# Отзывы выбранного рынка, новые сверху
+REVIEWS_PAGE_REVIEWS_SQL = """
+    SELECT id, user_name, rating, review_text
+    FROM reviews
+    WHERE market_id = %s
+    ORDER BY id DESC
+"""
+
+
 def reviews_page(request: HttpRequest) -> HttpResponse:
     """
     Единая страница для работы с отзывами:
@@ -764,26 +749,14 @@ def reviews_page(request: HttpRequest) -> HttpResponse:
 
     # --- Поиск по строке ---
     elif q:
-    # Поиск по строке
-        rows = execute_query(
-            """
-            SELECT m.id, m.name, l.city, l.state, l.zip
-            FROM markets m
-            JOIN locations l ON m.location_id = l.id
-            WHERE m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s OR l.zip::text ILIKE %s
-            ORDER BY m.name
-            LIMIT 20
-            """,
-            (f"%{q}%", f"%{q}%", f"%{q}%", f"%{q}%"),
-            fetch=True
-        )
+    # Поиск по строке: 20 самых подходящих рынков (search.py)
+        rows = search_markets(q, 20, total=count_search(q))
         context["rows"] = rows
         context["q"] = q
 
     else:
         # Если нет ни id, ни q — показываем рынки с пагинацией
-        total_row = execute_query("SELECT COUNT(*) FROM markets", fetch=True)[0]
-        total = int(total_row.get("count") or 0)
+        total = count_total("SELECT COUNT(*) FROM markets")
 
         per_page = _get_int(request, "per", default=10, min_v=5, max_v=100)
         page = _get_int(request, "page", default=1, min_v=1, max_v=10**9)
@@ -834,6 +807,7 @@ def reviews_page(request: HttpRequest) -> HttpResponse:
                     "INSERT INTO reviews (market_id, user_name, rating, review_text) VALUES (%s, %s, %s, %s)",
                     (market_id, user_name, rating, review_text)
                 )
+                invalidate_totals()
                 return redirect(f"{reverse('markets:reviews')}?id={market_id}")
 
         elif action == "delete":
@@ -843,11 +817,7 @@ def reviews_page(request: HttpRequest) -> HttpResponse:
             market_id = request.POST.get("market_id")
 
             # 2) Тянем из БД автора отзыва (и его user_id, если сохранён).
-            review = execute_query(
-                "SELECT id, user_id, user_name FROM reviews WHERE id = %s",
-                (review_id,),
-                fetch=True
-            )
+            review = execute_query(REVIEW_AUTHOR_SQL, (review_id,), fetch=True)
 
             # 3) Если такого отзыва нет — сообщаем об ошибке и остаёмся на странице.
             if not review:
@@ -874,6 +844,7 @@ def reviews_page(request: HttpRequest) -> HttpResponse:
                 if is_super or can_moderate or (is_author_by_name and is_author_by_id):
                     # 8) Удаляем отзыв.
                     execute_query("DELETE FROM reviews WHERE id = %s", (review_id,), fetch=False)
+                    invalidate_totals()
                     # 9) Возвращаемся на эту же страницу выбранного рынка.
                     return redirect(f"{reverse('markets:reviews')}?id={market_id}")
                 else:
@@ -885,16 +856,7 @@ def reviews_page(request: HttpRequest) -> HttpResponse:
     # --- Если рынок выбран, подтягиваем отзывы ---
     if context.get("selected_market"):
         market_id = context["selected_market"]["id"]
-        reviews = execute_query(
-            """
-            SELECT id, user_name, rating, review_text
-            FROM reviews
-            WHERE market_id = %s
-            ORDER BY id DESC
-            """,
-            (market_id,),
-            fetch=True
-        )
+        reviews = execute_query(REVIEWS_PAGE_REVIEWS_SQL, (market_id,), fetch=True)
         context["reviews"] = reviews
 
     return render(request, "reviews.html", context)
@@ -905,6 +867,41 @@ def reviews_page(request: HttpRequest) -> HttpResponse:
 # ===========================================
 # 6) СОРТИРОВКА РЫНКОВ
 # ===========================================
+
+# Общая SELECT-часть. Рейтинг и число отзывов — готовые из market_rating_summary
+# (сортировка по рейтингу идёт по индексу idx_rating_summary_top/low,
+# по городу и штату — по idx_city / idx_state).
+SORT_MARKETS_SQL = """
+    SELECT
+        m.id, m.name,
+        l.city, l.state, l.zip,
+        m.latitude, m.longitude,
+        s.avg_rating, s.review_count
+    FROM markets m
+    JOIN locations l ON m.location_id = l.id
+    JOIN market_rating_summary s ON s.market_id = m.id
+"""
+# Число строк — с теми же JOIN, что у SORT_MARKETS_SQL (иначе число страниц разойдётся со строками)
+SORT_COUNT_SQL = """
+    SELECT COUNT(*)
+    FROM markets m
+    JOIN locations l ON m.location_id = l.id
+    JOIN market_rating_summary s ON s.market_id = m.id
+"""
+
+
+def sort_keys(field: str, sql_dir: str) -> list:
+    """
+    Ключ сортировки (он же ORDER BY) для поля rating/city/state; последним всегда идёт уникальный id.
+    """
+    if field == "city":
+        return [("city", sql_dir), ("id", "ASC")]
+    if field == "state":
+        return [("state", sql_dir), ("id", "ASC")]
+    # по умолчанию рейтинг
+    return [("avg_rating", sql_dir), ("review_count", "DESC"), ("id", "ASC")]
+
+
 def sort_markets(request: HttpRequest) -> HttpResponse:
     """
     Сортировка рынков по выбранному полю и направлению.
@@ -914,49 +911,21 @@ def sort_markets(request: HttpRequest) -> HttpResponse:
 
     # Читаем параметры из GET
     field = (request.GET.get("field") or "rating").strip()
-    direction = (request.GET.get("direction") or "desc").strip().lower()
-
-    per = _get_int(request, "per", default=10, min_v=5, max_v=100)
-    page = _get_int(request, "page", default=1, min_v=1, max_v=10**9)
-
-    # Общая SELECT-часть
-    base_select = """
-        SELECT
-            m.id, m.name,
-            l.city, l.state, l.zip,
-            m.latitude, m.longitude,
-            COALESCE((SELECT AVG(r.rating) FROM reviews r WHERE r.market_id = m.id), 0) AS avg_rating,
-            (SELECT COUNT(r2.id) FROM reviews r2 WHERE r2.market_id = m.id) AS review_count
-        FROM markets m
-        JOIN locations l ON m.location_id = l.id
-    """
-
-    # ORDER BY
-    if field == "city":
-        order_sql = f"ORDER BY l.city {'ASC' if direction=='asc' else 'DESC'}, m.id ASC"
-    elif field == "state":
-        order_sql = f"ORDER BY l.state {'ASC' if direction=='asc' else 'DESC'}, m.id ASC"
-    else:
-        # по умолчанию рейтинг
-        order_sql = f"ORDER BY avg_rating {'ASC' if direction=='asc' else 'DESC'}, review_count DESC, m.id ASC"
+    if field not in ("rating", "city", "state"):
+        field = "rating"
+    direction = "asc" if (request.GET.get("direction") or "desc").strip().lower() == "asc" else "desc"
+    sql_dir = direction.upper()
+    keys = sort_keys(field, sql_dir)
 
     # total
-    count_sql = "SELECT COUNT(*) FROM markets m JOIN locations l ON m.location_id = l.id"
-    total = execute_query(count_sql, fetch=True)[0]["count"]
-
-    pages = max(1, ceil(max(0, total) / max(1, per)))
-    page = min(page, pages)
-    offset = (page - 1) * per
-
-    sql = f"""
-        {base_select}
-        {order_sql}
-        LIMIT %s OFFSET %s
-    """
-    rows = execute_query(sql, (per, offset), fetch=True) if total > 0 else []
+    total = count_total(SORT_COUNT_SQL)
 
-    # Пагинация через универсальный хелпер
-    pagination = build_pagination_context(request, total, default_per=10)
+    # Keyset-пагинация: «Вперёд/Назад» продолжают от ключа крайней строки
+    rows, pagination = keyset_paginate(
+        request, total, keys, SORT_MARKETS_SQL, (),
+        lambda sql, params, kind: execute_query(sql, params, fetch=True),
+        scope=f"sort|{field}|{direction}",
+    )
 
     # Собираем строку sort для шаблона (например rating_desc, city_asc и т.п.)
     sort = f"{field}_{direction}"
@@ -966,6 +935,10 @@ def sort_markets(request: HttpRequest) -> HttpResponse:
         "field": field,
         "direction": direction,
         "sort": sort,
+        # Параметры сортировки для ссылок пагинации и формы «на странице»
+        "extra_query": "&" + urlencode({"field": field, "direction": direction}),
+        "hidden_fields": (f'<input type="hidden" name="field" value="{field}">'
+                          f'<input type="hidden" name="direction" value="{direction}">'),
     }
     ctx.update(pagination)
     return render(request, "sort.html", ctx)
@@ -1032,14 +1005,29 @@ def search_by_radius(request: HttpRequest) -> HttpResponse:
         )
     """
 
+    # Ячейки geohash вокруг точки — несколько диапазонов по индексу idx_markets_geohash;
+    # прямоугольник дополнительно отсекает углы ячеек, формула расстояния
+    # считается только для оставшихся рынков
+    geo_sql, geo_params = geohash_condition(lat0, lon0, radius)
+    bbox_sql, bbox_params = bbox_condition(lat0, lon0, radius)
+    bbox_sql, bbox_params = f"{geo_sql} AND {bbox_sql}", geo_params + bbox_params
+
+    # Быстрый путь: гео-индекс в памяти сразу даёт все id в радиусе с расстояниями
+    # (None — индекс выключен/недоступен, тогда считаем в базе, как раньше)
+    hits = radius_hits(lat0, lon0, radius)
+
     # 5) Считаем total (сколько рынков попадает в радиус)
     total_sql = f"""
         SELECT COUNT(*)
         FROM markets m
         WHERE m.latitude IS NOT NULL AND m.longitude IS NOT NULL
+          AND {bbox_sql}
           AND {distance_expr} <= %s
     """
-    total = execute_query(total_sql, (radius,), fetch=True)[0]["count"]
+    if hits is not None:
+        total = len(hits)
+    else:
+        total = execute_query(total_sql, bbox_params + (radius,), fetch=True)[0]["count"]
 
     # 6) Пагинация
     pages = max(1, ceil(max(0, total) / max(1, per)))
@@ -1056,11 +1044,17 @@ def search_by_radius(request: HttpRequest) -> HttpResponse:
         FROM markets m
         JOIN locations l ON l.id = m.location_id
         WHERE m.latitude IS NOT NULL AND m.longitude IS NOT NULL
+          AND {bbox_sql}
           AND {distance_expr} <= %s
         ORDER BY distance_miles ASC, m.id ASC
         LIMIT %s OFFSET %s
     """
-    rows = execute_query(rows_sql, (radius, per, offset), fetch=True) if total > 0 else []
+    if hits is not None:
+        rows = load_hit_rows(hits[offset:offset + per])
+        for r in rows:
+            r["distance_miles"] = r["distance"]
+    else:
+        rows = execute_query(rows_sql, bbox_params + (radius, per, offset), fetch=True) if total > 0 else []
     
     # Окно номеров страниц вокруг текущей (±2)
     win = 2
@@ -1084,6 +1078,88 @@ def search_by_radius(request: HttpRequest) -> HttpResponse:
     })
 
 
+# ===========================================
+# 7а) K БЛИЖАЙШИХ РЫНКОВ (k-NN)
+# ===========================================
+
+# Сколько ближайших рынков можно запросить за раз (страница и JSON)
+KNN_DEFAULT_K = 10
+KNN_MAX_K = 100
+
+
+def _nearest_rows(request: HttpRequest):
+    """
+    Общая часть страницы и JSON-эндпоинта: читаем lat/lon/k и ищем k ближайших рынков.
+    Возвращает (coords, k, rows); coords = None, если координаты некорректны.
+    """
+    coords = validate_coordinates(request.GET.get("lat", ""), request.GET.get("lon", ""))
+    k = _get_int(request, "k", KNN_DEFAULT_K, 1, KNN_MAX_K)
+    if not coords:
+        return None, k, []
+    lat0, lon0 = coords
+    # Индекс в памяти, а без него — SQL «кольцами» (см. geo_index.nearest_markets)
+    return coords, k, nearest_markets(lat0, lon0, k)
+
+
+def nearest_page(request: HttpRequest) -> HttpResponse:
+    """
+    Страница «Ближайшие рынки»: вместо радиуса задаём k и получаем k ближайших
+    к точке рынков с расстояниями (по возрастанию).
+    """
+    lat_input = request.GET.get("lat", "")
+    lon_input = request.GET.get("lon", "")
+    coords, k, rows = _nearest_rows(request)
+
+    error = ""
+    if (lat_input or lon_input) and not coords:
+        error = "Некорректные координаты: широта -90..90, долгота -180..180."
+
+    return render(request, "nearest.html", {
+        "rows": rows,
+        "lat": lat_input,
+        "lon": lon_input,
+        "k": k,
+        "k_options": [5, 10, 20, 50, 100],
+        "error": error,
+    })
+
+
+def nearest_api(request: HttpRequest) -> JsonResponse:
+    """
+    JSON-версия: GET /api/nearest/?lat=44&lon=-72&k=10
+    -> {"lat": 44.0, "lon": -72.0, "k": 10, "count": 10, "results": [{id, name, city, state, zip,
+        latitude, longitude, distance_miles}, ...]}
+    При некорректных координатах — 400 и {"error": "..."}.
+    """
+    coords, k, rows = _nearest_rows(request)
+    if not coords:
+        return JsonResponse(
+            {"error": "lat/lon обязательны: широта -90..90, долгота -180..180"}, status=400
+        )
+
+    results = [
+        {
+            "id": r["id"],
+            "name": r["name"],
+            "city": r["city"],
+            "state": r["state"],
+            "zip": r["zip"],
+            # Decimal из numeric-колонок -> float, чтобы JSON был числовым
+            "latitude": float(r["latitude"]) if r["latitude"] is not None else None,
+            "longitude": float(r["longitude"]) if r["longitude"] is not None else None,
+            "distance_miles": round(float(r["distance"]), 3),
+        }
+        for r in rows
+    ]
+    return JsonResponse({
+        "lat": coords[0],
+        "lon": coords[1],
+        "k": k,
+        "count": len(results),
+        "results": results,
+    })
+
+
 # ===========================================
 # 8) УДАЛЕНИЕ РЫНКОВ
 # ===========================================
@@ -1117,35 +1193,33 @@ def delete_market(request: HttpRequest) -> HttpResponse:
                 execute_query("DELETE FROM reviews WHERE market_id = %s", (market_id,), fetch=False)
                 execute_query("DELETE FROM market_categories WHERE market_id = %s", (market_id,), fetch=False)
                 execute_query("DELETE FROM markets WHERE id = %s", (market_id,), fetch=False)
+                market_deleted(market_id)  # убираем рынок и из гео-индекса
+                invalidate_totals()  # и забываем запомненные числа рынков
                 ctx["success_direct"] = f"Рынок #{market_id} и связанные данные удалены."
 
     # --- B) Поиск и пагинация ---
+    # С запросом — поиск по релевантности (search.py), без него — все рынки по id
     q = (request.GET.get("q") or "").strip()
-    where, params = "", []
     if q:
-        where = "WHERE (m.name ILIKE %s OR l.city ILIKE %s OR l.state ILIKE %s)"
-        params = [f"%{q}%", f"%{q}%", f"%{q}%"]
-
-    total = execute_query(
-        f"SELECT COUNT(*) FROM markets m JOIN locations l ON l.id = m.location_id {where}",
-        tuple(params),
-        fetch=True
-    )[0]["count"]
+        total = count_search(q)
+    else:
+        total = count_total("SELECT COUNT(*) FROM markets m JOIN locations l ON l.id = m.location_id")
 
     pagination = build_pagination_context(request, total, default_per=10)
 
     rows = []
-    if total > 0:
+    if total > 0 and q:
+        rows = search_markets(q, pagination["per"], pagination["offset"], total=total)
+    elif total > 0:
         rows = execute_query(
-            f"""
+            """
             SELECT m.id, m.name, l.city, l.state, l.zip
             FROM markets m
             JOIN locations l ON l.id = m.location_id
-            {where}
             ORDER BY m.id
             LIMIT %s OFFSET %s
             """,
-            tuple(params) + (pagination["per"], pagination["offset"]),
+            (pagination["per"], pagination["offset"]),
             fetch=True
         )
 
@@ -1172,6 +1246,8 @@ def delete_market(request: HttpRequest) -> HttpResponse:
             execute_query("DELETE FROM reviews WHERE market_id = %s", (rid,), fetch=False)
             execute_query("DELETE FROM market_categories WHERE market_id = %s", (rid,), fetch=False)
             execute_query("DELETE FROM markets WHERE id = %s", (rid,), fetch=False)
+            market_deleted(rid)  # убираем рынок и из гео-индекса
+            invalidate_totals()
             return redirect(f"{reverse('markets:delete_market')}?q={q}&page={pagination['page']}&per={pagination['per']}")
 
     return render(request, "delete_market.html", ctx)
@@ -1181,23 +1257,50 @@ def delete_market(request: HttpRequest) -> HttpResponse:
 # 9) Рынки по категориям
 # ---------------------------
 
+# {where} — условие по markets.flags_mask (и market_categories для категорий без бита) из flags_condition()
+BY_CATEGORY_COUNT_SQL = """
+    SELECT COUNT(*)
+    FROM markets m
+    WHERE {where}
+"""
+BY_CATEGORY_SQL = """
+    SELECT m.id, m.name, l.city, l.state
+    FROM markets m
+    JOIN locations l ON l.id = m.location_id
+    WHERE {where}
+"""
+BY_CATEGORY_KEYS = [("name", "ASC"), ("id", "ASC")]
+
+
 def markets_by_category(request: HttpRequest) -> HttpResponse:
     """
     Полный аналог Streamlit-функции render_markets_by_category:
-    1) Загружаем все категории (id, name), сортируем по алфавиту.
+    1) Загружаем все категории (id, name, bit_no), сортируем по алфавиту,
+       и способы оплаты (payment_types).
     2) Текстовый фильтр по именам категорий (локально).
-    3) Выбор категории (по category_id) через GET.
-    4) Считаем COUNT рынков по выбранной категории.
+    3) Выбор одной или нескольких категорий и способов оплаты через GET
+       (?category_id=..&category_id=..&payment=..) и режима:
+       mode=all — рынок должен иметь все выбранные флаги, mode=any — любой из них.
+    4) Собираем из выбранного битовую маску и фильтруем одним условием
+       по markets.flags_mask (без JOIN на каждую категорию), считаем COUNT.
     5) Берём страницу (LIMIT/OFFSET) и рендерим таблицу.
     """
-    # 1) Загружаем категории из БД
-    categories = execute_query(
+    # 1) Загружаем категории и способы оплаты из БД
+    categories = execute_prepared(
+        "category_list",
         """
-        SELECT id, name
+        SELECT id, name, bit_no
         FROM categories
         ORDER BY name
         """,
-        fetch=True
+    ) or []
+    payment_types = execute_prepared(
+        "payment_type_list",
+        """
+        SELECT id, name, bit_no
+        FROM payment_types
+        ORDER BY bit_no
+        """,
     ) or []
 
     # 2) Текстовый фильтр по GET ?q=
@@ -1212,8 +1315,11 @@ def markets_by_category(request: HttpRequest) -> HttpResponse:
         return render(request, "by_category.html", {
             "categories": [],
             "categories_filtered": [],
+            "payment_types": payment_types,
             "q": q,
-            "selected_id": 0,
+            "selected_ids": [],
+            "selected_payments": [],
+            "mode": "all",
             "total": 0,
             "rows": [],
             "per": 10,
@@ -1224,76 +1330,91 @@ def markets_by_category(request: HttpRequest) -> HttpResponse:
             "prev_page": 1,
             "next_page": 1,
             "per_options": [5, 10, 15, 20, 50, 100],
+            "extra_query": "",
         })
 
-    # 3) Читаем параметры category_id, per, page
-    def _get_int_from_get(name: str, default: int, lo: int, hi: int) -> int:
-        raw = request.GET.get(name)
-        try:
-            v = int(raw)
-        except (TypeError, ValueError):
-            v = default
-        return max(lo, min(v, hi))
-
-    selected_id = _get_int_from_get(
-        "category_id",
-        default=(categories_filtered[0]["id"] if categories_filtered else 0),
-        lo=0,
-        hi=10**9,
+    # 3) Читаем параметры category_id (может быть несколько), payment, mode
+    #    (per, page и cursor читает keyset_paginate)
+    def _get_ids_from_get(name: str) -> list:
+        ids = []
+        for raw in request.GET.getlist(name):
+            if raw.isdigit() and int(raw) not in ids:
+                ids.append(int(raw))
+        return ids
+
+    selected_ids = _get_ids_from_get("category_id")
+    selected_payments = _get_ids_from_get("payment")
+    # По умолчанию (первый заход) — первая категория из списка, как раньше
+    if not selected_ids and not selected_payments and categories_filtered:
+        selected_ids = [categories_filtered[0]["id"]]
+
+    mode = "any" if request.GET.get("mode") == "any" else "all"
+
+    # 4) Битовая маска из выбранных категорий и способов оплаты.
+    #    Категории без бита (в маску помещается 48) проверяются по market_categories.
+    mask = build_flags_mask(
+        [c["bit_no"] for c in categories if c["id"] in selected_ids]
+        + [pt["bit_no"] for pt in payment_types if pt["id"] in selected_payments]
     )
-    per = _get_int_from_get("per", default=10, lo=5, hi=100)
-    page = _get_int_from_get("page", default=1, lo=1, hi=10**9)
+    no_bit_ids = [c["id"] for c in categories if c["id"] in selected_ids and c["bit_no"] is None]
+    # Текст условия зависит от того, есть ли маска и категории без бита — у каждого варианта свой PREPARE
+    variant = "" if not no_bit_ids else ("_links" if mask else "_links_only")
 
     total = 0
     rows = []
 
-    if selected_id > 0:
-        # 4) COUNT(*) рынков по категории
-        total = execute_query(
-            """
-            SELECT COUNT(*)
-            FROM markets m
-            JOIN market_categories mc ON mc.market_id = m.id
-            WHERE mc.category_id = %s
-            """,
-            (selected_id,),
-            fetch=True
-        )[0]["count"]
+    if mask or no_bit_ids:
+        where_sql, where_params = flags_condition(mask, match_all=(mode == "all"), category_ids=no_bit_ids)
 
-        # 5) LIMIT/OFFSET
-        p = _paginate(total, per, page)
-        rows = execute_query(
-            """
-            SELECT m.id, m.name, l.city, l.state
-            FROM markets m
-            JOIN market_categories mc ON mc.market_id = m.id
-            JOIN locations l ON l.id = m.location_id
-            WHERE mc.category_id = %s
-            ORDER BY m.name
-            LIMIT %s OFFSET %s
-            """,
-            (selected_id, p["per_page"], p["offset"]),
-            fetch=True
-        ) or []
+        # COUNT(*) рынков по маске (запоминается до изменения рынков — см. totals.py)
+        total = count_total(BY_CATEGORY_COUNT_SQL.format(where=where_sql), where_params)
+
+        # 5) Keyset-пагинация по (name, id)
+        rows, p = keyset_paginate(
+            request, total, BY_CATEGORY_KEYS, BY_CATEGORY_SQL.format(where=where_sql), where_params,
+            lambda sql, params, kind: execute_prepared(f"by_category_page_{mode}{variant}_{kind}", sql, params),
+            scope=f"by_category|{mode}|{mask}|{no_bit_ids}",
+        )
     else:
-        p = _paginate(0, per, page)
+        rows, p = keyset_paginate(request, 0, [("id", "ASC")], "", (), lambda *args: [])
+
+    # Параметры фильтра для ссылок пагинации
+    extra_query = "&" + urlencode(
+        {"q": q, "category_id": selected_ids, "payment": selected_payments, "mode": mode},
+        doseq=True,
+    )
+    # Те же параметры скрытыми полями — для форм «на странице» и «перейти на страницу»
+    hidden_fields = "".join(
+        f'<input type="hidden" name="{name}" value="{escape(value)}">'
+        for name, value in [("q", q), ("mode", mode)]
+        + [("category_id", i) for i in selected_ids]
+        + [("payment", i) for i in selected_payments]
+    )
 
     # финальный render
     return render(request, "by_category.html", {
         "categories": categories,
         "categories_filtered": categories_filtered,
+        "payment_types": payment_types,
         "q": q,
-        "selected_id": selected_id,
+        "selected_ids": selected_ids,
+        "selected_payments": selected_payments,
+        "mode": mode,
         "rows": rows,
         "total": total,
-        "per": p["per_page"],
+        "approximate": p["approximate"],
+        "per": p["per"],
         "page": p["page"],
         "pages": p["pages"],
         "has_prev": p["has_prev"],
         "has_next": p["has_next"],
         "prev_page": p["prev_page"],
         "next_page": p["next_page"],
+        "prev_cursor": p["prev_cursor"],
+        "next_cursor": p["next_cursor"],
         "per_options": [5, 10, 15, 20, 50, 100],
+        "extra_query": extra_query,
+        "hidden_fields": hidden_fields,
     })
 
 